@@ -7,10 +7,13 @@ If run as a main program, it takes the path to an OSM file as input, identifies
 tag elements containing city names, and prints out those that additions.
 """
 
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 
+import audit_engine
+import cleaning_rules
+import osm_reader
+
 RE_CITY_WITH_ADDON = re.compile("^Ostseebad|^Insel|[^ a-zäöüßA-ZÄÖÜ-]")
 
 
@@ -26,23 +29,27 @@ def audit_cityname(funny, cityname):
         funny[cityname] += 1
 
 
-def audit(osmpath):
-    osm = open(osmpath, "r", encoding='utf-8')
-    cities = defaultdict(int)
-    for event, elem in ET.iterparse(osm, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_cityname(tag):
-                    audit_cityname(cities, tag.attrib['v'])
-    osm.close()
-    return cities
+def report(cities):
+    for city, count in cities.items():
+        print(city, count)
+
+
+AUDITOR = audit_engine.Auditor("addr_city", lambda: defaultdict(int),
+                               lambda key: key == "addr:city",
+                               lambda cities, key, value: audit_cityname(cities, value),
+                               report)
+
+
+def audit(osmpath, parser="etree"):
+    return audit_engine.run(osmpath, [AUDITOR], parser=parser)[AUDITOR.name]
 
 
 def update_cityname(cityname):
     """Update the tag value with cleaned city name: 
     - slash, spaces before, everything behind removed.
-    - leading 'Ostseebad' or 'Insel' plus space removed"""
-    return re.sub("^Ostseebad *|^Insel *| */.*$", "", cityname)
+    - leading 'Ostseebad' or 'Insel' plus space removed
+    These are the addr:city rules of cleaning_rules.RULES."""
+    return cleaning_rules.RULE_SET.clean("addr:city", cityname)
 
 
 if __name__ == "__main__":
@@ -50,9 +57,10 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Audit addr:city names. Prints funny results to stdout.')
     parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
     args = parser.parse_args()
 
-    cities = audit(args.osmpath) # dict {str: int}
-    for city, count in cities.items():
-        print(city, count)
+    cities = audit(args.osmpath, args.parser) # dict {str: int}
+    report(cities)
 
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Single pass audit engine.
+
+Every audit module registers an Auditor: a predicate deciding which <tag> elements
+it is interested in, and an accumulator collecting them into its result. The engine
+parses the OSM file once, with bounded memory (osm_reader.py), and dispatches each
+tag to the interested auditors, so running all audits costs one parse instead of
+one per module.
+
+If run as a main program, it takes the path to an OSM file as input, runs all
+registered auditors (or a selection) and prints a combined report to stdout.
+With --cleaned, tag values are cleaned (as in prepare_csv) before they are
+audited, to show what is left after cleaning. With --parser expat, the file is
+parsed by fastparse.py instead of ElementTree. PBF files are read by pbf.py.
+"""
+import importlib
+
+import osm_reader
+import pbf
+
+# modules providing an AUDITOR, in report order
+AUDIT_MODULES = ["count_elements", "tags", "addr_city", "postcode",
+                 "street_abbrev", "street_housenum", "street_type"]
+
+# top level elements that may carry <tag> children
+TOP_LEVEL = ("node", "way", "relation")
+
+
+class Auditor(object):
+    """Audit plugin.
+
+    - name: key of the result in the combined report
+    - factory: callable returning an empty result, e.g. lambda: defaultdict(int)
+    - predicate: called with the tag key (or element name, for level "element");
+      return True if the auditor is interested
+    - accumulate: called as accumulate(result, key, value) for tags, or
+      accumulate(result, name) for elements
+    - report: optional, called as report(result) to print the result
+    - parents: top level elements whose tags are audited. None means all.
+    - level: "tag" to receive <tag> elements, "element" to receive every element
+    """
+
+    def __init__(self, name, factory, predicate, accumulate, report=None,
+                 parents=("node", "way"), level="tag"):
+        self.name = name
+        self.factory = factory
+        self.predicate = predicate
+        self.accumulate = accumulate
+        self.report = report
+        self.parents = parents
+        self.level = level
+
+    def wants_parent(self, parent):
+        return self.parents is None or parent in self.parents
+
+
+def run(osmpath, auditors, cleaner=None, parser="etree"):
+    """Parse the OSM file once and feed all auditors. Return dict {name: result}.
+    If cleaner (a clean_cache.CleaningCache) is given, auditors get cleaned values.
+    parser is "etree" (ElementTree elements) or "expat" (fastparse records)."""
+    results = {a.name: a.factory() for a in auditors}
+    element_auditors = [a for a in auditors if a.level == "element"]
+    # tag auditors grouped by the parent element they listen to
+    tag_auditors = {parent: [a for a in auditors if a.level == "tag" and a.wants_parent(parent)]
+                    for parent in TOP_LEVEL + (None,)}
+    elements = osm_reader.iter_elements(osmpath, tags=None, parser=parser)
+    if parser == "expat" or pbf.is_pbf(osmpath):
+        run_records(elements, results, element_auditors, tag_auditors, cleaner)
+    else:
+        run_elements(elements, results, element_auditors, tag_auditors, cleaner)
+    return results
+
+
+def run_elements(elements, results, element_auditors, tag_auditors, cleaner=None):
+    """Feed the auditors from complete ElementTree elements."""
+    for element in elements:
+        for elem in element.iter():
+            for a in element_auditors:
+                if a.predicate(elem.tag):
+                    a.accumulate(results[a.name], elem.tag)
+        auditors = tag_auditors[element.tag if element.tag in TOP_LEVEL else None]
+        if not auditors:
+            continue
+        for tag in element.iterfind("tag"):
+            k = tag.attrib["k"]
+            v = tag.attrib["v"]
+            if cleaner is not None:
+                v = cleaner.clean(k, v)
+            for a in auditors:
+                if a.predicate(k):
+                    a.accumulate(results[a.name], k, v)
+
+
+def run_records(records, results, element_auditors, tag_auditors, cleaner=None):
+    """Feed the auditors from fastparse records, like run_elements."""
+    for record in records:
+        if element_auditors:
+            for name, n in ((record.tag, 1), ("tag", len(record.tags)), ("nd", len(record.nds)),
+                            ("member", len(record.members))):
+                for a in element_auditors:
+                    if n and a.predicate(name):
+                        for _ in range(n):
+                            a.accumulate(results[a.name], name)
+        auditors = tag_auditors[record.tag if record.tag in TOP_LEVEL else None]
+        if not auditors:
+            continue
+        for k, v in record.tags:
+            if cleaner is not None:
+                v = cleaner.clean(k, v)
+            for a in auditors:
+                if a.predicate(k):
+                    a.accumulate(results[a.name], k, v)
+
+
+def load_auditors(names=AUDIT_MODULES):
+    """Import the audit modules and return their auditors."""
+    return [importlib.import_module(name).AUDITOR for name in names]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run all audits in a single pass. Prints a combined report to stdout.')
+    parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--only', type=str, nargs='+', choices=AUDIT_MODULES, default=AUDIT_MODULES,
+                        help='Run only the selected audits')
+    parser.add_argument('--cleaned', action='store_true', help='Audit tag values after cleaning')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
+    args = parser.parse_args()
+
+    auditors = load_auditors(args.only)
+    cleaner = None
+    if args.cleaned:
+        import clean_cache
+        cleaner = clean_cache.CleaningCache()
+    results = run(args.osmpath, auditors, cleaner, args.parser)
+    for a in auditors:
+        print("\n===== %s =====" % a.name)
+        a.report(results[a.name])
+    if cleaner is not None:
+        print("\n" + cleaner.format_stats())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the pipeline stages on synthetic OSM files.
+
+For every size, a file is generated with synth_osm.py, and these stages are timed:
+- audit.<module>: every auditor alone, and audit.all: all of them in one pass
+- prepare_csv and prepare_csv.validate: process_map without and with validation
+- load_database and load_database.bulk: the row by row and the bulk load
+- query.<name>: every query of workload.sql, on the loaded database
+
+Each stage is run --repeat times and the best time counts. The results are
+written to a JSON file, together with the Python and SQLite versions and the git
+commit, so that runs can be compared with "compare".
+
+If run as a main program, it runs the benchmark ("run"), or prints the ratios
+of the stage times of two result files ("compare").
+"""
+import contextlib
+import io
+import json
+import os.path
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+import audit_engine
+import clean_cache
+import index_advisor
+import load_database
+import prepare_csv
+import synth_osm
+
+# default sizes: (nodes, ways)
+SIZES = [(10000, 1500), (100000, 15000)]
+
+
+def parse_size(text):
+    """Parse '100000x15000' into (100000, 15000)."""
+    n_nodes, n_ways = text.lower().split("x")
+    return int(n_nodes), int(n_ways)
+
+
+def best_time(func, repeat=1, setup=None):
+    """Return the best run time of func() in s. setup() is called before every run, untimed."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset_cleaning_cache():
+    # every run starts with an empty cache, like a new process
+    prepare_csv.CLEANING_CACHE = clean_cache.CleaningCache()
+
+
+def remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def benchmark_size(workdir, n_nodes, n_ways, repeat=1, tags_per_element=3, dirty=0.2, seed=0):
+    """Generate a file of the given size in workdir and time all stages. Return the
+    result dict of the size."""
+    osmpath = os.path.join(workdir, "synth_%i_%i.osm" % (n_nodes, n_ways))
+    t0 = time.perf_counter()
+    synth_osm.generate(osmpath, n_nodes, n_ways, n_relations=n_ways // 100, tags_per_element=tags_per_element,
+                       dirty=dirty, seed=seed)
+    result = {"nodes": n_nodes, "ways": n_ways, "tags_per_element": tags_per_element, "dirty": dirty,
+              "seed": seed, "file_bytes": os.path.getsize(osmpath),
+              "generate_seconds": time.perf_counter() - t0}
+    timings = result["timings"] = {}
+
+    auditors = audit_engine.load_auditors()
+    for auditor in auditors:
+        timings["audit." + auditor.name] = best_time(lambda: audit_engine.run(osmpath, [auditor]), repeat)
+    timings["audit.all"] = best_time(lambda: audit_engine.run(osmpath, auditors), repeat)
+
+    timings["prepare_csv"] = best_time(lambda: prepare_csv.process_map(osmpath, validate=False), repeat,
+                                       reset_cleaning_cache)
+    timings["prepare_csv.validate"] = best_time(lambda: prepare_csv.process_map(osmpath, validate=True), repeat,
+                                                reset_cleaning_cache)
+
+    dbfile = "synth_%i_%i.db" % (n_nodes, n_ways)
+    dbpath = os.path.join(workdir, dbfile)
+    for name, bulk in [("load_database", False), ("load_database.bulk", True)]:
+        timings[name] = best_time(lambda: load_database.load(workdir, dbfile, bulk=bulk), repeat,
+                                  lambda: remove(dbpath))
+
+    setup, queries = index_advisor.read_workload()
+    conn = sqlite3.connect(dbpath)
+    for statement in setup:
+        conn.execute(statement)
+    for query, seconds in zip(queries, index_advisor.time_queries(conn, queries, repeat)):
+        timings["query." + query.name] = seconds
+    conn.close()
+    return result
+
+
+def run(sizes=SIZES, workdir=None, repeat=1, tags_per_element=3, dirty=0.2, seed=0, log=print):
+    """Benchmark all sizes. Return the result dict."""
+    results = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+               "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+               "platform": platform.platform(), "repeat": repeat, "sizes": []}
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        for n_nodes, n_ways in sizes:
+            log("benchmarking %i nodes, %i ways ..." % (n_nodes, n_ways))
+            # the stages print progress and reports, which would drown the results
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = benchmark_size(workdir, n_nodes, n_ways, repeat, tags_per_element, dirty, seed)
+            results["sizes"].append(result)
+            for stage, seconds in result["timings"].items():
+                log("  %-45s %9.4f s" % (stage, seconds))
+    return results
+
+
+def compare(old, new):
+    """Return [(size, stage, old s, new s)] of the stages and sizes in both results."""
+    rows = []
+    old_sizes = {(r["nodes"], r["ways"]): r["timings"] for r in old["sizes"]}
+    for result in new["sizes"]:
+        size = (result["nodes"], result["ways"])
+        if size not in old_sizes:
+            continue
+        for stage, seconds in result["timings"].items():
+            if stage in old_sizes[size]:
+                rows.append((size, stage, old_sizes[size][stage], seconds))
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic OSM files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('run', help='run the benchmark')
+    p.add_argument('--sizes', type=parse_size, nargs='+', default=SIZES, metavar='NODESxWAYS',
+                   help='sizes of the synthetic files, e.g. 100000x15000')
+    p.add_argument('--out', type=str, default='benchmark.json', help='JSON file for the results')
+    p.add_argument('--workdir', type=str, help='directory for the generated files (default: temporary)')
+    p.add_argument('--repeat', type=int, default=1, help='runs per stage, the best one counts')
+    p.add_argument('--tags', type=int, default=3, help='mean number of tags per tagged element')
+    p.add_argument('--dirty', type=float, default=0.2, help='share of dirty street, city and postcode values')
+    p.add_argument('--seed', type=int, default=0, help='random seed')
+    p = subparsers.add_parser('compare', help='compare two result files')
+    p.add_argument('old', type=str, help='JSON file of the baseline run')
+    p.add_argument('new', type=str, help='JSON file of the new run')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.sizes, args.workdir, args.repeat, args.tags, args.dirty, args.seed)
+        with open(args.out, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, indent=2)
+        print("results written to %s" % args.out)
+    else:
+        with open(args.old, encoding="utf-8") as fp:
+            old = json.load(fp)
+        with open(args.new, encoding="utf-8") as fp:
+            new = json.load(fp)
+        for (n_nodes, n_ways), stage, t_old, t_new in compare(old, new):
+            print("%8ix%-7i %-45s %9.4f s %9.4f s   %6.2fx"
+                  % (n_nodes, n_ways, stage, t_old, t_new, t_old / t_new if t_new > 0 else float("inf")))
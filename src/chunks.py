@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Split an OSM XML file into byte ranges aligned to top level elements.
+
+In XML a literal '<' only appears at the start of markup, so every occurrence of
+'<node', '<way' or '<relation' (followed by a space, '/' or '>') is the start of a
+top level element. A range can therefore be parsed on its own, after wrapping it
+into an <osm> root element, without parsing anything before it. The same way,
+iter_raw_elements yields the raw bytes of every top level element.
+
+If run as a main program, it prints the byte ranges for the given number of chunks.
+"""
+import os
+import re
+
+import compressed
+
+# start of a top level element, or the closing root tag
+RE_BOUNDARY = re.compile(rb"<(?:node|way|relation)[\s/>]|</osm>")
+# start of a top level element, with its name, or the closing root tag
+RE_ELEMENT = re.compile(rb"<(node|way|relation)[\s/>]|</osm>")
+
+BLOCK_SIZE = 1 << 20
+OVERLAP = 16  # longer than any boundary match
+
+CHUNK_SIZE = 32 << 20  # default maximum size of a chunk in bytes
+
+
+def find_boundary(fp, offset):
+    """Return the offset of the first top level element (or '</osm>') at or after
+    offset. Return the file size if there is none."""
+    fp.seek(offset)
+    pos = offset
+    tail = b""
+    while True:
+        block = fp.read(BLOCK_SIZE)
+        if not block:
+            return pos
+        data = tail + block
+        m = RE_BOUNDARY.search(data)
+        if m:
+            return pos - len(tail) + m.start()
+        tail = data[-OVERLAP:]
+        pos += len(block)
+
+
+def data_range(fp):
+    """Return (start, end): from the first top level element to the closing root tag."""
+    start = find_boundary(fp, 0)
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    # the closing root tag is at the very end, only look at the last bytes
+    fp.seek(max(start, size - BLOCK_SIZE))
+    tail_start = fp.tell()
+    tail = fp.read()
+    i = tail.rfind(b"</osm>")
+    end = tail_start + i if i >= 0 else size
+    return start, end
+
+
+def split(osmpath, n_chunks=None, chunk_size=CHUNK_SIZE):
+    """Return a list of (start, end) byte ranges covering all top level elements.
+
+    The file is split into n_chunks ranges of about equal size, but into more if a
+    range would be larger than chunk_size."""
+    with open(osmpath, "rb") as fp:
+        start, end = data_range(fp)
+        size = end - start
+        n = max(n_chunks or 1, -(-size // chunk_size), 1)
+        offsets = [start]
+        for i in range(1, n):
+            offset = find_boundary(fp, start + size * i // n)
+            if offsets[-1] < offset < end:
+                offsets.append(offset)
+        offsets.append(end)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def iter_raw_elements(osmpath, block_size=BLOCK_SIZE):
+    """Yield (name, offset, data) of the top level elements, without parsing them:
+    data are the raw bytes from the start of the element to the start of the next
+    one (or to the closing root tag), including the whitespace after it. The file
+    is read as a stream, so it may be compressed; offsets are uncompressed."""
+    with compressed.open_osm(osmpath) as fp:
+        pos = 0  # offset of data[0]
+        data = b""
+        name, i = None, 0  # current element and its start in data
+        while True:
+            block = fp.read(block_size)
+            data += block
+            for m in RE_ELEMENT.finditer(data, i + 1 if name else 0):
+                if name:
+                    yield name, pos + i, data[i:m.start()]
+                if m.group(1) is None:
+                    return
+                name, i = m.group(1).decode(), m.start()
+            if not block:
+                if name:
+                    yield name, pos + i, data[i:]
+                return
+            # the current element may continue in the next block
+            cut = i if name else max(0, len(data) - OVERLAP)
+            pos += cut
+            data = data[cut:]
+            i -= cut
+
+
+def read_chunk(osmpath, start, end):
+    """Return the byte range as a standalone XML document."""
+    with open(osmpath, "rb") as fp:
+        fp.seek(start)
+        data = fp.read(end - start)
+    return b"<osm>" + data + b"</osm>"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Print byte ranges of chunks aligned to top level elements.')
+    parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('n', type=int, help='Number of chunks')
+    args = parser.parse_args()
+
+    for start, end in split(args.osmpath, args.n):
+        print(start, end)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memoizing layer for the cleaning functions.
+
+Tag values repeat a lot (a city has thousands of addresses), so the cleaned value
+of every (tag key, raw value) pair is kept in a bounded LRU cache. Hits, misses
+and evictions are counted, so the hit rate can be reported at the end of a run.
+
+CleaningCache is used by prepare_csv.process_kv, and by audit_engine.py --cleaned
+to audit the values as they would end up in the database.
+"""
+from collections import Counter, OrderedDict
+
+import cleaning_rules
+
+# tag key -> cleaning function
+CLEANERS = cleaning_rules.RULE_SET.cleaners()
+
+CACHE_SIZE = 100000  # maximum number of cached values
+
+
+class LRUCache(object):
+    """Bounded mapping, evicting the least recently used entry when full."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.stats = Counter(hits=0, misses=0, evictions=0)
+
+    def get(self, key, func, *args):
+        """Return the cached value for key. On a miss, store and return func(*args)."""
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.stats["misses"] += 1
+            value = self.data[key] = func(*args)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.stats["evictions"] += 1
+            return value
+        self.stats["hits"] += 1
+        self.data.move_to_end(key)
+        return value
+
+    def lookup(self, key, default=None):
+        """Return the cached value for key, or default. Counts a hit or a miss."""
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.stats["misses"] += 1
+            return default
+        self.stats["hits"] += 1
+        self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self.data)
+
+
+class CleaningCache(object):
+    """Clean tag values with the cleaner registered for their key, memoized."""
+
+    def __init__(self, cleaners=CLEANERS, maxsize=CACHE_SIZE):
+        self.cleaners = cleaners
+        self.cache = LRUCache(maxsize)
+
+    def clean(self, key, value):
+        """Return the cleaned value. Values of keys without cleaner are returned unchanged."""
+        cleaner = self.cleaners.get(key)
+        if cleaner is None:
+            return value
+        return self.cache.get((key, value), cleaner, value)
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def format_stats(self):
+        stats = self.stats
+        lookups = stats["hits"] + stats["misses"]
+        rate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+        return "cleaning cache: %i hits, %i misses, %i evictions, %.1f%% hit rate" % (
+            stats["hits"], stats["misses"], stats["evictions"], rate)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Declarative cleaning rules for tag values.
+
+All cleaning rules are declared in RULES as (tag key, pattern, replacement). The
+rules of a key are compiled into one regex, an alternation of one named group per
+rule, and a value is cleaned with a single re.sub call: at every position the
+first matching rule wins, and its replacement is looked up by the name of the
+matching group. Adding a rule therefore adds no extra pass over the value.
+
+Because all rules see the original value in the same scan, a rule must not rely
+on the result of another one. E.g. the abbreviation rules for addr:street accept
+a trailing house number after 'Str.', since that house number is removed in the
+same scan. Patterns must not contain capturing groups, use (?:...) instead, and
+replacements are literal strings.
+
+RULES is the only definition of the cleaning: the update functions of
+street_abbrev.py, street_housenum.py and addr_city.py delegate to RULE_SET, and
+their audits detect the patterns of the rules.
+
+If run as a main program, it cleans the given values and prints the result.
+"""
+import re
+from collections import OrderedDict
+
+# trailing house numbers: latin numbers and roman literals (I, V and X only)
+HOUSENUM = r"\s+(?:\d+|[IVX]+)\s*$"
+# end of a street name, possibly followed by a house number
+STREET_END = r"(?=(?:\s+(?:\d+|[IVX]+))?\s*$)"
+
+RULES = [
+    # addr:city: leading 'Ostseebad' or 'Insel' plus space, slash with spaces before and everything behind
+    ("addr:city", r"^Ostseebad *", ""),
+    ("addr:city", r"^Insel *", ""),
+    ("addr:city", r" */.*$", ""),
+    # addr:street: trailing house numbers
+    ("addr:street", HOUSENUM, ""),
+    # addr:street: common abbreviations and incorrect typing
+    ("addr:street", r"Str\." + STREET_END, "Straße"),
+    ("addr:street", r"str\." + STREET_END, "straße"),
+    ("addr:street", r"Strasse", "Straße"),
+    ("addr:street", r"strasse", "straße"),
+]
+
+
+class RuleSet(object):
+    """Rules compiled per key into a single regex and a replacement dispatch."""
+
+    def __init__(self, rules=RULES):
+        by_key = OrderedDict()
+        for key, pattern, replacement in rules:
+            if re.compile(pattern).groups:
+                raise ValueError("capturing group in rule for %s: %s" % (key, pattern))
+            by_key.setdefault(key, []).append((pattern, replacement))
+        self.compiled = {key: self.compile_rules(key_rules) for key, key_rules in by_key.items()}
+
+    @staticmethod
+    def compile_rules(key_rules):
+        """Return (regex, replacement function) for the rules of one key."""
+        replacements = {}
+        alternatives = []
+        for i, (pattern, replacement) in enumerate(key_rules):
+            name = "r%i" % i
+            replacements[name] = replacement
+            alternatives.append("(?P<%s>%s)" % (name, pattern))
+        regex = re.compile("|".join(alternatives))
+
+        def replace(m):
+            return replacements[m.lastgroup]
+
+        return regex, replace
+
+    def clean(self, key, value):
+        """Return the cleaned value. Values of keys without rules are returned unchanged."""
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            return value
+        regex, replace = compiled
+        return regex.sub(replace, value)
+
+    def cleaners(self):
+        """Return dict {key: function(value) -> cleaned value}, e.g. for clean_cache."""
+        cleaners = {}
+        for key, (regex, replace) in self.compiled.items():
+            cleaners[key] = lambda value, regex=regex, replace=replace: regex.sub(replace, value)
+        return cleaners
+
+
+RULE_SET = RuleSet()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Clean tag values with the declared rules.')
+    parser.add_argument('key', type=str, help='tag key, e.g. addr:street')
+    parser.add_argument('values', type=str, nargs='+', help='values to clean')
+    args = parser.parse_args()
+
+    for value in args.values:
+        print("%s -> %s" % (value, RULE_SET.clean(args.key, value)))
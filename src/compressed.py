@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read compressed OSM files (.osm.gz, .osm.bz2) directly, without decompressing
+them to disk first.
+
+The compression is recognized by the magic bytes of the file. gzip files are
+read with the gzip module. bz2 files made of several streams (as written by
+pbzip2, or by compress_bz2 here) are decompressed in parallel: groups of
+streams are decompressed by worker processes, and the decompressed data are
+read in file order, with a bounded number of groups in flight. Files of a
+single stream are read with the bz2 module.
+
+open_osm is used by all readers of OSM files: osm_reader.py (and so the audits,
+prepare_csv.py and stream_load.py), chunks.iter_raw_elements (sampling.py) and
+update_database.py.
+
+If run as a main program, it writes compressed copies of an OSM file
+("compress"), or compares parsing them directly with decompressing them to disk
+and parsing the decompressed file ("benchmark").
+"""
+import bz2
+import gzip
+import io
+import multiprocessing
+import os
+import re
+import shutil
+from collections import deque
+
+# start of a bz2 stream: header and magic number of the first block
+RE_BZ2_STREAM = re.compile(rb"BZh[1-9]1AY&SY")
+
+BLOCK_SIZE = 1 << 20
+GROUP_SIZE = 1 << 20  # compressed bytes decompressed by a worker at once
+STREAM_SIZE = 900 * 1000  # uncompressed bytes per stream written by compress_bz2
+
+
+def compression(path):
+    """Return "gz", "bz2" or None, from the first bytes of the file."""
+    with open(path, "rb") as fp:
+        magic = fp.read(3)
+    if magic[:2] == b"\x1f\x8b":
+        return "gz"
+    if magic == b"BZh":
+        return "bz2"
+    return None
+
+
+def bz2_streams(path):
+    """Return the offsets of the streams of a bz2 file."""
+    offsets = []
+    with open(path, "rb") as fp:
+        pos = 0
+        tail = b""
+        while True:
+            block = fp.read(BLOCK_SIZE)
+            if not block:
+                return offsets
+            data = tail + block
+            offsets.extend(pos - len(tail) + m.start() for m in RE_BZ2_STREAM.finditer(data))
+            # keep less than a match, so that no match is found twice
+            tail = data[-9:]
+            pos += len(block)
+
+
+def stream_groups(path, group_size=GROUP_SIZE):
+    """Return the (start, end) byte ranges of groups of consecutive bz2 streams of
+    about group_size bytes."""
+    offsets = bz2_streams(path)
+    if not offsets:
+        return []
+    offsets.append(os.path.getsize(path))
+    ranges = []
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= group_size or offset == offsets[-1]:
+            ranges.append((start, offset))
+            start = offset
+    return ranges
+
+
+def decompress_range(task):
+    """Worker: return the decompressed data of the bz2 streams in a byte range."""
+    path, start, end = task
+    with open(path, "rb") as fp:
+        fp.seek(start)
+        return bz2.decompress(fp.read(end - start))
+
+
+class ParallelBz2Reader(io.RawIOBase):
+    """Raw binary stream of a multi stream bz2 file, decompressed by a process pool."""
+
+    def __init__(self, path, groups, workers):
+        super().__init__()
+        self.path = path
+        self.groups = deque(groups)
+        self.max_pending = 2 * workers
+        self.pending = deque()
+        self.buffer = memoryview(b"")
+        self.offset = 0
+        self.pool = multiprocessing.Pool(workers)
+        self.submit()
+
+    def submit(self):
+        while self.groups and len(self.pending) < self.max_pending:
+            start, end = self.groups.popleft()
+            self.pending.append(self.pool.apply_async(decompress_range, ((self.path, start, end),)))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset >= len(self.buffer):
+            if not self.pending:
+                return 0
+            self.buffer = memoryview(self.pending.popleft().get())
+            self.offset = 0
+            self.submit()
+        n = min(len(b), len(self.buffer) - self.offset)
+        b[:n] = self.buffer[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        super().close()
+
+
+def open_osm(path, workers=None):
+    """Open an OSM file, compressed or not, for reading bytes. Multi stream bz2
+    files are decompressed by workers processes (default: one per CPU)."""
+    kind = compression(path)
+    if kind == "gz":
+        return gzip.open(path, "rb")
+    if kind == "bz2":
+        if workers is None:
+            workers = os.cpu_count() or 1
+        # worker processes, e.g. of prepare_csv --workers, cannot start a pool
+        if workers > 1 and not multiprocessing.current_process().daemon:
+            groups = stream_groups(path)
+            if len(groups) > 1:
+                return io.BufferedReader(ParallelBz2Reader(path, groups, workers), BLOCK_SIZE)
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def is_compressed(path):
+    return compression(path) is not None
+
+
+# ================================================== #
+#               Compression                          #
+# ================================================== #
+def compress_bz2(path_in, path_out, stream_size=STREAM_SIZE, level=9):
+    """Write path_in as a bz2 file of one stream per stream_size bytes, like pbzip2."""
+    with open(path_in, "rb") as fp_in, open(path_out, "wb") as fp_out:
+        while True:
+            data = fp_in.read(stream_size)
+            if not data:
+                break
+            fp_out.write(bz2.compress(data, level))
+
+
+def compress_gz(path_in, path_out, level=6):
+    with open(path_in, "rb") as fp_in, gzip.open(path_out, "wb", compresslevel=level) as fp_out:
+        shutil.copyfileobj(fp_in, fp_out, BLOCK_SIZE)
+
+
+def decompress(path_in, path_out, workers=None):
+    with open_osm(path_in, workers) as fp_in, open(path_out, "wb") as fp_out:
+        shutil.copyfileobj(fp_in, fp_out, BLOCK_SIZE)
+
+
+def benchmark(osmpath, workdir, workers=None, parser="etree", repeat=1, log=print):
+    """Time parsing the .bz2 and .gz copies of osmpath directly (with 1 and with
+    workers decompression processes), and decompressing them to disk first.
+    Return {stage: best time in s}."""
+    import benchmark as bench
+    import osm_reader
+
+    def parse(path, workers=None):
+        with open_osm(path, workers) as fp:
+            for _ in osm_reader.iter_elements(fp, None, parser):
+                pass
+
+    def decompress_parse(path):
+        plain = os.path.join(workdir, "decompressed.osm")
+        decompress(path, plain, workers)
+        parse(plain)
+        os.remove(plain)
+
+    workers = workers or os.cpu_count() or 1
+    bz2_path = os.path.join(workdir, os.path.basename(osmpath) + ".bz2")
+    gz_path = os.path.join(workdir, os.path.basename(osmpath) + ".gz")
+    compress_bz2(osmpath, bz2_path)
+    compress_gz(osmpath, gz_path)
+    log("%s: %i bytes, bz2 %i bytes in %i streams, gz %i bytes"
+        % (osmpath, os.path.getsize(osmpath), os.path.getsize(bz2_path), len(bz2_streams(bz2_path)),
+           os.path.getsize(gz_path)))
+    timings = {}
+    stages = [("plain", lambda: parse(osmpath)),
+              ("bz2.decompress_then_parse", lambda: decompress_parse(bz2_path)),
+              ("bz2.stream", lambda: parse(bz2_path, 1)),
+              ("bz2.stream.%i_workers" % workers, lambda: parse(bz2_path, workers)),
+              ("gz.decompress_then_parse", lambda: decompress_parse(gz_path)),
+              ("gz.stream", lambda: parse(gz_path))]
+    for stage, func in stages:
+        timings[stage] = bench.best_time(func, repeat)
+        log("  %-35s %8.3f s" % (stage, timings[stage]))
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    import osm_reader
+
+    parser = argparse.ArgumentParser(description='Compress OSM files, or benchmark reading compressed OSM files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('compress', help='write a multi stream .bz2 and a .gz copy next to the file')
+    p.add_argument('osmpath', type=str, help='Path to OSM file')
+    p.add_argument('--stream-size', type=int, default=STREAM_SIZE, help='uncompressed bytes per bz2 stream')
+    p = subparsers.add_parser('benchmark', help='compare direct parsing with decompress then parse')
+    p.add_argument('osmpath', type=str, help='Path to (uncompressed) OSM file')
+    p.add_argument('--workers', type=int, help='decompression processes (default: one per CPU)')
+    p.add_argument('--parser', choices=osm_reader.PARSERS, default="etree", help='XML parser backend')
+    p.add_argument('--repeat', type=int, default=1, help='runs per stage, the best one counts')
+    args = parser.parse_args()
+
+    if args.command == 'compress':
+        compress_bz2(args.osmpath, args.osmpath + ".bz2", args.stream_size)
+        compress_gz(args.osmpath, args.osmpath + ".gz")
+    else:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(args.osmpath))) as workdir:
+            benchmark(args.osmpath, workdir, args.workers, args.parser, args.repeat)
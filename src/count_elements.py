@@ -1,19 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
 import pprint
 from collections import defaultdict
 
+import audit_engine
 
-def count_tags(filename):
-    tag_counts = defaultdict(int)
-    for event, elem in ET.iterparse(filename, events=('end',)):
-        tag_counts[elem.tag] += 1
-    return tag_counts
+
+def count_element(tag_counts, name):
+    tag_counts[name] += 1
+
+
+def report(tag_counts):
+    pprint.pprint(dict(tag_counts))
+
+
+# counts every element, not only <tag>
+AUDITOR = audit_engine.Auditor("count_elements", lambda: defaultdict(int),
+                               lambda name: True,
+                               count_element,
+                               report,
+                               parents=None, level="element")
+
+
+def count_tags(filename, parser="etree"):
+    return audit_engine.run(filename, [AUDITOR], parser=parser)[AUDITOR.name]
         
 
 if __name__ == "__main__":
     #filename = "sample.osm"
     filename = "full/ruegen_20200416.osm"
     tags = count_tags(filename)
-    pprint.pprint(dict(tags))
+    report(tags)
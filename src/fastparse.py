@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fast OSM XML parser backend, without element trees.
+
+ElementTree builds an Element with an attribute dict for every <tag> and <nd>,
+and shape_element copies them into more dicts. Here an expat parser is fed the
+file in blocks, and its callbacks collect every top level element directly
+into a compact Element record:
+
+- tag: 'node', 'way', 'relation' (or 'bounds', ...)
+- attrib: dict of the attributes of the element
+- tags: list of (key, value) of its <tag> children, keys interned
+- nds: list of the node ids (strings) of its <nd> children
+- members: list of (type, ref, role) of its <member> children
+
+Only start tags are handled. A record is complete when the start tag of the
+next top level element arrives, or the document ends; it is yielded after the
+block of the file containing that start tag has been parsed. Nothing else is
+kept, so memory use does not grow with the file. Attribute names are interned
+by expat. <tag>, <nd> and <member> children before the first top level element
+belong to no record, they are ignored.
+
+If run as a main program, it compares the parse time with ElementTree.
+"""
+import sys
+import xml.parsers.expat as expat
+from xml.sax.saxutils import quoteattr
+
+BLOCK_SIZE = 1 << 16  # bytes fed to expat at once
+
+TOP_LEVEL = ("node", "way", "relation")
+
+
+class Element(object):
+    """Top level element of an OSM file, with its children as lists."""
+    __slots__ = ("tag", "attrib", "tags", "nds", "members")
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.tags = []
+        self.nds = []
+        self.members = []
+
+    def __repr__(self):
+        return "<Element %s %s>" % (self.tag, self.attrib.get("id", ""))
+
+    def __reduce__(self):
+        # pickled as a tuple of the fields, faster than the default for __slots__
+        return make_element, (self.tag, self.attrib, self.tags, self.nds, self.members)
+
+
+def make_element(tag, attrib, tags, nds, members):
+    element = Element(tag, attrib)
+    element.tags = tags
+    element.nds = nds
+    element.members = members
+    return element
+
+
+def iter_elements(source, tags=TOP_LEVEL, block_size=BLOCK_SIZE):
+    """Yield the Element records of the top level elements named in tags. If tags
+    is None, yield all top level elements, preceded by the root element (without
+    children). source is a path or a binary file object."""
+    records = []
+    intern = sys.intern
+    root = None
+    current = None
+
+    def ignore(child):
+        pass
+
+    # children before the first top level element are ignored
+    add_tag = add_nd = add_member = ignore
+
+    # Only start tags are handled, end tags are not needed: the children of an
+    # element are the <tag>, <nd> and <member> elements following its start tag,
+    # and an element is complete when the next top level element starts. This
+    # saves a Python call per element.
+    def start(name, attrs):
+        nonlocal root, current, add_tag, add_nd, add_member
+        if name == "tag":
+            add_tag((intern(attrs["k"]), attrs["v"]))
+        elif name == "nd":
+            add_nd(attrs["ref"])
+        elif name == "member":
+            add_member((attrs["type"], attrs["ref"], attrs.get("role", "")))
+        elif root is None:
+            root = name
+            if tags is None:
+                records.append(Element(name, attrs))
+        else:
+            if current is not None and (tags is None or current.tag in tags):
+                records.append(current)
+            current = Element(name, attrs)
+            add_tag = current.tags.append
+            add_nd = current.nds.append
+            add_member = current.members.append
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    fp = open(source, "rb") if isinstance(source, str) else source
+    try:
+        while True:
+            data = fp.read(block_size)
+            parser.Parse(data, not data)
+            if not data and current is not None and (tags is None or current.tag in tags):
+                records.append(current)
+            if records:
+                yield from records
+                records.clear()
+            if not data:
+                break
+    finally:
+        if fp is not source:
+            fp.close()
+
+
+def from_etree(elem):
+    """Return the Element record of an ElementTree element, e.g. to keep or pickle it."""
+    element = Element(elem.tag, dict(elem.attrib))
+    for child in elem:
+        if child.tag == "tag":
+            element.tags.append((sys.intern(child.attrib["k"]), child.attrib["v"]))
+        elif child.tag == "nd":
+            element.nds.append(child.attrib["ref"])
+        elif child.tag == "member":
+            element.members.append((child.attrib["type"], child.attrib["ref"], child.attrib.get("role", "")))
+    return element
+
+
+def to_xml(element, indent="  "):
+    """Serialize an Element record as OSM XML (bytes)."""
+    attributes = "".join(" %s=%s" % (name, quoteattr(value)) for name, value in element.attrib.items())
+    children = ["%s<nd ref=%s/>\n" % (indent * 2, quoteattr(ref)) for ref in element.nds]
+    children += ["%s<member type=%s ref=%s role=%s/>\n" % (indent * 2, quoteattr(typ), quoteattr(ref), quoteattr(role))
+                 for typ, ref, role in element.members]
+    children += ["%s<tag k=%s v=%s/>\n" % (indent * 2, quoteattr(k), quoteattr(v)) for k, v in element.tags]
+    if not children:
+        return ("%s<%s%s/>\n" % (indent, element.tag, attributes)).encode("utf-8")
+    return ("%s<%s%s>\n%s%s</%s>\n" % (indent, element.tag, attributes, "".join(children), indent,
+                                       element.tag)).encode("utf-8")
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import prepare_csv
+
+    parser = argparse.ArgumentParser(description='Compare the parse time of fastparse and ElementTree.')
+    parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    args = parser.parse_args()
+
+    for name, elements in [("ElementTree", prepare_csv.get_element(args.osmpath, tags=TOP_LEVEL)),
+                           ("fastparse", iter_elements(args.osmpath))]:
+        t0 = time.perf_counter()
+        n = sum(1 for _ in elements)
+        dt = time.perf_counter() - t0
+        print("%-12s %i elements, %.2f s, %.0f elements/s" % (name, n, dt, n / dt))
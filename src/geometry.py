@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Geometry of the ways: bounding box, centroid and length, in the table ways_geometry.
+
+ways_nodes only holds the node ids of a way, so its geometry needs the node
+coordinates. Instead of joining ways_nodes to nodes in SQL, the coordinates are
+streamed once, in id order, into a node store on disk: a sorted int64 id array,
+and the lat/lon as int32 in units of 1e-7 degrees (the precision of OSM, as in
+PBF files), 16 bytes per node. The files are memory mapped, so the operating
+system keeps in memory what fits, and the store works for extracts whose nodes
+do not fit into RAM.
+
+The way nodes are then read in way order, in chunks of whole ways, and resolved
+with vectorized binary searches (numpy.searchsorted) in the store. Per way:
+- bbox: min/max of lat and lon of its nodes
+- length: sum of the great circle distances between consecutive nodes, in m
+- centroid: mean of the segment midpoints, weighted by segment length (the mean
+  of the nodes for ways of length 0)
+Nodes missing from the database (or without coordinates) are counted in
+missing, and left out; segments to them are not counted.
+
+Built by load_database.py --geometry; update_database.py refreshes the rows of
+changed ways, and of ways using changed nodes. Needs numpy.
+
+If run as a main program, it builds the table for a database ("build"), or
+compares the bounding boxes with the equivalent SQL join ("benchmark").
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import spatial
+
+COORDINATE_SCALE = 10 ** 7  # int32 units per degree in the node store
+CHUNK_SIZE = 1 << 20  # rows read at once
+
+GEOMETRY_SCHEMA = """
+DROP TABLE IF EXISTS ways_geometry;
+CREATE TABLE ways_geometry (
+    id INTEGER PRIMARY KEY NOT NULL,
+    min_lat REAL,
+    max_lat REAL,
+    min_lon REAL,
+    max_lon REAL,
+    centroid_lat REAL,
+    centroid_lon REAL,
+    length REAL,  -- m
+    nodes INTEGER,  -- nd refs
+    missing INTEGER,  -- nd refs without node coordinates
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+"""
+
+GEOMETRY_INSERT = "INSERT INTO ways_geometry VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
+
+STORE_FILES = [("ids", np.int64), ("lat", np.int32), ("lon", np.int32)]
+
+
+# ================================================== #
+#               Node store                           #
+# ================================================== #
+class NodeStore(object):
+    """Node coordinates by node id: sorted ids, with lat and lon in 1e-7 degrees.
+    The arrays are memory mapped from the files of write_node_store, or given."""
+
+    def __init__(self, ids, lat, lon):
+        self.ids = ids
+        self.lat = lat
+        self.lon = lon
+
+    @classmethod
+    def open(cls, directory):
+        arrays = []
+        for name, dtype in STORE_FILES:
+            path = os.path.join(directory, name + ".bin")
+            # an empty file cannot be memory mapped
+            arrays.append(np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.zeros(0, dtype))
+        return cls(*arrays)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, refs):
+        """Return lat and lon (degrees, 0 where not found) of the node ids refs,
+        and the mask of the ids found."""
+        if not len(self.ids):
+            zeros = np.zeros(len(refs))
+            return zeros, zeros, np.zeros(len(refs), dtype=bool)
+        index = np.searchsorted(self.ids, refs)
+        index[index == len(self.ids)] = 0
+        found = self.ids[index] == refs
+        index = index[found]
+        lat = np.zeros(len(refs))
+        lon = np.zeros(len(refs))
+        lat[found] = self.lat[index] / COORDINATE_SCALE
+        lon[found] = self.lon[index] / COORDINATE_SCALE
+        return lat, lon, found
+
+
+def to_store_arrays(rows):
+    """Return the id, lat and lon arrays of the store of [(id, lat, lon)] rows."""
+    data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return (data[:, 0].astype(np.int64),
+            np.rint(data[:, 1] * COORDINATE_SCALE).astype(np.int32),
+            np.rint(data[:, 2] * COORDINATE_SCALE).astype(np.int32))
+
+
+def write_node_store(cur, directory, chunk_size=CHUNK_SIZE):
+    """Stream the coordinates of the nodes, in id order, into the store files in
+    directory. Return the number of nodes."""
+    cur.execute("SELECT id, lat, lon FROM nodes WHERE lat IS NOT NULL AND lon IS NOT NULL ORDER BY id;")
+    n = 0
+    last_id = None
+    files = [open(os.path.join(directory, name + ".bin"), "wb") for name, _ in STORE_FILES]
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return n
+            arrays = to_store_arrays(rows)
+            ids = arrays[0]
+            if np.any(ids[1:] <= ids[:-1]) or (last_id is not None and ids[0] <= last_id):
+                raise ValueError("node ids are not unique and ascending")
+            last_id = ids[-1]
+            for fp, array in zip(files, arrays):
+                array.tofile(fp)
+            n += len(ids)
+    finally:
+        for fp in files:
+            fp.close()
+
+
+# ================================================== #
+#               Way geometry                         #
+# ================================================== #
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distances in m, of arrays of coordinates (see spatial.haversine)."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2) ** 2
+    return 2 * spatial.EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def iter_way_chunks(cur, where="", params=(), chunk_size=CHUNK_SIZE):
+    """Yield (way ids, node ids) arrays of the way nodes, in way and position
+    order, in chunks of whole ways."""
+    cur.execute("SELECT id, node_id FROM ways_nodes %s ORDER BY id, position;" % where, params)
+    carry = np.zeros((0, 2), dtype=np.int64)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            if len(carry):
+                yield carry[:, 0], carry[:, 1]
+            return
+        data = np.concatenate([carry, np.array(rows, dtype=np.int64).reshape(-1, 2)])
+        # the last way may go on in the next rows
+        cut = np.searchsorted(data[:, 0], data[-1, 0])
+        if cut:
+            yield data[:cut, 0], data[:cut, 1]
+        carry = data[cut:]
+
+
+def way_geometry(way_ids, refs, store):
+    """Return the ways_geometry rows of the ways of (way ids, node ids) arrays, in
+    way order, with the nodes of every way consecutive and in order."""
+    lat, lon, found = store.lookup(refs)
+    first = np.ones(len(way_ids), dtype=bool)
+    first[1:] = way_ids[1:] != way_ids[:-1]
+    group = np.cumsum(first) - 1  # way index of every way node
+    ids = way_ids[first]
+    n_ways = len(ids)
+    n_refs = np.bincount(group, minlength=n_ways)
+    n_found = np.bincount(group[found], minlength=n_ways)
+
+    # bbox over the nodes found
+    g, la, lo = group[found], lat[found], lon[found]
+    bbox = np.full((4, n_ways), np.nan)
+    if len(g):
+        starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+        present = g[starts]
+        bbox[0, present] = np.minimum.reduceat(la, starts)
+        bbox[1, present] = np.maximum.reduceat(la, starts)
+        bbox[2, present] = np.minimum.reduceat(lo, starts)
+        bbox[3, present] = np.maximum.reduceat(lo, starts)
+
+    # segments between consecutive nodes of a way, both found
+    segment = (group[1:] == group[:-1]) & found[1:] & found[:-1]
+    seg_group = group[1:][segment]
+    d = haversine(lat[:-1][segment], lon[:-1][segment], lat[1:][segment], lon[1:][segment])
+    length = np.bincount(seg_group, weights=d, minlength=n_ways)
+    mid_lat = (lat[:-1][segment] + lat[1:][segment]) / 2
+    mid_lon = (lon[:-1][segment] + lon[1:][segment]) / 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid_lat = np.where(length > 0, np.bincount(seg_group, weights=d * mid_lat, minlength=n_ways) / length,
+                                np.bincount(g, weights=la, minlength=n_ways) / n_found)
+        centroid_lon = np.where(length > 0, np.bincount(seg_group, weights=d * mid_lon, minlength=n_ways) / length,
+                                np.bincount(g, weights=lo, minlength=n_ways) / n_found)
+
+    rows = list(zip(ids.tolist(), *(column.tolist() for column in bbox), centroid_lat.tolist(),
+                    centroid_lon.tolist(), length.tolist(), n_refs.tolist(), (n_refs - n_found).tolist()))
+    # no coordinates, no geometry
+    for i in np.flatnonzero(n_found == 0).tolist():
+        rows[i] = rows[i][:1] + (None,) * 6 + rows[i][7:]
+    return rows
+
+
+def has_ways_geometry(cur):
+    cur.execute("select count(*) from sqlite_master where name = 'ways_geometry';")
+    return cur.fetchone()[0] == 1
+
+
+def build_ways_geometry(conn, store_dir=None, chunk_size=CHUNK_SIZE, log=None):
+    """(Re)create and fill ways_geometry. The node store is written to store_dir,
+    and kept, or to a temporary directory next to the database."""
+    cur = conn.cursor()
+    cur.executescript(GEOMETRY_SCHEMA)
+    # the sort of ways_nodes may not fit into memory, let SQLite use temporary files
+    temp_store = cur.execute("PRAGMA temp_store;").fetchone()[0]
+    cur.execute("PRAGMA temp_store = FILE;")
+    try:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(database_path(conn)) or None) as tmpdir:
+            directory = store_dir or tmpdir
+            t0 = time.perf_counter()
+            n_nodes = write_node_store(cur, directory, chunk_size)
+            if log:
+                log("node store: %i nodes, %.1f MB, %.1f s"
+                    % (n_nodes, n_nodes * 16 / 1e6, time.perf_counter() - t0))
+            store = NodeStore.open(directory)
+            t0 = time.perf_counter()
+            n_ways = 0
+            # a second cursor: the first one is still reading the way nodes
+            insert = conn.cursor()
+            for way_ids, refs in iter_way_chunks(cur, chunk_size=chunk_size):
+                rows = way_geometry(way_ids, refs, store)
+                insert.executemany(GEOMETRY_INSERT, rows)
+                n_ways += len(rows)
+            if log:
+                log("ways_geometry: %i ways, %.1f s" % (n_ways, time.perf_counter() - t0))
+            del store
+    finally:
+        cur.execute("PRAGMA temp_store = %i;" % temp_store)
+    conn.commit()
+    return n_ways
+
+
+def database_path(conn):
+    """Return the file of the main database of conn ("" for an in-memory database)."""
+    for _, name, path in conn.execute("PRAGMA database_list;"):
+        if name == "main":
+            return path
+    return ""
+
+
+def refresh_ways_geometry(cur, node_ids, way_ids):
+    """Update ways_geometry for changed nodes and ways, e.g. after update_database.
+    Ways using a changed node get a new geometry, too. The nodes of the ways are
+    looked up in the database, no node store is needed. Does not commit."""
+    if not has_ways_geometry(cur):
+        return
+    node_ids = list(node_ids)
+    way_ids = set(way_ids)
+    for i in range(0, len(node_ids), 500):
+        batch = node_ids[i:i + 500]
+        cur.execute("select distinct id from ways_nodes where node_id in (%s);" % ", ".join("?" * len(batch)), batch)
+        way_ids.update(row[0] for row in cur.fetchall())
+    way_ids = sorted(way_ids)
+    for i in range(0, len(way_ids), 500):
+        batch = way_ids[i:i + 500]
+        marks = ", ".join("?" * len(batch))
+        cur.execute("delete from ways_geometry where id in (%s);" % marks, batch)
+        cur.execute("SELECT id, lat, lon FROM nodes WHERE lat IS NOT NULL AND lon IS NOT NULL AND id IN "
+                    "(SELECT node_id FROM ways_nodes WHERE id IN (%s)) ORDER BY id;" % marks, batch)
+        store = NodeStore(*to_store_arrays(cur.fetchall()))
+        rows = []
+        for chunk_way_ids, refs in iter_way_chunks(cur, "WHERE id IN (%s)" % marks, batch):
+            rows.extend(way_geometry(chunk_way_ids, refs, store))
+        cur.executemany(GEOMETRY_INSERT, rows)
+
+
+# ================================================== #
+#               Benchmark                            #
+# ================================================== #
+BBOX_JOIN = """
+SELECT wn.id, min(n.lat), max(n.lat), min(n.lon), max(n.lon)
+FROM ways_nodes wn
+     JOIN nodes n ON n.id = wn.node_id
+GROUP BY wn.id
+ORDER BY wn.id;
+"""
+
+
+def benchmark(conn, log=print):
+    """Time building ways_geometry against the bounding boxes by SQL join, and
+    check that the boxes agree. Return (build s, join s)."""
+    t0 = time.perf_counter()
+    build_ways_geometry(conn, log=log)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    joined = conn.execute(BBOX_JOIN).fetchall()
+    t_join = time.perf_counter() - t0
+    built = conn.execute("SELECT id, min_lat, max_lat, min_lon, max_lon FROM ways_geometry "
+                         "WHERE min_lat IS NOT NULL ORDER BY id;").fetchall()
+    if len(joined) != len(built) or any(a[0] != b[0] or max(abs(x - y) for x, y in zip(a[1:], b[1:])) > 1e-7
+                                        for a, b in zip(joined, built)):
+        raise AssertionError("ways_geometry and the SQL join give different bounding boxes")
+    log("ways_geometry (bbox, centroid, length) %.2f s, bbox by SQL join %.2f s" % (t_build, t_join))
+    return t_build, t_join
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the ways_geometry table, or benchmark it against a SQL join.')
+    parser.add_argument('command', choices=['build', 'benchmark'])
+    parser.add_argument('dbpath', type=str, help='Path to database file')
+    parser.add_argument('--store', type=str, help='directory for the node store, kept (default: temporary)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows read at once')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.dbpath)
+    if args.command == 'build':
+        t0 = time.perf_counter()
+        build_ways_geometry(conn, args.store, args.chunk_size, log=print)
+        print("ways_geometry built, %.1f s" % (time.perf_counter() - t0))
+    else:
+        benchmark(conn)
+    conn.close()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Index advisor for the query workload.
+
+The workload file (workload.sql) holds the queries of queries.ipynb, each named
+by the comment line before it; other statements, like the TEMP views, are run
+once before. For every query, EXPLAIN QUERY PLAN is captured and these problems
+are flagged:
+- full scan: a table is read completely, without any index
+- nested scan: a table, view or subquery is read completely for every row of an
+  outer loop of a join
+- automatic index: SQLite builds a temporary index, for this query only
+- temp b-tree: rows are sorted for GROUP BY, ORDER BY or DISTINCT
+
+Candidate indexes are the ones of indexes.sql, plus a covering index for every
+automatic index of a plan. They are evaluated "what if": the schema (but no data)
+and the planner statistics of the database are copied into an in-memory
+database, the candidate is created there, and the plans are compared. The
+candidate removing the most problems is picked, until no candidate helps
+anymore; a candidate making the plan of any query worse is never picked. Picked
+indexes made redundant by later ones are dropped again.
+
+If run as a main program, it prints the flagged problems of every query and the
+proposed indexes. With --create, the proposed indexes are created in the
+database, and the run time of every query is reported before and after.
+"""
+import re
+import sqlite3
+import time
+from collections import namedtuple, OrderedDict
+
+import load_database
+
+WORKLOAD = "workload.sql"
+
+Query = namedtuple("Query", ["name", "sql"])
+Candidate = namedtuple("Candidate", ["name", "table", "columns", "sql"])
+
+FULL_SCAN = "full scan"
+NESTED_SCAN = "nested scan"
+AUTOMATIC_INDEX = "automatic index"
+TEMP_BTREE = "temp b-tree"
+# a nested scan is quadratic; a full scan is worse than building an index once per query,
+# which is worse than sorting
+WEIGHTS = {NESTED_SCAN: 10, FULL_SCAN: 3, AUTOMATIC_INDEX: 2, TEMP_BTREE: 1}
+
+RE_COMMENT = re.compile(r"^\s*--\s?(.*?)\s*$")
+RE_QUERY = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+RE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(?: LEFT-JOIN)?$")
+RE_SUBQUERY = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (\w+)")
+RE_AUTOMATIC = re.compile(r"^SEARCH (?:TABLE )?(\w+)(?: AS (\w+))? USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.*)\)")
+RE_TEMP_BTREE = re.compile(r"^USE TEMP B-TREE")
+RE_INDEX_DEF = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)\s*\(([^)]*)\)",
+                          re.IGNORECASE)
+
+
+def read_workload(path=WORKLOAD):
+    """Return (setup statements, [Query]) of a workload file."""
+    setup, queries = [], []
+    with open(path, encoding="utf-8") as fp:
+        statements = load_database.split_statements(fp.read())
+    for statement in statements:
+        name, lines = None, []
+        for line in statement.strip().splitlines():
+            m = RE_COMMENT.match(line)
+            if m is None:
+                lines.append(line)
+            elif not lines:
+                name = m.group(1)
+        sql = "\n".join(lines)
+        if RE_QUERY.match(sql):
+            queries.append(Query(name or " ".join(sql.split())[:60], sql))
+        else:
+            setup.append(sql)
+    return setup, queries
+
+
+# ================================================== #
+#               Query plans                          #
+# ================================================== #
+def explain(conn, sql):
+    """Return the query plan as [(depth, detail)]."""
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append((depth[node_id], detail))
+    return plan
+
+
+def problems(plan):
+    """Return [(problem, detail)] of a query plan."""
+    # scans of materialized views and subqueries are not table scans
+    subqueries = set(m.group(1) for m in (RE_SUBQUERY.match(detail) for _, detail in plan) if m)
+    found = []
+    # depths at which the current query block already has a loop
+    loops = set()
+    for depth, detail in plan:
+        loops = set(d for d in loops if d <= depth)
+        m = RE_SCAN.match(detail)
+        if m and depth in loops:
+            found.append((NESTED_SCAN, detail))
+        elif m and (m.group(2) or m.group(1)) not in subqueries:
+            found.append((FULL_SCAN, detail))
+        elif RE_AUTOMATIC.match(detail):
+            found.append((AUTOMATIC_INDEX, detail))
+        elif RE_TEMP_BTREE.match(detail):
+            found.append((TEMP_BTREE, detail))
+        if m or detail.startswith("SEARCH "):
+            loops.add(depth)
+    return found
+
+
+def plan_cost(plan):
+    return sum(WEIGHTS[problem] for problem, _ in problems(plan))
+
+
+def cost(plans):
+    return sum(plan_cost(plan) for plan in plans)
+
+
+def workload_plans(conn, queries):
+    return [explain(conn, query.sql) for query in queries]
+
+
+# ================================================== #
+#               Candidate indexes                    #
+# ================================================== #
+def make_candidate(table, columns):
+    name = "%s_%s" % (table, "_".join(columns))
+    sql = "CREATE INDEX IF NOT EXISTS %s ON %s (%s);" % (name, table, ", ".join(columns))
+    return Candidate(name, table, tuple(columns), sql)
+
+
+def read_indexes(path=load_database.INDEXES):
+    """Return the Candidates of the CREATE INDEX statements of an SQL file."""
+    candidates = []
+    for statement in load_database.split_statements(load_database.read_schema(path)):
+        m = RE_INDEX_DEF.search(statement)
+        if m:
+            name, table, columns = m.groups()
+            sql = "\n".join(line for line in statement.splitlines() if line.strip() and not RE_COMMENT.match(line))
+            candidates.append(Candidate(name, table, tuple(c.strip() for c in columns.split(",")), sql))
+    return candidates
+
+
+def table_columns(conn):
+    """Return {table: [column]} of the tables of the database."""
+    tables = OrderedDict()
+    for (table,) in conn.execute("select name from sqlite_master where type = 'table' and sql not like 'CREATE VIRTUAL%';"):
+        tables[table] = [row[1] for row in conn.execute("PRAGMA table_info(%s);" % table)]
+    return tables
+
+
+def existing_indexes(conn):
+    """Return {index name: (table, columns)} of the indexes of the database."""
+    indexes = {}
+    for table in table_columns(conn):
+        for row in conn.execute("PRAGMA index_list(%s);" % table):
+            name = row[1]
+            indexes[name] = (table, tuple(r[2] for r in conn.execute("PRAGMA index_info(%s);" % name)))
+    return indexes
+
+
+def resolve_alias(alias, text, tables):
+    """Return the table an alias stands for in the SQL text, or None if it is no table."""
+    if alias in tables:
+        return alias
+    for m in re.finditer(r"\b(\w+)\s+(?:AS\s+)?%s\b" % re.escape(alias), text, re.IGNORECASE):
+        if m.group(1) in tables:
+            return m.group(1)
+    return None
+
+
+def automatic_candidates(plan, text, tables):
+    """Return the Candidates replacing the automatic indexes of a plan: one on the
+    searched columns, and one also covering the other columns used by the query."""
+    candidates = []
+    for _, detail in plan:
+        m = RE_AUTOMATIC.match(detail)
+        if m is None:
+            continue
+        alias = m.group(2) or m.group(1)
+        table = resolve_alias(alias, text, tables)
+        if table is None:
+            continue
+        columns = [c for c in re.findall(r"(\w+)\s*[=<>]", m.group(3)) if c in tables[table]]
+        if not columns:
+            continue
+        covering = list(columns)
+        for c in re.findall(r"\b%s\.(\w+)" % re.escape(alias), text):
+            if c in tables[table] and c not in covering:
+                covering.append(c)
+        if covering != columns:
+            candidates.append(make_candidate(table, covering))
+        candidates.append(make_candidate(table, columns))
+    return candidates
+
+
+def candidate_indexes(conn, setup, queries, plans, index_file=load_database.INDEXES):
+    """Return the candidate indexes not yet in the database: the ones of the index
+    file first, then the ones replacing automatic indexes."""
+    tables = table_columns(conn)
+    existing = existing_indexes(conn)
+    seen = set(existing.values())
+    text = "\n".join(setup)
+    candidates = []
+    automatic = []
+    for query, plan in zip(queries, plans):
+        automatic += automatic_candidates(plan, text + "\n" + query.sql, tables)
+    for candidate in read_indexes(index_file) + automatic:
+        key = (candidate.table, candidate.columns)
+        if candidate.name in existing or key in seen or candidate.table not in tables:
+            continue
+        seen.add(key)
+        candidates.append(candidate)
+    return candidates
+
+
+# ================================================== #
+#               What-if evaluation                   #
+# ================================================== #
+def clone_schema(conn):
+    """Return an in-memory database with the schema and planner statistics of conn, but no data."""
+    # no statement cache: EXPLAIN statements are not prepared again after a schema change
+    clone = sqlite3.connect(":memory:", cached_statements=0)
+    for name, sql in conn.execute("select name, sql from sqlite_master "
+                                  "where sql is not null and name not like 'sqlite_%' order by rowid;"):
+        # shadow tables are created by their virtual table
+        if clone.execute("select count(*) from sqlite_master where name = ?;", (name,)).fetchone()[0] == 0:
+            clone.execute(sql)
+    if conn.execute("select count(*) from sqlite_master where name = 'sqlite_stat1';").fetchone()[0]:
+        clone.execute("ANALYZE;")
+        clone.execute("DELETE FROM sqlite_stat1;")
+        clone.executemany("INSERT INTO sqlite_stat1 VALUES (?, ?, ?);",
+                          conn.execute("select tbl, idx, stat from sqlite_stat1;"))
+        # reload the statistics
+        clone.execute("ANALYZE sqlite_master;")
+    clone.commit()
+    return clone
+
+
+def what_if(clone, queries, candidate):
+    """Return the cost of every query with the candidate index added."""
+    clone.execute(candidate.sql)
+    try:
+        return [plan_cost(plan) for plan in workload_plans(clone, queries)]
+    finally:
+        clone.execute("DROP INDEX %s;" % candidate.name)
+
+
+def advise(conn, setup, queries, index_file=load_database.INDEXES):
+    """Pick indexes for the workload greedily. Return (chosen Candidates, plans before, plans after)."""
+    for statement in setup:
+        conn.execute(statement)
+    before = workload_plans(conn, queries)
+    candidates = candidate_indexes(conn, setup, queries, before, index_file)
+
+    clone = clone_schema(conn)
+    for statement in setup:
+        clone.execute(statement)
+    current = [plan_cost(plan) for plan in before]
+    chosen = []
+    while candidates:
+        best, best_costs = None, current
+        for candidate in candidates:
+            costs = what_if(clone, queries, candidate)
+            if sum(costs) < sum(best_costs) and all(c <= c0 for c, c0 in zip(costs, current)):
+                best, best_costs = candidate, costs
+        if best is None:
+            break
+        clone.execute(best.sql)
+        chosen.append(best)
+        candidates.remove(best)
+        current = best_costs
+
+    # drop indexes not needed anymore
+    for candidate in list(chosen):
+        clone.execute("DROP INDEX %s;" % candidate.name)
+        if all(plan_cost(plan) <= c for plan, c in zip(workload_plans(clone, queries), current)):
+            chosen.remove(candidate)
+        else:
+            clone.execute(candidate.sql)
+    after = workload_plans(clone, queries)
+    clone.close()
+    return chosen, before, after
+
+
+def time_queries(conn, queries, repeat=3):
+    """Return the best of repeat run times of every query, in s."""
+    times = []
+    for query in queries:
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(query.sql).fetchall()
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        times.append(best)
+    return times
+
+
+def print_problems(queries, plans, verbose=False):
+    for query, plan in zip(queries, plans):
+        print("-- %s" % query.name)
+        if verbose:
+            for depth, detail in plan:
+                print("   %s%s" % ("  " * depth, detail))
+        for problem, detail in problems(plan):
+            print("   %-16s %s" % (problem, detail))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Propose indexes for a query workload, and optionally create them.')
+    parser.add_argument('dbpath', type=str, help='Path to database file')
+    parser.add_argument('--workload', type=str, default=WORKLOAD, help='SQL file with the queries')
+    parser.add_argument('--indexes', type=str, default=load_database.INDEXES,
+                        help='SQL file with candidate CREATE INDEX statements')
+    parser.add_argument('--create', action='store_true', help='create the proposed indexes and time the queries')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per query for timing, the best one counts')
+    parser.add_argument('--plans', action='store_true', help='print the complete query plans')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.dbpath)
+    setup, queries = read_workload(args.workload)
+    chosen, before, after = advise(conn, setup, queries, args.indexes)
+
+    print("== query plans, %i problems (cost %i)" % (sum(len(problems(p)) for p in before), cost(before)))
+    print_problems(queries, before, args.plans)
+    print()
+    if not chosen:
+        print("== no index proposed")
+    else:
+        print("== proposed indexes, remaining problems (cost %i)" % cost(after))
+        for candidate in chosen:
+            print(candidate.sql)
+        print()
+        print_problems(queries, after, args.plans)
+
+    if args.create and chosen:
+        print()
+        times_before = time_queries(conn, queries, args.repeat)
+        t0 = time.perf_counter()
+        for candidate in chosen:
+            conn.execute(candidate.sql)
+        conn.commit()
+        print("== indexes created, %.1f s" % (time.perf_counter() - t0))
+        times_after = time_queries(conn, queries, args.repeat)
+        for query, t_before, t_after in zip(queries, times_before, times_after):
+            print("%-40s before %8.4f s   after %8.4f s   speedup %6.1fx"
+                  % (query.name[:40], t_before, t_after, t_before / t_after if t_after > 0 else float("inf")))
+        print("%-40s before %8.4f s   after %8.4f s" % ("total", sum(times_before), sum(times_after)))
+    conn.close()
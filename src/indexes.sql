@@ -0,0 +1,19 @@
+-- Index set for the query workload in workload.sql.
+-- Created after loading with load_database.py --indexes; index_advisor.py
+-- checks which of them the workload actually uses.
+
+-- tag filters: key = ... AND value IN (...), key and type of addr:city, name, population
+CREATE INDEX IF NOT EXISTS nodes_tags_key_value ON nodes_tags (key, value, type, id);
+CREATE INDEX IF NOT EXISTS ways_tags_key_value ON ways_tags (key, value, type, id);
+
+-- tags of the same element, joined by id
+CREATE INDEX IF NOT EXISTS nodes_tags_id ON nodes_tags (id, key, type, value);
+CREATE INDEX IF NOT EXISTS ways_tags_id ON ways_tags (id, key, type, value);
+
+-- edits per user
+CREATE INDEX IF NOT EXISTS nodes_user ON nodes (user);
+CREATE INDEX IF NOT EXISTS ways_user ON ways (user);
+
+-- nodes of a way, and ways of a node
+CREATE INDEX IF NOT EXISTS ways_nodes_id ON ways_nodes (id, position, node_id);
+CREATE INDEX IF NOT EXISTS ways_nodes_node_id ON ways_nodes (node_id, id);
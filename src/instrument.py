@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of pipeline runs: throughput, latency histograms and peak memory.
+
+Within a with block, an Instrumentation replaces the stage functions of
+prepare_csv (parse, shape, process_tag, clean, validate, write) and the csv
+readers of load_database by timed wrappers, and puts the originals back at the
+end. Nothing is wrapped when instrumentation is off, so the normal run costs
+nothing extra.
+
+Stages are nested: shape includes process_tag, which includes clean. For every
+stage the number of calls and items (elements, rows), the time spent in it and a
+histogram of the call times (power of two buckets in microseconds) are kept.
+Counters hold the tags dropped for problem characters and the values changed by
+cleaning. A background thread prints a progress line to stderr every interval
+seconds; report() returns everything, including the peak RSS, as a dict for JSON.
+
+prepare_csv.py and load_database.py use it with --instrument REPORT.json.
+"""
+import csv
+import json
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROGRESS_INTERVAL = 10  # s
+HISTOGRAM_BUCKETS = 32  # bucket i holds call times below 2**i microseconds
+
+
+def peak_rss(who="self"):
+    """Return the peak resident set size in bytes of this process ("self") or of
+    its finished child processes ("children"), or None if unknown."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class Stage(object):
+    """Calls, items, time and call time histogram of one stage."""
+    __slots__ = ("calls", "items", "seconds", "max_seconds", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, seconds, items=1):
+        self.calls += 1
+        self.items += items
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def report(self):
+        histogram = OrderedDict(("<%i" % 2 ** i, n) for i, n in enumerate(self.histogram) if n)
+        return OrderedDict([("calls", self.calls), ("items", self.items), ("seconds", self.seconds),
+                            ("items_per_second", self.items / self.seconds if self.seconds > 0 else None),
+                            ("mean_us", 1e6 * self.seconds / self.calls if self.calls else None),
+                            ("max_us", 1e6 * self.max_seconds),
+                            ("histogram_us", histogram)])
+
+
+class TimedWriter(object):
+    """csv writer proxy timing writerow and writerows."""
+
+    def __init__(self, writer, stage):
+        self.writer = writer
+        self.stage = stage
+
+    def writeheader(self):
+        return self.writer.writeheader()
+
+    def writerow(self, row):
+        t0 = time.perf_counter()
+        result = self.writer.writerow(row)
+        self.stage.add(time.perf_counter() - t0)
+        return result
+
+    def writerows(self, rows):
+        t0 = time.perf_counter()
+        result = self.writer.writerows(rows)
+        self.stage.add(time.perf_counter() - t0, len(rows))
+        return result
+
+
+class CountingCsv(object):
+    """Stands in for the csv module in load_database, counting the rows read."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def counted(self, rows):
+        stage = self.stage
+        t0 = time.perf_counter()
+        for row in rows:
+            t1 = time.perf_counter()
+            stage.add(t1 - t0)
+            yield row
+            t0 = time.perf_counter()
+
+    def reader(self, *args, **kwargs):
+        """csv.reader, not counting the first row: the header line of the csv files."""
+        rows = csv.reader(*args, **kwargs)
+        for header in rows:
+            yield header
+            break
+        yield from self.counted(rows)
+
+    def DictReader(self, *args, **kwargs):
+        stage = self.stage
+
+        class CountingDictReader(csv.DictReader):
+            def __next__(self):
+                t0 = time.perf_counter()
+                row = super().__next__()
+                stage.add(time.perf_counter() - t0)
+                return row
+
+        return CountingDictReader(*args, **kwargs)
+
+
+class Instrumentation(object):
+    """Stage timings and counters of a run. Use as context manager around the run."""
+
+    def __init__(self, interval=PROGRESS_INTERVAL, out=sys.stderr):
+        self.interval = interval
+        self.out = out
+        self.stages = OrderedDict()
+        self.counters = Counter()
+        self.patches = []
+        self.t0 = None
+        self.elapsed = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage()
+        return self.stages[name]
+
+    def timed(self, name, func):
+        """Return func wrapped with a timer of the stage name."""
+        stage = self.stage(name)
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage.add(time.perf_counter() - t0)
+
+        return wrapper
+
+    def timed_iter(self, name, iterable):
+        """Yield from iterable, timing every step as the stage name."""
+        stage = self.stage(name)
+        iterator = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            stage.add(time.perf_counter() - t0)
+            yield item
+
+    def patch(self, obj, attr, value):
+        """Replace obj.attr by value until the end of the with block."""
+        self.patches.append((obj, attr, getattr(obj, attr), attr in vars(obj)))
+        setattr(obj, attr, value)
+
+    def restore(self):
+        while self.patches:
+            obj, attr, old, existed = self.patches.pop()
+            if existed:
+                setattr(obj, attr, old)
+            else:
+                delattr(obj, attr)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        if self.interval and self.out is not None:
+            self.thread = threading.Thread(target=self.print_progress, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.elapsed = time.perf_counter() - self.t0
+        self.restore()
+        if self.out is not None:
+            print(self.progress_line(), file=self.out, flush=True)
+        return False
+
+    def print_progress(self):
+        while not self.stopped.wait(self.interval):
+            print(self.progress_line(), file=self.out, flush=True)
+
+    def progress_line(self):
+        elapsed = time.perf_counter() - self.t0
+        parts = ["[%7.1f s]" % elapsed]
+        for name, stage in list(self.stages.items()):
+            if stage.items:
+                parts.append("%s %i (%.0f/s)" % (name, stage.items, stage.items / elapsed if elapsed > 0 else 0))
+        for name, n in sorted(self.counters.items()):
+            parts.append("%s %i" % (name, n))
+        rss = peak_rss()
+        if rss is not None:
+            parts.append("peak rss %.0f MB" % (rss / 2 ** 20))
+        return "  ".join(parts)
+
+    def report(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.t0
+        return OrderedDict([("elapsed_seconds", elapsed),
+                            ("peak_rss_bytes", peak_rss()),
+                            ("peak_rss_children_bytes", peak_rss("children")),
+                            ("counters", dict(self.counters)),
+                            ("stages", OrderedDict((name, stage.report()) for name, stage in self.stages.items()))])
+
+    def write_report(self, path):
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(self.report(), fp, indent=2)
+
+
+# ================================================== #
+#               Instrumented modules                 #
+# ================================================== #
+def instrument_prepare_csv(instr, prepare_csv=None):
+    """Wrap the stages of the prepare_csv module (pass it if it runs as __main__).
+    Single process only: worker processes are not measured."""
+    if prepare_csv is None:
+        import prepare_csv
+
+    # stages in pipeline order, for the progress lines
+    for name in ("parse", "shape", "process_tag", "clean", "validate", "write"):
+        instr.stage(name)
+    get_elements = prepare_csv.get_elements
+    instr.patch(prepare_csv, "get_elements",
+                lambda *args, **kwargs: instr.timed_iter("parse", get_elements(*args, **kwargs)))
+    instr.patch(prepare_csv, "shape_rows", instr.timed("shape", prepare_csv.shape_rows))
+
+    tag_row = instr.timed("process_tag", prepare_csv.tag_row)
+
+    def counting_tag_row(k, v, element_id):
+        row = tag_row(k, v, element_id)
+        if row is None:
+            instr.counters["dropped_problemchar_tags"] += 1
+        return row
+
+    instr.patch(prepare_csv, "tag_row", counting_tag_row)
+
+    cache = prepare_csv.CLEANING_CACHE
+    clean = instr.timed("clean", cache.clean)
+
+    def counting_clean(key, value):
+        cleaned = clean(key, value)
+        if cleaned != value:
+            instr.counters["cleaned_values"] += 1
+        return cleaned
+
+    instr.patch(cache, "clean", counting_clean)
+    instr.patch(prepare_csv, "validate_element", instr.timed("validate", prepare_csv.validate_element))
+
+    open_writers = prepare_csv.open_writers
+    write = instr.stage("write")
+    instr.patch(prepare_csv, "open_writers",
+                lambda *args, **kwargs: [TimedWriter(w, write) for w in open_writers(*args, **kwargs)])
+
+
+def instrument_load_database(instr, load_database=None):
+    """Count and time the csv rows read by the load_database module (pass it if it
+    runs as __main__), and time every table load."""
+    if load_database is None:
+        import load_database
+
+    instr.patch(load_database, "csv", CountingCsv(instr.stage("read")))
+    for func_name in ("load_table", "bulk_load_table"):
+        func = getattr(load_database, func_name)
+
+        def timed_load(conn_or_cur, table, *args, func=func, **kwargs):
+            read = instr.stage("read")
+            rows_before = read.items
+            t0 = time.perf_counter()
+            try:
+                return func(conn_or_cur, table, *args, **kwargs)
+            finally:
+                instr.stage("load." + table).add(time.perf_counter() - t0, read.items - rows_before)
+
+        instr.patch(load_database, func_name, timed_load)
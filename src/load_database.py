@@ -1,11 +1,77 @@
+"""
+Create the database from osm.sql and fill it with the preprocessed csv files.
+
+With --bulk, the tables are loaded with batched executemany calls over plain tuple
+rows, one transaction per table, under PRAGMAs that only apply to the loader's
+connection (no rollback journal, no fsync, large page cache). CREATE INDEX
+statements of the schema are deferred until all data is in. The resulting
+database has the same schema and content as the row by row load.
+
+With --indexes, the indexes for the query workload in indexes.sql are created
+after loading (see index_advisor.py).
+
+With --normalized, the loaded tables are converted to a dictionary encoded layout:
+users, tag keys and frequent tag values in lookup tables, referred to by integer
+ids, and views with the old table names (see normalize.py).
+
+With --spatial, R*Tree indexes over node coordinates and way bounding boxes are
+built after loading (see spatial.py). With --pivot NAME=KEY,KEY,... a
+materialized wide format tag table is created (see pivot.py). With --geometry,
+the bounding box, centroid and length of every way are computed into the table
+ways_geometry, from a memory mapped node store (see geometry.py, needs numpy).
+
+With --checkpoint, the rows are committed every CHECKPOINT_ROWS rows, together
+with the number of rows of the table committed so far (in the table
+load_checkpoint). If the load is killed, --resume skips the committed rows of
+the csv files and continues; the steps after loading (indexes, spatial index,
+pivot tables, ways_geometry) are run again, they replace what they create. In bulk mode the
+rollback journal is kept, so that a killed load leaves a consistent database.
+The checkpoint table is dropped when the load is done.
+
+With --instrument REPORT.json, rows read and loaded per table are measured
+(see instrument.py).
+"""
 import sqlite3
 import csv
+import contextlib
 import os.path
 import argparse
+import itertools
+import re
+import sys
+import time
+
+import instrument
+import normalize
+import pivot
+import spatial
 
 # table names, and csv file names
 TABLES = ["nodes", "nodes_tags", "ways", "ways_tags", "ways_nodes"]
 SCHEMA = "osm.sql"
+# indexes for the query workload, see index_advisor.py
+INDEXES = "indexes.sql"
+
+# rows per executemany call in bulk mode
+BATCH_SIZE = 50000
+
+# connection scoped settings for bulk loading; none of them is stored in the database file
+BULK_PRAGMAS = ["PRAGMA journal_mode = OFF;",
+                "PRAGMA synchronous = OFF;",
+                "PRAGMA cache_size = -262144;",  # KiB, i.e. 256 MB
+                "PRAGMA temp_store = MEMORY;"]
+
+# with checkpoints, a killed load must leave the last commit intact: keep the
+# rollback journal (synchronous = OFF is safe if only the process dies)
+CHECKPOINT_BULK_PRAGMAS = [pragma for pragma in BULK_PRAGMAS if "journal_mode" not in pragma]
+
+# committed rows per table of a resumable load (--checkpoint, --resume)
+CHECKPOINT_TABLE = "load_checkpoint"
+CHECKPOINT_ROWS = 500000  # rows per commit with checkpoints
+CHECKPOINT_SCHEMA = "CREATE TABLE %s (tablename TEXT PRIMARY KEY, rows INTEGER NOT NULL);\n" % CHECKPOINT_TABLE
+
+RE_CREATE_INDEX = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\b", re.IGNORECASE | re.MULTILINE)
+
 
 def insert_template(tablename, fieldnames):
     """Return an SQL INSERT query template for table tablename with field names fieldnames."""
@@ -14,33 +80,239 @@ def insert_template(tablename, fieldnames):
                                                      ", ".join([":"+field for field in fieldnames]))
 
 
-parser = argparse.ArgumentParser(description='Create database and fill with preprocessed csv files.')
-parser.add_argument('directory', type=str, help='directory where csv files reside')
-parser.add_argument('dbfile', type=str, help='name of database file')
-args = parser.parse_args()
+def positional_insert_template(tablename, fieldnames):
+    """Return an SQL INSERT query template with positional (?) parameters."""
+    return "insert into {} ({}) values ({});".format(tablename,
+                                                     ", ".join(fieldnames),
+                                                     ", ".join(["?"] * len(fieldnames)))
+
+
+def split_statements(sql):
+    """Split an SQL script into complete statements, each with the comments before it."""
+    statements = []
+    statement = ""
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ""
+    return statements
+
+
+def split_schema(sql_schema):
+    """Split an SQL script into (statements without indexes, CREATE INDEX statements)."""
+    tables, indexes = [], []
+    for statement in split_statements(sql_schema):
+        (indexes if RE_CREATE_INDEX.search(statement) else tables).append(statement)
+    return "".join(tables), "".join(indexes)
 
-# create database
-conn = sqlite3.connect(os.path.join(args.directory, args.dbfile))
-cur = conn.cursor()
 
-# read the SQL for table definition
-with open(SCHEMA, encoding="utf-8") as fp:
-    sql_schema = fp.read()    
-cur.executescript(sql_schema)
+def read_schema(path=SCHEMA):
+    """Return the SQL for the table definition"""
+    with open(path, encoding="utf-8") as fp:
+        return fp.read()
 
-for table in TABLES:
-    print("reading %s ...  "%table, end='')
-    csv_path = os.path.join(args.directory, table+".csv")
+
+def load_table(cur, table, csv_path, checkpoint_rows=None, done=0):
+    """Insert the csv file row by row. With checkpoint_rows, commit every
+    checkpoint_rows rows with a checkpoint, after skipping the done rows
+    committed by an interrupted load."""
     with open(csv_path, encoding='utf-8') as fp:
         reader = csv.DictReader(fp)
         template = insert_template(table, reader.fieldnames)
         # insert data
-        for row in reader:
+        n = done
+        for row in itertools.islice(reader, done, None):
             cur.execute(template, row)
-    # info - how many entries were inserted?
-    cur.execute("select count(*) from %s;"%table)
-    print("%i entries" % cur.fetchone()[0])
+            n += 1
+            if checkpoint_rows and n % checkpoint_rows == 0:
+                save_checkpoint(cur, table, n)
+                cur.connection.commit()
+        if checkpoint_rows:
+            save_checkpoint(cur, table, n)
+            cur.connection.commit()
+
+
+def bulk_load_table(conn, table, csv_path, batch_size=BATCH_SIZE, checkpoint_rows=None, done=0):
+    """Insert the csv file in batches, in a single transaction. Return number of rows.
+    With checkpoint_rows, commit about every checkpoint_rows rows with a
+    checkpoint, after skipping the done rows committed by an interrupted load."""
+    n = done
+    committed = done
+    cur = conn.cursor()
+    with open(csv_path, encoding='utf-8', newline='') as fp:
+        reader = csv.reader(fp)
+        template = positional_insert_template(table, next(reader))
+        # skip without building the rows
+        for _ in itertools.islice(reader, done):
+            pass
+        cur.execute("BEGIN;")
+        while True:
+            batch = list(itertools.islice(reader, batch_size))
+            if not batch:
+                break
+            cur.executemany(template, batch)
+            n += len(batch)
+            if checkpoint_rows and n - committed >= checkpoint_rows:
+                save_checkpoint(cur, table, n)
+                conn.commit()
+                committed = n
+                cur.execute("BEGIN;")
+        if checkpoint_rows:
+            save_checkpoint(cur, table, n)
+        conn.commit()
+    return n
+
+
+def save_checkpoint(cur, table, rows):
+    """Record the rows of table committed so far. Does not commit: the checkpoint
+    is committed together with the rows."""
+    cur.execute("insert or replace into %s (tablename, rows) values (?, ?);" % CHECKPOINT_TABLE, (table, rows))
+
+
+def read_checkpoint(cur):
+    """Return {table: committed rows} of an interrupted load, or None if the
+    database has no checkpoint."""
+    cur.execute("select count(*) from sqlite_master where type = 'table' and name = ?;", (CHECKPOINT_TABLE,))
+    if cur.fetchone()[0] == 0:
+        return None
+    cur.execute("select tablename, rows from %s;" % CHECKPOINT_TABLE)
+    return dict(cur.fetchall())
+
+
+def count_rows(cur, table):
+    cur.execute("select count(*) from %s;" % table)
+    return cur.fetchone()[0]
+
+
+def load(directory, dbfile, bulk=False, batch_size=BATCH_SIZE, spatial_index=False, pivots=(), indexes=False,
+         checkpoint=False, resume=False, checkpoint_rows=CHECKPOINT_ROWS, normalized=False,
+         min_value_count=normalize.MIN_VALUE_COUNT, geometry=False):
+    if normalized and indexes:
+        raise ValueError("the indexes of %s are for the plain layout, not the normalized one" % INDEXES)
+    # create database
+    conn = sqlite3.connect(os.path.join(directory, dbfile))
+    cur = conn.cursor()
+
+    done = read_checkpoint(cur) if resume else None
+    checkpoint = checkpoint or resume
+    sql_schema = read_schema()
+    if bulk:
+        for pragma in CHECKPOINT_BULK_PRAGMAS if checkpoint else BULK_PRAGMAS:
+            cur.execute(pragma)
+        sql_schema, sql_indexes = split_schema(sql_schema)
+    if done is None:
+        # a fresh load recreates the tables: the checkpoint of an earlier load is stale
+        sql_schema = "DROP TABLE IF EXISTS %s;\n" % CHECKPOINT_TABLE + sql_schema
+        if checkpoint:
+            # the checkpoint table is created with the tables, in one transaction
+            sql_schema = "BEGIN;\n" + sql_schema + CHECKPOINT_SCHEMA + "COMMIT;\n"
+        cur.executescript(sql_schema)
+        done = {}
+    else:
+        print("resuming: %s" % ", ".join("%s %i rows" % (table, rows) for table, rows in done.items()))
+
+    for table in TABLES:
+        print("reading %s ...  " % table, end='', flush=True)
+        csv_path = os.path.join(directory, table+".csv")
+        if bulk:
+            t0 = time.perf_counter()
+            n = bulk_load_table(conn, table, csv_path, batch_size, checkpoint_rows if checkpoint else None,
+                                done.get(table, 0))
+            dt = time.perf_counter() - t0
+            inserted = n - done.get(table, 0)
+            print("%i entries, %.0f rows/s" % (count_rows(cur, table), inserted / dt if dt > 0 else 0))
+        else:
+            load_table(cur, table, csv_path, checkpoint_rows if checkpoint else None, done.get(table, 0))
+            # info - how many entries were inserted?
+            print("%i entries" % count_rows(cur, table))
+
+    if bulk and sql_indexes:
+        print("creating indexes ...  ", end='', flush=True)
+        t0 = time.perf_counter()
+        cur.executescript(sql_indexes)
+        print("%.1f s" % (time.perf_counter() - t0))
+
+    if normalized:
+        print("normalizing ...  ", end='', flush=True)
+        t0 = time.perf_counter()
+        normalize.normalize(conn, min_value_count)
+        print("%.1f s" % (time.perf_counter() - t0))
+
+    if indexes:
+        print("creating workload indexes ...  ", end='', flush=True)
+        t0 = time.perf_counter()
+        cur.executescript(read_schema(INDEXES))
+        print("%.1f s" % (time.perf_counter() - t0))
+
+    if spatial_index:
+        print("building spatial index ...  ", end='', flush=True)
+        t0 = time.perf_counter()
+        spatial.build_spatial_index(conn)
+        print("%.1f s" % (time.perf_counter() - t0))
+
+    for name, keys in pivots:
+        print("creating pivot table %s ...  " % name, end='', flush=True)
+        t0 = time.perf_counter()
+        pivot.create_pivot(conn, name, keys)
+        print("%.1f s" % (time.perf_counter() - t0))
+
+    if geometry:
+        import geometry as geo  # needs numpy
+        print("building ways_geometry ...  ", end='', flush=True)
+        t0 = time.perf_counter()
+        geo.build_ways_geometry(conn)
+        print("%.1f s" % (time.perf_counter() - t0))
+
+    # done
+    if checkpoint:
+        cur.execute("DROP TABLE IF EXISTS %s;" % CHECKPOINT_TABLE)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create database and fill with preprocessed csv files.')
+    parser.add_argument('directory', type=str, help='directory where csv files reside')
+    parser.add_argument('dbfile', type=str, help='name of database file')
+    parser.add_argument('--bulk', action='store_true',
+                        help='batched inserts, one transaction per table, deferred indexes')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per batch in bulk mode')
+    parser.add_argument('--indexes', action='store_true',
+                        help='create the indexes for the query workload from %s' % INDEXES)
+    parser.add_argument('--normalized', action='store_true',
+                        help='lookup tables for users, tag keys and frequent values, with compatibility views')
+    parser.add_argument('--min-value-count', type=int, default=normalize.MIN_VALUE_COUNT,
+                        help='--normalized: occurrences of a tag value to store it in the lookup table')
+    parser.add_argument('--spatial', action='store_true', help='build R*Tree indexes for nodes and ways')
+    parser.add_argument('--pivot', type=str, action='append', default=[], metavar='NAME=KEY,KEY,...',
+                        help='create a wide format tag table, e.g. resto=amenity,name,cuisine,addr:city')
+    parser.add_argument('--geometry', action='store_true',
+                        help='compute bounding box, centroid and length of the ways into ways_geometry (needs numpy)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='commit every --checkpoint-rows rows with a checkpoint, to be able to --resume')
+    parser.add_argument('--checkpoint-rows', type=int, default=CHECKPOINT_ROWS, help='rows per commit with checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted --checkpoint load of dbfile from its last checkpoint')
+    parser.add_argument('--instrument', type=str, metavar='REPORT.json',
+                        help='measure reading and loading, print progress to stderr and write a JSON report')
+    parser.add_argument('--progress', type=float, default=instrument.PROGRESS_INTERVAL,
+                        help='seconds between progress lines with --instrument')
+    args = parser.parse_args()
+    if args.normalized and args.indexes:
+        parser.error("--indexes creates the indexes of the plain layout, it cannot be combined with --normalized")
 
-# done
-conn.commit()
-conn.close()
\ No newline at end of file
+    pivots = []
+    for spec in args.pivot:
+        name, keys = spec.split("=", 1)
+        pivots.append((name, keys.split(",")))
+    with contextlib.ExitStack() as stack:
+        if args.instrument:
+            instr = stack.enter_context(instrument.Instrumentation(args.progress))
+            instrument.instrument_load_database(instr, sys.modules[__name__])
+        load(args.directory, args.dbfile, bulk=args.bulk, batch_size=args.batch_size, spatial_index=args.spatial,
+             pivots=pivots, indexes=args.indexes, checkpoint=args.checkpoint, resume=args.resume,
+             checkpoint_rows=args.checkpoint_rows, normalized=args.normalized, min_value_count=args.min_value_count,
+             geometry=args.geometry)
+    if args.instrument:
+        instr.write_report(args.instrument)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Normalized, dictionary encoded layout of the database.
+
+The user names, the tag keys (with their type) and the frequent tag values are
+stored once, in the lookup tables users, tag_keys and tag_values, and the rows
+of nodes_data, ways_data, nodes_tags_data and ways_tags_data refer to them by
+integer ids. Tag values occurring less than min_value_count times stay inline,
+in the value column of the tag rows. ways_nodes is unchanged. The tag rows are
+indexed by element id, and the planner statistics are gathered (ANALYZE):
+without them, the joins of the views get slow plans.
+
+Views with the old names (nodes, ways, nodes_tags, ways_tags) join the lookup
+tables back, with the old columns in the old order, so that the queries of
+queries.ipynb, pivot.py and spatial.py work unchanged. INSTEAD OF triggers on
+the views keep update_database.py working: new users, keys and types are added
+to the lookup tables, new values are stored inline.
+
+The layout is created by load_database.py --normalized, which loads the csv
+files as usual and converts the tables with normalize(). Queries on the ids
+(e.g. GROUP BY user_id) avoid the joins of the views; see NATIVE_QUERIES.
+
+If run as a main program, it loads the csv files of a directory into a plain
+and a normalized database, and compares their size and the run times of the
+workload queries (workload.sql).
+"""
+import os
+import sqlite3
+
+MIN_VALUE_COUNT = 2  # occurrences of a tag value to get into tag_values
+
+NORMALIZED_SCHEMA = """
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT UNIQUE
+);
+
+CREATE TABLE tag_keys (
+    key_id INTEGER PRIMARY KEY NOT NULL,
+    key TEXT NOT NULL,
+    type TEXT,
+    UNIQUE (key, type)
+);
+
+CREATE TABLE tag_values (
+    value_id INTEGER PRIMARY KEY NOT NULL,
+    value TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE nodes_data (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat REAL,
+    lon REAL,
+    user_id INTEGER,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp DATETIME,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+CREATE TABLE ways_data (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user_id INTEGER,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp DATETIME,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- value is NULL if value_id refers to the value in tag_values
+CREATE TABLE nodes_tags_data (
+    id INTEGER,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER,
+    value TEXT,
+    FOREIGN KEY (id) REFERENCES nodes_data(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(key_id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(value_id)
+);
+
+CREATE TABLE ways_tags_data (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER,
+    value TEXT,
+    FOREIGN KEY (id) REFERENCES ways_data(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(key_id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(value_id)
+);
+"""
+
+FILL = """
+INSERT INTO users (user)
+    SELECT user FROM nodes UNION SELECT user FROM ways;
+
+INSERT INTO tag_keys (key, type)
+    SELECT key, type FROM nodes_tags UNION SELECT key, type FROM ways_tags;
+
+INSERT INTO tag_values (value)
+    SELECT value FROM (SELECT value FROM nodes_tags UNION ALL SELECT value FROM ways_tags)
+    GROUP BY value
+    HAVING count(*) >= {min_value_count};
+
+INSERT INTO nodes_data
+    SELECT n.id, n.lat, n.lon, u.user_id, n.uid, n.version, n.changeset, n.timestamp
+    FROM nodes n LEFT JOIN users u ON u.user = n.user;
+
+INSERT INTO ways_data
+    SELECT w.id, u.user_id, w.uid, w.version, w.changeset, w.timestamp
+    FROM ways w LEFT JOIN users u ON u.user = w.user;
+
+INSERT INTO nodes_tags_data
+    SELECT t.id, k.key_id, v.value_id, CASE WHEN v.value_id IS NULL THEN t.value END
+    FROM nodes_tags t
+         JOIN tag_keys k ON k.key = t.key AND k.type IS t.type
+         LEFT JOIN tag_values v ON v.value = t.value
+    ORDER BY t.rowid;
+
+INSERT INTO ways_tags_data
+    SELECT t.id, k.key_id, v.value_id, CASE WHEN v.value_id IS NULL THEN t.value END
+    FROM ways_tags t
+         JOIN tag_keys k ON k.key = t.key AND k.type IS t.type
+         LEFT JOIN tag_values v ON v.value = t.value
+    ORDER BY t.rowid;
+
+DROP TABLE nodes;
+DROP TABLE ways;
+DROP TABLE nodes_tags;
+DROP TABLE ways_tags;
+
+-- the views join the tags of an element by id
+CREATE INDEX nodes_tags_data_id ON nodes_tags_data (id);
+CREATE INDEX ways_tags_data_id ON ways_tags_data (id);
+"""
+
+# the old tables, as views with the same columns
+VIEWS = """
+CREATE VIEW nodes AS
+    SELECT n.id, n.lat, n.lon, u.user, n.uid, n.version, n.changeset, n.timestamp
+    FROM nodes_data n LEFT JOIN users u ON u.user_id = n.user_id;
+
+CREATE VIEW ways AS
+    SELECT w.id, u.user, w.uid, w.version, w.changeset, w.timestamp
+    FROM ways_data w LEFT JOIN users u ON u.user_id = w.user_id;
+
+CREATE VIEW nodes_tags AS
+    SELECT t.id, k.key, coalesce(v.value, t.value) AS value, k.type
+    FROM nodes_tags_data t
+         JOIN tag_keys k ON k.key_id = t.key_id
+         LEFT JOIN tag_values v ON v.value_id = t.value_id;
+
+CREATE VIEW ways_tags AS
+    SELECT t.id, k.key, coalesce(v.value, t.value) AS value, k.type
+    FROM ways_tags_data t
+         JOIN tag_keys k ON k.key_id = t.key_id
+         LEFT JOIN tag_values v ON v.value_id = t.value_id;
+"""
+
+# writes to the views, as done by update_database.py; no OR IGNORE for the
+# lookup tables: the OR REPLACE of the outer statement would override it
+TRIGGERS = """
+CREATE TRIGGER nodes_insert INSTEAD OF INSERT ON nodes
+BEGIN
+    INSERT INTO users (user)
+        SELECT NEW.user
+        WHERE NOT EXISTS (SELECT 1 FROM users WHERE user IS NEW.user);
+    INSERT OR REPLACE INTO nodes_data (id, lat, lon, user_id, uid, version, changeset, timestamp)
+    VALUES (NEW.id, NEW.lat, NEW.lon, (SELECT user_id FROM users WHERE user IS NEW.user),
+            NEW.uid, NEW.version, NEW.changeset, NEW.timestamp);
+END;
+
+CREATE TRIGGER nodes_delete INSTEAD OF DELETE ON nodes
+BEGIN
+    DELETE FROM nodes_data WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER ways_insert INSTEAD OF INSERT ON ways
+BEGIN
+    INSERT INTO users (user)
+        SELECT NEW.user
+        WHERE NOT EXISTS (SELECT 1 FROM users WHERE user IS NEW.user);
+    INSERT OR REPLACE INTO ways_data (id, user_id, uid, version, changeset, timestamp)
+    VALUES (NEW.id, (SELECT user_id FROM users WHERE user IS NEW.user),
+            NEW.uid, NEW.version, NEW.changeset, NEW.timestamp);
+END;
+
+CREATE TRIGGER ways_delete INSTEAD OF DELETE ON ways
+BEGIN
+    DELETE FROM ways_data WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER nodes_tags_insert INSTEAD OF INSERT ON nodes_tags
+BEGIN
+    INSERT INTO tag_keys (key, type)
+        SELECT NEW.key, NEW.type
+        WHERE NOT EXISTS (SELECT 1 FROM tag_keys WHERE key = NEW.key AND type IS NEW.type);
+    INSERT INTO nodes_tags_data (id, key_id, value_id, value)
+    VALUES (NEW.id, (SELECT key_id FROM tag_keys WHERE key = NEW.key AND type IS NEW.type),
+            (SELECT value_id FROM tag_values WHERE value = NEW.value),
+            CASE WHEN NOT EXISTS (SELECT 1 FROM tag_values WHERE value = NEW.value) THEN NEW.value END);
+END;
+
+CREATE TRIGGER nodes_tags_delete INSTEAD OF DELETE ON nodes_tags
+BEGIN
+    DELETE FROM nodes_tags_data WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER ways_tags_insert INSTEAD OF INSERT ON ways_tags
+BEGIN
+    INSERT INTO tag_keys (key, type)
+        SELECT NEW.key, NEW.type
+        WHERE NOT EXISTS (SELECT 1 FROM tag_keys WHERE key = NEW.key AND type IS NEW.type);
+    INSERT INTO ways_tags_data (id, key_id, value_id, value)
+    VALUES (NEW.id, (SELECT key_id FROM tag_keys WHERE key = NEW.key AND type IS NEW.type),
+            (SELECT value_id FROM tag_values WHERE value = NEW.value),
+            CASE WHEN NOT EXISTS (SELECT 1 FROM tag_values WHERE value = NEW.value) THEN NEW.value END);
+END;
+
+CREATE TRIGGER ways_tags_delete INSTEAD OF DELETE ON ways_tags
+BEGIN
+    DELETE FROM ways_tags_data WHERE id = OLD.id;
+END;
+"""
+
+# queries of workload.sql on the ids, without the joins of the views
+NATIVE_QUERIES = [
+    ("unique users", """
+SELECT count(*) AS num_users
+  FROM (SELECT user_id FROM nodes_data
+        UNION
+        SELECT user_id FROM ways_data);"""),
+    ("users having only one edit", """
+SELECT count(*) as num_once
+FROM (SELECT user_id, count(*) AS edits
+        FROM (SELECT user_id FROM nodes_data
+              UNION ALL
+              SELECT user_id FROM ways_data)
+      GROUP BY user_id
+      HAVING edits = 1
+);"""),
+    ("top 10 users", """
+SELECT u.user, e.edits
+  FROM (SELECT user_id, count(*) AS edits
+          FROM (SELECT user_id FROM nodes_data
+                UNION ALL
+                SELECT user_id FROM ways_data)
+        GROUP BY user_id
+        ORDER BY edits DESC
+        LIMIT 10) e
+       LEFT JOIN users u ON u.user_id = e.user_id
+ORDER BY e.edits DESC;"""),
+]
+
+
+def is_normalized(cur):
+    cur.execute("select count(*) from sqlite_master where type = 'table' and name = 'nodes_data';")
+    return cur.fetchone()[0] > 0
+
+
+def normalize(conn, min_value_count=MIN_VALUE_COUNT, vacuum=True):
+    """Convert the loaded tables of the database to the normalized layout, in one
+    transaction, and VACUUM it to give the space of the old tables back. Does
+    nothing if the database is normalized already."""
+    cur = conn.cursor()
+    if is_normalized(cur):
+        return
+    conn.commit()
+    cur.executescript("BEGIN;\n" + NORMALIZED_SCHEMA + FILL.format(min_value_count=int(min_value_count))
+                      + VIEWS + TRIGGERS + "ANALYZE;\nCOMMIT;\n")
+    if vacuum:
+        cur.execute("VACUUM;")
+
+
+def table_sizes(cur):
+    """Return {table: rows} of the lookup tables."""
+    return {table: cur.execute("select count(*) from %s;" % table).fetchone()[0]
+            for table in ("users", "tag_keys", "tag_values")}
+
+
+# ================================================== #
+#               Benchmark                            #
+# ================================================== #
+def benchmark(directory, workdir, min_value_count=MIN_VALUE_COUNT, repeat=3, log=print):
+    """Load the csv files of directory into a plain and a normalized database in
+    workdir, and compare their size and the run times of the workload queries.
+    Return {query name: (plain s, normalized s)}."""
+    import contextlib
+    import io
+
+    import index_advisor
+    import load_database
+
+    paths = {}
+    for layout in ("plain", "normalized"):
+        dbfile = "%s.db" % layout
+        paths[layout] = os.path.join(workdir, dbfile)
+        # load_database takes the database file name relative to the csv directory
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_database.load(directory, os.path.relpath(paths[layout], directory), bulk=True,
+                               normalized=layout == "normalized", min_value_count=min_value_count)
+    sizes = {layout: os.path.getsize(path) for layout, path in paths.items()}
+    log("size: plain %.1f MB, normalized %.1f MB (%.0f%%)"
+        % (sizes["plain"] / 1e6, sizes["normalized"] / 1e6, 100.0 * sizes["normalized"] / sizes["plain"]))
+
+    setup, queries = index_advisor.read_workload()
+    times = {}
+    for layout, path in paths.items():
+        conn = sqlite3.connect(path)
+        if layout == "normalized":
+            log("lookup tables: %s" % ", ".join("%s %i rows" % kv for kv in table_sizes(conn.cursor()).items()))
+        for sql in setup:
+            conn.execute(sql)
+        times[layout] = index_advisor.time_queries(conn, queries, repeat)
+        if layout == "normalized":
+            native = [index_advisor.Query(name, sql) for name, sql in NATIVE_QUERIES]
+            times["native"] = dict(zip([q.name for q in native], index_advisor.time_queries(conn, native, repeat)))
+        conn.close()
+
+    results = {}
+    log("%-40s %10s %12s %10s" % ("query", "plain s", "normalized s", "native s"))
+    for query, t_plain, t_normalized in zip(queries, times["plain"], times["normalized"]):
+        t_native = times["native"].get(query.name)
+        log("%-40s %10.4f %12.4f %10s" % (query.name[:40], t_plain, t_normalized,
+                                           "%.4f" % t_native if t_native is not None else ""))
+        results[query.name] = (t_plain, t_normalized)
+    log("%-40s %10.4f %12.4f" % ("total", sum(times["plain"]), sum(times["normalized"])))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Compare the plain and the normalized database layout.')
+    parser.add_argument('directory', type=str, help='directory where csv files reside')
+    parser.add_argument('--min-value-count', type=int, default=MIN_VALUE_COUNT,
+                        help='occurrences of a tag value to store it in tag_values')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per query, the best one counts')
+    parser.add_argument('--workdir', type=str, help='directory for the databases (default: temporary)')
+    args = parser.parse_args()
+
+    if args.workdir:
+        benchmark(args.directory, args.workdir, args.min_value_count, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            benchmark(args.directory, workdir, args.min_value_count, args.repeat)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming reader of OSM files with bounded memory, shared by the audits
+(audit_engine.py) and prepare_csv.py.
+
+Top level elements are yielded once their end tag has been parsed, so all their
+children are there. When the consumer asks for the next element, the previous
+one is cleared and removed from the root, so the tree never holds more than the
+element being consumed, whatever the size of the file. Two backends:
+- "etree": ElementTree elements from iterparse
+- "expat": fastparse.Element records, no tree at all
+Compressed files (.osm.gz, .osm.bz2) are read directly, see compressed.py, and
+PBF files are read by pbf.py.
+
+If run as a main program, it checks that the peak memory of reading and
+auditing stays flat as the input grows, on synthetic files (synth_osm.py) of
+increasing size. It exits with status 1 if it does not.
+"""
+import xml.etree.ElementTree as ET
+
+import compressed
+import fastparse
+import pbf
+
+PARSERS = ["etree", "expat"]
+
+TOP_LEVEL = fastparse.TOP_LEVEL
+
+
+def iter_etree(source, tags=TOP_LEVEL):
+    """Yield the complete ElementTree elements of the top level elements named in
+    tags. If tags is None, yield all top level elements, preceded by a childless
+    copy of the root element. An element is cleared as soon as the next one is
+    asked for; keep what you need from it before."""
+    context = ET.iterparse(source, events=("start", "end"))
+    _, root = next(context)
+    if tags is None:
+        # iterparse may already have added children to the root
+        yield ET.Element(root.tag, root.attrib)
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            if tags is None or elem.tag in tags:
+                yield elem
+            # element and its children are consumed, free memory
+            elem.clear()
+            del root[:]
+
+
+def iter_elements(source, tags=TOP_LEVEL, parser="etree"):
+    """Yield the top level elements named in tags (all if None, preceded by the
+    root) as ElementTree elements ("etree") or fastparse.Element records
+    ("expat"). source is a path, of a compressed file too, or a binary file object.
+    PBF files give fastparse.Element records, whatever the parser."""
+    if parser not in PARSERS:
+        raise ValueError("unknown parser %r, use one of %s" % (parser, ", ".join(PARSERS)))
+    if isinstance(source, str):
+        if pbf.is_pbf(source):
+            return pbf.iter_elements(source, tags)
+        return iter_file(source, tags, parser)
+    if parser == "expat":
+        return fastparse.iter_elements(source, tags)
+    return iter_etree(source, tags)
+
+
+def iter_file(path, tags, parser):
+    with compressed.open_osm(path) as fp:
+        yield from iter_elements(fp, tags, parser)
+
+
+# ================================================== #
+#               Memory check                         #
+# ================================================== #
+def peak_memory(func):
+    """Return the peak of the memory allocated by Python while func() runs, in bytes."""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def consume(elements):
+    for _ in elements:
+        pass
+
+
+def check_memory(workdir, sizes, max_growth=1.5, log=print):
+    """Measure the peak memory of reading (every parser) and of auditing
+    synthetic files of the given sizes, given as (nodes, ways). Return True if no
+    peak grows by more than max_growth from the smallest to the largest file.
+    The audit uses the auditors whose results do not grow with the file
+    (count_elements, tags): the others collect the distinct dirty values."""
+    import os.path
+
+    import audit_engine
+    import synth_osm
+
+    auditors = audit_engine.load_auditors(["count_elements", "tags"])
+    peaks = {}
+    for n_nodes, n_ways in sizes:
+        osmpath = os.path.join(workdir, "synth_%i_%i.osm" % (n_nodes, n_ways))
+        synth_osm.generate(osmpath, n_nodes, n_ways, n_relations=n_ways // 100)
+        for parser in PARSERS:
+            for name, func in [("read", lambda: consume(iter_elements(osmpath, None, parser))),
+                               ("audit", lambda: audit_engine.run(osmpath, auditors, parser=parser))]:
+                peak = peak_memory(func)
+                peaks.setdefault((name, parser), []).append(peak)
+                log("%8i nodes %7i ways  %-5s %-5s peak %8.1f KB" % (n_nodes, n_ways, name, parser, peak / 1024))
+    flat = True
+    for (name, parser), values in peaks.items():
+        growth = values[-1] / values[0]
+        log("%-5s %-5s growth %.2fx" % (name, parser, growth))
+        if growth > max_growth:
+            flat = False
+    return flat
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import tempfile
+
+    import benchmark
+
+    parser = argparse.ArgumentParser(description='Check that peak memory stays flat as the OSM input grows.')
+    parser.add_argument('--sizes', type=benchmark.parse_size, nargs='+', default=[(10000, 1500), (80000, 12000)],
+                        metavar='NODESxWAYS', help='sizes of the synthetic files, smallest first')
+    parser.add_argument('--max-growth', type=float, default=1.5,
+                        help='largest allowed ratio of the peak memory of the largest and smallest file')
+    parser.add_argument('--workdir', type=str, help='directory for the generated files (default: temporary)')
+    args = parser.parse_args()
+
+    if args.workdir:
+        flat = check_memory(args.workdir, args.sizes, args.max_growth)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            flat = check_memory(workdir, args.sizes, args.max_growth)
+    print("memory is flat" if flat else "memory grows with the input")
+    sys.exit(0 if flat else 1)
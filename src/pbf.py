@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read and write OSM PBF files, without a protobuf library.
+
+A PBF file is a sequence of blobs, each one a zlib compressed protobuf message:
+an OSMHeader blob, then OSMData blobs holding primitive blocks of up to 8000
+nodes, ways or relations with their own string table. Blocks can be decoded
+independently: the reader only reads the blob headers, and worker processes
+read and decode the blobs, at most two per worker in flight. Decoded blocks are
+yielded in file order.
+
+The reader yields the same fastparse.Element records as the expat backend
+(attribute values as in the XML files, lat and lon with 7 decimals), so that
+shape_element, the cleaning and the audits work unchanged. Dense nodes, ways,
+relations, string tables and the (dense) info of the elements are supported;
+zlib and raw blobs only.
+
+The writer (PbfWriter, convert) writes dense nodes, ways and relations; it is
+used to make PBF copies of synthetic files (synth_osm.py --pbf).
+
+If run as a main program, it converts an OSM XML file to PBF ("convert"), or
+checks the reader against the XML of synthetic files and compares the read
+times ("check").
+"""
+import calendar
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import deque
+from itertools import accumulate
+
+import fastparse
+
+TOP_LEVEL = fastparse.TOP_LEVEL
+
+BLOCK_SIZE = 8000  # elements per primitive block written
+MEMBER_TYPES = ["node", "way", "relation"]
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def is_pbf(path):
+    """Return True if the file starts with the header of an OSMHeader blob."""
+    with open(path, "rb") as fp:
+        data = fp.read(16)
+    return data[4:15] == b"\x0a\x09OSMHeader"
+
+
+# ================================================== #
+#               Protobuf wire format                 #
+# ================================================== #
+def read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_fields(buf):
+    """Yield (field number, value) of a message: an int for varints, bytes for
+    length delimited fields."""
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            n, pos = read_varint(buf, pos)
+            value = buf[pos:pos + n]
+            pos += n
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("unsupported wire type %i" % wire_type)
+        yield key >> 3, value
+
+
+def unpack_varints(buf):
+    """Return the list of the varints of a packed field."""
+    values = []
+    append = values.append
+    result = shift = 0
+    for b in buf:
+        if b < 0x80:
+            append(result | (b << shift))
+            result = shift = 0
+        else:
+            result |= (b & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def signed(n):
+    """int64 from its unsigned varint."""
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def unpack_sint(buf, delta=False):
+    values = [(n >> 1) ^ -(n & 1) for n in unpack_varints(buf)]
+    return list(accumulate(values)) if delta else values
+
+
+def encode_varint(n):
+    if n < 0:
+        n += 1 << 64
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def encode_zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def field_varint(number, n):
+    return encode_varint(number << 3) + encode_varint(n)
+
+
+def field_bytes(number, data):
+    return encode_varint(number << 3 | 2) + encode_varint(len(data)) + data
+
+
+def field_packed(number, values):
+    return field_bytes(number, b"".join(encode_varint(n) for n in values))
+
+
+def deltas(values):
+    previous = 0
+    result = []
+    for value in values:
+        result.append(value - previous)
+        previous = value
+    return result
+
+
+# ================================================== #
+#               Reading                              #
+# ================================================== #
+def iter_blobs(fp):
+    """Yield (type, offset, size) of the blobs of an open PBF file, skipping their data."""
+    while True:
+        data = fp.read(4)
+        if len(data) < 4:
+            return
+        header = dict(iter_fields(fp.read(struct.unpack(">I", data)[0])))
+        offset = fp.tell()
+        yield header[1].decode(), offset, header[3]
+        fp.seek(offset + header[3])
+
+
+def blob_data(blob):
+    """Return the uncompressed data of a Blob message."""
+    fields = dict(iter_fields(blob))
+    if 1 in fields:
+        return fields[1]
+    if 3 in fields:
+        return zlib.decompress(fields[3])
+    raise ValueError("unsupported blob compression (only raw and zlib are supported)")
+
+
+def format_coordinate(nanodegrees):
+    """Format like the XML files: degrees with 7 decimals."""
+    units = (nanodegrees + 50) // 100 if nanodegrees >= 0 else -((-nanodegrees + 50) // 100)
+    sign = "-" if units < 0 else ""
+    return "%s%i.%07i" % (sign, abs(units) // 10000000, abs(units) % 10000000)
+
+
+class Block(object):
+    """Strings and coordinate and date scales of a primitive block."""
+
+    def __init__(self, strings, granularity=100, lat_offset=0, lon_offset=0, date_granularity=1000):
+        self.strings = strings
+        self.granularity = granularity
+        self.lat_offset = lat_offset
+        self.lon_offset = lon_offset
+        self.date_granularity = date_granularity
+        self.timestamps = {}
+
+    def timestamp(self, value):
+        if value not in self.timestamps:
+            self.timestamps[value] = time.strftime(TIMESTAMP_FORMAT,
+                                                   time.gmtime(value * self.date_granularity // 1000))
+        return self.timestamps[value]
+
+    def tags(self, keys, values):
+        strings = self.strings
+        return [(strings[k], strings[v]) for k, v in zip(keys, values)]
+
+    def info(self, attrib, version, timestamp, changeset, uid, user_sid):
+        attrib["version"] = str(version)
+        attrib["timestamp"] = self.timestamp(timestamp)
+        attrib["changeset"] = str(changeset)
+        attrib["uid"] = str(uid)
+        attrib["user"] = self.strings[user_sid]
+
+
+def decode_info(block, attrib, buf):
+    fields = dict(iter_fields(buf))
+    if fields:
+        block.info(attrib, fields.get(1, 0), signed(fields.get(2, 0)), signed(fields.get(3, 0)),
+                   fields.get(4, 0), fields.get(5, 0))
+
+
+def decode_dense(block, buf):
+    fields = dict(iter_fields(buf))
+    ids = unpack_sint(fields.get(1, b""), delta=True)
+    lats = unpack_sint(fields.get(8, b""), delta=True)
+    lons = unpack_sint(fields.get(9, b""), delta=True)
+    keys_vals = unpack_varints(fields.get(10, b""))
+    info = dict(iter_fields(fields.get(5, b"")))
+    if info:
+        versions = unpack_varints(info.get(1, b""))
+        timestamps = unpack_sint(info.get(2, b""), delta=True)
+        changesets = unpack_sint(info.get(3, b""), delta=True)
+        uids = unpack_sint(info.get(4, b""), delta=True)
+        user_sids = unpack_sint(info.get(5, b""), delta=True)
+    strings = block.strings
+    intern = sys.intern
+    granularity, lat_offset, lon_offset = block.granularity, block.lat_offset, block.lon_offset
+    lats = [format_coordinate(lat_offset + granularity * lat) for lat in lats]
+    lons = [format_coordinate(lon_offset + granularity * lon) for lon in lons]
+    if info:
+        timestamps = [block.timestamp(t) for t in timestamps]
+        users = [strings[sid] for sid in user_sids]
+    elements = []
+    n_keys_vals = len(keys_vals)
+    j = 0
+    for i, node_id in enumerate(ids):
+        if info:
+            attrib = {"id": str(node_id), "lat": lats[i], "lon": lons[i], "version": str(versions[i]),
+                      "timestamp": timestamps[i], "changeset": str(changesets[i]), "uid": str(uids[i]),
+                      "user": users[i]}
+        else:
+            attrib = {"id": str(node_id), "lat": lats[i], "lon": lons[i]}
+        element = fastparse.Element("node", attrib)
+        # keys and values of all nodes, the tags of each node end with a 0
+        if j < n_keys_vals and keys_vals[j]:
+            tags = element.tags
+            while keys_vals[j]:
+                tags.append((intern(strings[keys_vals[j]]), strings[keys_vals[j + 1]]))
+                j += 2
+        j += 1
+        elements.append(element)
+    return elements
+
+
+def decode_element(block, tag, buf):
+    """Decode a Node, Way or Relation message."""
+    fields = {}
+    for number, value in iter_fields(buf):
+        fields[number] = value
+    attrib = {"id": str(signed(fields[1]) if tag != "node" else zigzag(fields[1]))}
+    if tag == "node":
+        attrib["lat"] = format_coordinate(block.lat_offset + block.granularity * zigzag(fields[8]))
+        attrib["lon"] = format_coordinate(block.lon_offset + block.granularity * zigzag(fields[9]))
+    if 4 in fields:
+        decode_info(block, attrib, fields[4])
+    element = fastparse.Element(tag, attrib)
+    element.tags = [(sys.intern(k), v) for k, v in block.tags(unpack_varints(fields.get(2, b"")),
+                                                                unpack_varints(fields.get(3, b"")))]
+    if tag == "way":
+        element.nds = [str(ref) for ref in unpack_sint(fields.get(8, b""), delta=True)]
+    elif tag == "relation":
+        roles = unpack_varints(fields.get(8, b""))
+        refs = unpack_sint(fields.get(9, b""), delta=True)
+        types = unpack_varints(fields.get(10, b""))
+        element.members = [(MEMBER_TYPES[typ], str(ref), block.strings[role])
+                           for typ, ref, role in zip(types, refs, roles)]
+    return element
+
+
+def decode_block(data, tags=TOP_LEVEL):
+    """Return the Element records of a PrimitiveBlock of the types in tags (all if None)."""
+    groups = []
+    fields = {17: 100, 18: 1000, 19: 0, 20: 0}
+    for number, value in iter_fields(data):
+        if number == 2:
+            groups.append(value)
+        else:
+            fields[number] = value
+    strings = [s.decode("utf-8") for number, s in iter_fields(fields.get(1, b"")) if number == 1]
+    block = Block(strings, fields[17], signed(fields[19]), signed(fields[20]), fields[18])
+    elements = []
+    for group in groups:
+        for number, value in iter_fields(group):
+            if number == 2:
+                tag = "node"
+            elif number in (1, 3, 4):
+                tag = {1: "node", 3: "way", 4: "relation"}[number]
+            else:
+                continue  # changesets
+            if tags is not None and tag not in tags:
+                continue
+            if number == 2:
+                elements.extend(decode_dense(block, value))
+            else:
+                elements.append(decode_element(block, tag, value))
+    return elements
+
+
+def read_blob(task):
+    """Worker: read and decode the blob at offset of the file."""
+    path, offset, size, tags = task
+    with open(path, "rb") as fp:
+        fp.seek(offset)
+        return decode_block(blob_data(fp.read(size)), tags)
+
+
+def decode_header(data):
+    """Return the root and bounds Elements of a HeaderBlock."""
+    fields = dict(iter_fields(data))
+    root = fastparse.Element("osm", {"version": "0.6", "generator": fields.get(16, b"").decode("utf-8")})
+    elements = [root]
+    if 1 in fields:
+        bbox = {number: zigzag(value) for number, value in iter_fields(fields[1])}
+        elements.append(fastparse.Element("bounds", {"minlat": format_coordinate(bbox.get(4, 0)),
+                                                     "minlon": format_coordinate(bbox.get(1, 0)),
+                                                     "maxlat": format_coordinate(bbox.get(3, 0)),
+                                                     "maxlon": format_coordinate(bbox.get(2, 0))}))
+    return elements
+
+
+def iter_elements(path, tags=TOP_LEVEL, workers=None):
+    """Yield the Element records of the top level elements named in tags. If tags
+    is None, yield all of them, preceded by the root and the bounds. Blocks are
+    decoded by workers processes (default: one per CPU)."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # worker processes, e.g. of prepare_csv --workers, cannot start a pool
+    pool = multiprocessing.Pool(workers) if workers > 1 and not multiprocessing.current_process().daemon else None
+    pending = deque()
+    try:
+        with open(path, "rb") as fp:
+            for blob_type, offset, size in iter_blobs(fp):
+                if blob_type == "OSMHeader":
+                    if tags is None:
+                        fp.seek(offset)
+                        yield from decode_header(blob_data(fp.read(size)))
+                        fp.seek(offset + size)
+                    continue
+                if blob_type != "OSMData":
+                    continue
+                task = (path, offset, size, tags)
+                if pool is None:
+                    yield from read_blob(task)
+                    continue
+                pending.append(pool.apply_async(read_blob, (task,)))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+# ================================================== #
+#               Writing                              #
+# ================================================== #
+def parse_timestamp(text):
+    return calendar.timegm(time.strptime(text, TIMESTAMP_FORMAT))
+
+
+def nanodegrees(text):
+    return int(round(float(text) * 1e7)) * 100
+
+
+class StringTable(object):
+    def __init__(self):
+        self.strings = [""]
+        self.index = {"": 0}
+
+    def __call__(self, s):
+        if s not in self.index:
+            self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return self.index[s]
+
+    def encode(self):
+        return b"".join(field_bytes(1, s.encode("utf-8")) for s in self.strings)
+
+
+class PbfWriter(object):
+    """Write Element records to a PBF file, in blocks of one element type."""
+
+    def __init__(self, path, bounds=None, block_size=BLOCK_SIZE, writing_program="osm_pbf"):
+        self.fp = open(path, "wb")
+        self.block_size = block_size
+        self.elements = []
+        header = field_bytes(4, b"OsmSchema-V0.6") + field_bytes(4, b"DenseNodes")
+        if bounds is not None:
+            bbox = [nanodegrees(bounds.attrib[name]) for name in ("minlon", "maxlon", "maxlat", "minlat")]
+            header = field_bytes(1, b"".join(field_varint(i + 1, encode_zigzag(v)) for i, v in enumerate(bbox))) \
+                + header
+        header += field_bytes(16, writing_program.encode("utf-8"))
+        self.write_blob("OSMHeader", header)
+
+    def write_blob(self, blob_type, data):
+        blob = field_varint(2, len(data)) + field_bytes(3, zlib.compress(data))
+        header = field_bytes(1, blob_type.encode()) + field_varint(3, len(blob))
+        self.fp.write(struct.pack(">I", len(header)) + header + blob)
+
+    def write(self, element):
+        if self.elements and (self.elements[0].tag != element.tag or len(self.elements) >= self.block_size):
+            self.flush()
+        self.elements.append(element)
+
+    def info(self, table, attrib):
+        return [int(attrib.get("version", 0)), parse_timestamp(attrib["timestamp"]) if "timestamp" in attrib else 0,
+                int(attrib.get("changeset", 0)), int(attrib.get("uid", 0)), table(attrib.get("user", ""))]
+
+    def flush(self):
+        if not self.elements:
+            return
+        table = StringTable()
+        elements, self.elements = self.elements, []
+        if elements[0].tag == "node":
+            group = field_bytes(2, self.encode_dense(table, elements))
+        else:
+            number = 3 if elements[0].tag == "way" else 4
+            group = b"".join(field_bytes(number, self.encode_element(table, element)) for element in elements)
+        # the string table has to be complete before it is written
+        self.write_blob("OSMData", field_bytes(1, table.encode()) + field_bytes(2, group))
+
+    def encode_dense(self, table, elements):
+        infos = [self.info(table, element.attrib) for element in elements]
+        keys_vals = []
+        for element in elements:
+            for k, v in element.tags:
+                keys_vals += [table(k), table(v)]
+            keys_vals.append(0)
+        dense_info = (field_packed(1, [info[0] for info in infos]) +
+                      b"".join(field_packed(i + 2, [encode_zigzag(d) for d in deltas([info[i + 1] for info in infos])])
+                               for i in range(4)))
+        return (field_packed(1, [encode_zigzag(d) for d in deltas([int(e.attrib["id"]) for e in elements])]) +
+                field_bytes(5, dense_info) +
+                field_packed(8, [encode_zigzag(d) for d in deltas([nanodegrees(e.attrib["lat"]) // 100
+                                                                    for e in elements])]) +
+                field_packed(9, [encode_zigzag(d) for d in deltas([nanodegrees(e.attrib["lon"]) // 100
+                                                                    for e in elements])]) +
+                field_packed(10, keys_vals))
+
+    def encode_element(self, table, element):
+        info = self.info(table, element.attrib)
+        data = (field_varint(1, int(element.attrib["id"])) +
+                field_packed(2, [table(k) for k, _ in element.tags]) +
+                field_packed(3, [table(v) for _, v in element.tags]) +
+                field_bytes(4, b"".join(field_varint(i + 1, n) for i, n in enumerate(info))))
+        if element.tag == "way":
+            data += field_packed(8, [encode_zigzag(d) for d in deltas([int(ref) for ref in element.nds])])
+        else:
+            data += (field_packed(8, [table(role) for _, _, role in element.members]) +
+                     field_packed(9, [encode_zigzag(d) for d in deltas([int(ref) for _, ref, _ in element.members])]) +
+                     field_packed(10, [MEMBER_TYPES.index(typ) for typ, _, _ in element.members]))
+        return data
+
+    def close(self):
+        self.flush()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def convert(osmpath, pbfpath, block_size=BLOCK_SIZE):
+    """Write the OSM XML file osmpath as PBF file pbfpath."""
+    elements = fastparse.iter_elements(osmpath, tags=None)
+    root = next(elements)
+    first = next(elements, None)
+    bounds = first if first is not None and first.tag == "bounds" else None
+    with PbfWriter(pbfpath, bounds, block_size, root.attrib.get("generator", "osm_pbf")) as writer:
+        if first is not None and bounds is None and first.tag in TOP_LEVEL:
+            writer.write(first)
+        for element in elements:
+            if element.tag in TOP_LEVEL:
+                writer.write(element)
+
+
+# ================================================== #
+#               Check                                #
+# ================================================== #
+def check(workdir, n_nodes, n_ways, workers=None, log=print):
+    """Generate a synthetic XML file and its PBF copy, and compare the records of
+    both readers. Return True if they are the same."""
+    import synth_osm
+
+    osmpath = os.path.join(workdir, "synth_%i_%i.osm" % (n_nodes, n_ways))
+    pbfpath = os.path.join(workdir, "synth_%i_%i.osm.pbf" % (n_nodes, n_ways))
+    synth_osm.generate(osmpath, n_nodes, n_ways, n_relations=n_ways // 100)
+    convert(osmpath, pbfpath)
+    log("%s: %i bytes, %s: %i bytes" % (osmpath, os.path.getsize(osmpath), pbfpath, os.path.getsize(pbfpath)))
+
+    def records(elements):
+        return [(e.tag, e.attrib, e.tags, e.nds, e.members) for e in elements if e.tag in TOP_LEVEL]
+
+    t0 = time.perf_counter()
+    xml_records = records(fastparse.iter_elements(osmpath, tags=None))
+    t1 = time.perf_counter()
+    pbf_records = records(iter_elements(pbfpath, tags=None, workers=workers))
+    t2 = time.perf_counter()
+    log("read XML (expat) %.2f s, PBF %.2f s" % (t1 - t0, t2 - t1))
+    same = xml_records == pbf_records
+    if not same:
+        for x, p in zip(xml_records, pbf_records):
+            if x != p:
+                log("first difference:\n  XML %r\n  PBF %r" % (x, p))
+                break
+    log("%i elements, %s" % (len(xml_records), "same records" if same else "DIFFERENT records"))
+    return same
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Convert OSM XML to PBF, or check the PBF reader.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('convert', help='convert an OSM XML file to PBF')
+    p.add_argument('osmpath', type=str, help='Path to OSM file')
+    p.add_argument('pbfpath', type=str, help='Path of the PBF file to write')
+    p = subparsers.add_parser('check', help='compare the records of synthetic XML and PBF files')
+    p.add_argument('--nodes', type=int, default=20000, help='number of nodes')
+    p.add_argument('--ways', type=int, default=3000, help='number of ways')
+    p.add_argument('--workers', type=int, help='decoding processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert(args.osmpath, args.pbfpath)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            sys.exit(0 if check(workdir, args.nodes, args.ways, args.workers) else 1)
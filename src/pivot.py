@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Materialized wide format tag tables.
+
+A pivot table has one row per node or way carrying at least one of a declared
+list of tag keys, and one column per key, e.g. for amenity, name, cuisine,
+addr:city:
+
+    id | element_type | amenity | name | cuisine | addr_city
+
+It replaces views which join the tag tables with themselves once per key, like
+'resto' in queries.ipynb:
+
+    SELECT name, addr_city AS city, cuisine FROM resto
+    WHERE amenity IN ('restaurant', 'cafe', 'fast_food', 'ice_cream');
+
+Keys are split into type and key like in prepare_csv ('addr:city' is key 'city'
+of type 'addr'). In the column names every character other than letters,
+digits and '_' is replaced by '_' (addr_city, contact_e_mail); keys whose
+columns would collide are rejected. Table and column names are quoted in the
+SQL. The declared pivot tables are stored in the table pivot_tables.
+A table is filled with one GROUP BY pass per tag table. update_database refreshes
+only the rows of changed elements.
+
+If run as a main program, it creates a pivot table, or refreshes pivot tables
+completely or for given elements.
+"""
+import re
+import sqlite3
+
+from prepare_csv import split_colon
+
+# element type -> tag table
+TAG_TABLES = [("node", "nodes_tags"), ("way", "ways_tags")]
+
+PIVOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pivot_tables (
+    name TEXT PRIMARY KEY NOT NULL,
+    keys TEXT NOT NULL
+);
+"""
+
+
+RE_NON_WORD = re.compile(r"[^A-Za-z0-9_]")
+
+
+def column_name(key):
+    return RE_NON_WORD.sub("_", key)
+
+
+def quote(identifier):
+    """Quote a table or column name for SQL."""
+    return '"%s"' % identifier.replace('"', '""')
+
+
+def column_names(keys):
+    """Return the column names of the keys. Raise ValueError if two keys, or a key
+    and id or element_type, give the same column (SQLite ignores the case), or a
+    key contains a comma (the keys are stored comma separated)."""
+    columns = {"id": "id", "element_type": "element_type"}
+    for key in keys:
+        if "," in key:
+            raise ValueError("pivot key with a comma: %r" % key)
+        column = column_name(key)
+        if column.lower() in columns:
+            raise ValueError("pivot keys %r and %r give the same column %s" % (columns[column.lower()], key, column))
+        columns[column.lower()] = key
+    return [column_name(key) for key in keys]
+
+
+def has_pivots(cur):
+    cur.execute("select count(*) from sqlite_master where name = 'pivot_tables';")
+    return cur.fetchone()[0] == 1
+
+
+def pivot_keys(cur, name):
+    cur.execute("select keys from pivot_tables where name = ?;", (name,))
+    row = cur.fetchone()
+    if row is None:
+        raise KeyError("no pivot table %s" % name)
+    return row[0].split(",")
+
+
+def pivot_names(cur):
+    if not has_pivots(cur):
+        return []
+    cur.execute("select name from pivot_tables order by name;")
+    return [row[0] for row in cur.fetchall()]
+
+
+def fill_sql(name, keys, element_type, tag_table, where=""):
+    """Return INSERT ... SELECT filling the pivot table from one tag table, and its parameters."""
+    columns, selects, conditions, params_select, params_where = [], [], [], [], []
+    for key, column in zip(keys, column_names(keys)):
+        typ, k = split_colon(key)
+        columns.append(quote(column))
+        selects.append("max(CASE WHEN type = ? AND key = ? THEN value END)")
+        params_select += [typ, k]
+        conditions.append("(type = ? AND key = ?)")
+        params_where += [typ, k]
+    sql = "INSERT INTO {name} (id, element_type, {columns}) SELECT id, '{element_type}', {selects} " \
+          "FROM {tag_table} WHERE ({conditions}) {where} GROUP BY id;".format(
+              name=quote(name), columns=", ".join(columns), element_type=element_type, selects=", ".join(selects),
+              tag_table=tag_table, conditions=" OR ".join(conditions), where=where)
+    return sql, params_select + params_where
+
+
+def create_pivot(conn, name, keys):
+    """Declare and fill the pivot table name for the given tag keys."""
+    columns = ", ".join("%s TEXT" % quote(column) for column in column_names(keys))
+    cur = conn.cursor()
+    cur.executescript(PIVOT_SCHEMA)
+    cur.executescript("""
+        DROP TABLE IF EXISTS {name};
+        CREATE TABLE {name} (
+            id INTEGER NOT NULL,
+            element_type TEXT NOT NULL,
+            {columns},
+            PRIMARY KEY (id, element_type)
+        );""".format(name=quote(name), columns=columns))
+    cur.execute("insert or replace into pivot_tables (name, keys) values (?, ?);", (name, ",".join(keys)))
+    refresh_pivot(cur, name)
+    conn.commit()
+
+
+def refresh_pivot(cur, name, elements=None):
+    """Rebuild the rows of the given (element type, id) pairs, or all rows if
+    elements is None. Does not commit."""
+    keys = pivot_keys(cur, name)
+    if elements is None:
+        cur.execute("DELETE FROM %s;" % quote(name))
+        for element_type, tag_table in TAG_TABLES:
+            sql, params = fill_sql(name, keys, element_type, tag_table)
+            cur.execute(sql, params)
+        return
+    for element_type, tag_table in TAG_TABLES:
+        ids = [i for t, i in elements if t == element_type]
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            marks = ", ".join("?" * len(batch))
+            cur.execute("DELETE FROM %s WHERE element_type = ? AND id IN (%s);" % (quote(name), marks),
+                        [element_type] + batch)
+            sql, params = fill_sql(name, keys, element_type, tag_table, "AND id IN (%s)" % marks)
+            cur.execute(sql, params + batch)
+
+
+def refresh_all(cur, elements=None):
+    """Refresh all declared pivot tables. Does not commit."""
+    for name in pivot_names(cur):
+        refresh_pivot(cur, name, elements)
+
+
+def parse_elements(items):
+    """Parse ['node:123', 'way:45'] into [('node', 123), ('way', 45)]."""
+    elements = []
+    for item in items:
+        element_type, element_id = item.split(":")
+        elements.append((element_type, int(element_id)))
+    return elements
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Create or refresh materialized wide format tag tables.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('create', help='declare and fill a pivot table')
+    p.add_argument('dbpath', type=str, help='Path to database file')
+    p.add_argument('name', type=str, help='name of the pivot table')
+    p.add_argument('keys', type=str, nargs='+', help='tag keys, e.g. amenity name cuisine addr:city')
+    p = subparsers.add_parser('refresh', help='rebuild pivot tables')
+    p.add_argument('dbpath', type=str, help='Path to database file')
+    p.add_argument('--name', type=str, help='only this pivot table')
+    p.add_argument('--elements', type=str, nargs='+',
+                   help='only rebuild the rows of these elements, given as node:ID or way:ID')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.dbpath)
+    if args.command == 'create':
+        create_pivot(conn, args.name, args.keys)
+    else:
+        elements = parse_elements(args.elements) if args.elements else None
+        cur = conn.cursor()
+        if args.name:
+            refresh_pivot(cur, args.name, elements)
+        else:
+            refresh_all(cur, elements)
+        conn.commit()
+    conn.close()
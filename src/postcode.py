@@ -21,10 +21,12 @@ __object:postcode__
 - Tagging of the numeric postcode of the area the POI is located in.
 
 """
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 
+import audit_engine
+import osm_reader
+
 
 POCO_KEYS = ["addr:postcode", "postal_code", "openGeoDB:postal_codes", 
              "object:postcode", "boundary:postal_code"]
@@ -35,23 +37,29 @@ POCO_RE = re.compile(r'^18[456]\d{2}$', re.IGNORECASE)
 
 def audit_poco(poco_types, key, poco):
     if not POCO_RE.match(poco):
-        poco_types[key].add(plz)
+        poco_types[key].add(poco)
 
 
 def is_poco(elem):
     return (elem.attrib['k'] in POCO_KEYS)
 
 
-def audit(osmpath):
-    osm = open(osmpath, "r", encoding="utf-8")
-    incorrect_postcodes = defaultdict(set)
-    for event, elem in ET.iterparse(osm, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_poco(tag):
-                    audit_poco(incorrect_postcodes, tag.attrib['k'], tag.attrib['v'])
-    osm.close()
-    return incorrect_postcodes
+def report(incorrect_postcodes):
+    for key in incorrect_postcodes:
+        n = len(incorrect_postcodes[key])
+        print("\n%s: %i not ok" % (key, n))
+        if n > 0:
+            print("  ", sorted(incorrect_postcodes[key]))
+
+
+AUDITOR = audit_engine.Auditor("postcode", lambda: defaultdict(set),
+                               lambda key: key in POCO_KEYS,
+                               audit_poco,
+                               report)
+
+
+def audit(osmpath, parser="etree"):
+    return audit_engine.run(osmpath, [AUDITOR], parser=parser)[AUDITOR.name]
 
 
 if __name__ == "__main__":
@@ -59,12 +67,9 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Identify and list incorrect postal codes')
     parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
     args = parser.parse_args()
 
-    incorrect_postcodes = audit(args.osmpath)
-
-    for key in incorrect_postcodes:
-        n = len(incorrect_postcodes[key])
-        print("\n%s: %i not ok"%n)
-        if n > 0:
-            print("  ", sorted(incorrect_postcodes[key]))
+    incorrect_postcodes = audit(args.osmpath, args.parser)
+    report(incorrect_postcodes)
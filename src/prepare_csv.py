@@ -1,19 +1,64 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-FIXME: some description
+Clean the nodes and ways of an OSM file and write them to five csv files next to it.
+
+With --validate every shaped element is checked by the compiled validator in
+validation.py. Failures do not stop the run; a summary is printed at the end.
+
+Tag values are cleaned with the rules declared in cleaning_rules.py. Cleaned
+values are memoized in a bounded LRU cache (clean_cache.py); its hit rate is
+printed at the end of the run.
+
+Elements are shaped into csv rows by shape_rows: tuples in the order of the
+fields, with interned keys, tag types and users, without the dicts of
+shape_element. The rows are written with csv.writer.writerows in batches.
+
+With --workers N the file is split into byte ranges aligned to top level elements
+(see chunks.py). Worker processes shape and clean the ranges into per chunk csv
+files, which are merged in element order into the same five output files.
+
+With --checkpoint the file is processed in byte ranges (--workers processes
+work on several at once). After each range the csv files are synced to disk and
+a checkpoint (prepare_csv.checkpoint.json next to the csv files) records the
+input byte offset, the id of the last element, and the size of the csv files.
+If the run is killed, --resume truncates the csv files to the checkpoint and
+continues from its offset; the csv files are the same as those of an
+uninterrupted run.
+
+With --pipeline, parsing (a thread), shaping and validation (--workers processes)
+and writing (a thread) run as a pipeline connected by bounded queues; the time
+each stage spends waiting is printed at the end, to show the bottleneck. An
+error in any stage stops the others and is raised at once.
+
+With --parser expat the file is parsed by fastparse.py, which yields compact
+records instead of an element tree. PBF files (pbf.py) give the same records.
+
+With --instrument REPORT.json the stages are measured (see instrument.py).
 """
 import csv
-import pprint
+import io
+import json
+import multiprocessing
 import re
 import os.path
-import xml.etree.cElementTree as ET
-
-import cerberus
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, closing
+
+import chunks
+import clean_cache
+import compressed
+import fastparse
+import osm_reader
+import pbf
 import schema
-
-from addr_city import is_cityname, update_cityname
-from street_housenum import is_streetname, update_streetname
+import validation
 
 
 NODES_FILE = "nodes.csv"
@@ -35,8 +80,36 @@ WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
 
+# output files, in the order used by write_elements
+CSV_FILES = [(NODES_FILE, NODE_FIELDS),
+             (NODE_TAGS_FILE, NODE_TAGS_FIELDS),
+             (WAYS_FILE, WAY_FIELDS),
+             (WAY_NODES_FILE, WAY_NODES_FIELDS),
+             (WAY_TAGS_FILE, WAY_TAGS_FIELDS)]
+
 DEFAULT_TAG_TYPE = "regular"
 
+# parser backends: ElementTree.iterparse, or fastparse (expat, no element tree)
+PARSERS = osm_reader.PARSERS
+
+# selected cleaning functions, memoized per (key, value)
+CLEANING_CACHE = clean_cache.CleaningCache()
+
+# tag key -> interned (type, key), or False for keys with problem characters
+SPLIT_KEYS = {}
+
+BATCH_SIZE = 1000  # elements per writerows of the csv files
+
+# pipeline mode (--pipeline)
+PIPELINE_BATCH_SIZE = 1000  # elements per batch passed between the stages
+QUEUE_SIZE = 8  # batches waiting between two stages
+WRITE_BUFFER_SIZE = 1 << 20  # bytes buffered per csv file
+STOP_TIMEOUT = 0.1  # seconds between checks for a stop while waiting on a queue
+
+# resumable mode (--checkpoint, --resume)
+CHECKPOINT_FILE = "prepare_csv.checkpoint.json"  # next to the csv files
+CHECKPOINT_SIZE = chunks.CHUNK_SIZE  # bytes of input between checkpoints
+
 
 def is_unproblematic(k):
     return PROBLEMCHARS.search(k) is None
@@ -56,24 +129,46 @@ def split_colon(k):
         return items[0], ":".join(items[1:])
 
 
-def process_tag(tag, element_id):
-    k = tag.attrib["k"]
-    v = tag.attrib["v"]
+def process_kv(k, v, element_id):
+    """Return the shaped tag of key k and value v, or None if k has problem characters."""
     if is_unproblematic(k):
         typ, key = split_colon(k)
         # apply selected cleaning functions
-        if is_cityname(tag):
-            v = update_cityname(v)
-        if is_streetname(tag):
-            v = update_streetname(v)
+        v = CLEANING_CACHE.clean(k, v)
         d = {'id': element_id, 'key': key, 'value': v, 'type': typ}
         return d
     else:
         return None
 
 
+def process_tag(tag, element_id):
+    return process_kv(tag.attrib["k"], tag.attrib["v"], element_id)
+
+
+def split_key(k):
+    """Return the interned (type, key) of tag key k, or False if k has problem characters."""
+    if not is_unproblematic(k):
+        return False
+    typ, key = split_colon(k)
+    return sys.intern(typ), sys.intern(key)
+
+
+def tag_row(k, v, element_id):
+    """Return the csv row (id, key, value, type) of a tag, or None if k has problem
+    characters. Like process_kv, with the split keys memoized in SPLIT_KEYS."""
+    split = SPLIT_KEYS.get(k)
+    if split is None:
+        split = SPLIT_KEYS[k] = split_key(k)
+    if split is False:
+        return None
+    typ, key = split
+    return (element_id, key, CLEANING_CACHE.clean(k, v), typ)
+
+
 def shape_element(element):
-    """Clean and shape node or way XML element to Python dict"""
+    """Clean and shape node or way XML element (or fastparse.Element) to Python dict"""
+    if isinstance(element, fastparse.Element):
+        return shape_record(element)
 
     node_attribs = {}
     way_attribs = {}
@@ -88,7 +183,7 @@ def shape_element(element):
         nid = node_attribs["id"]
         # tags
         for tag in element.iter("tag"):
-            d = process_tag(tag, nid)
+            d = process_kv(tag.attrib["k"], tag.attrib["v"], nid)
             if d is not None:
                 tags.append(d)
         return {'node': node_attribs, 'node_tags': tags}
@@ -101,7 +196,7 @@ def shape_element(element):
         wid = way_attribs['id']
         # tags
         for tag in element.iter("tag"):
-            d = process_tag(tag, wid)
+            d = process_kv(tag.attrib["k"], tag.attrib["v"], wid)
             if d is not None:
                 tags.append(d)
         # way nodes
@@ -113,72 +208,556 @@ def shape_element(element):
         return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
 
 
+def shape_record(record):
+    """Clean and shape a fastparse.Element record of a node or way, like shape_element"""
+    attrib = record.attrib
+    if record.tag == 'node':
+        node_attribs = {field: attrib.get(field, "") for field in NODE_FIELDS}
+        nid = node_attribs["id"]
+        tags = []
+        for k, v in record.tags:
+            d = process_kv(k, v, nid)
+            if d is not None:
+                tags.append(d)
+        return {'node': node_attribs, 'node_tags': tags}
+
+    elif record.tag == 'way':
+        way_attribs = {field: attrib.get(field, "") for field in WAY_FIELDS}
+        wid = way_attribs['id']
+        tags = []
+        for k, v in record.tags:
+            d = process_kv(k, v, wid)
+            if d is not None:
+                tags.append(d)
+        way_nodes = [{"id": wid, "node_id": ref, "position": position} for position, ref in enumerate(record.nds)]
+        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+
+
+def shape_rows(element):
+    """Clean and shape a node or way XML element (or fastparse.Element) into csv
+    rows, tuples in the order of the fields of CSV_FILES. Return (element row, tag
+    rows, way node rows); the same values as shape_element, without dicts."""
+    if isinstance(element, fastparse.Element):
+        attrib, kvs, refs = element.attrib, element.tags, element.nds
+    else:
+        attrib = element.attrib
+        kvs = [(tag.attrib["k"], tag.attrib["v"]) for tag in element.iter("tag")]
+        refs = [nd.attrib["ref"] for nd in element.iter("nd")]
+    get = attrib.get
+    element_id = get("id", "")
+    if element.tag == 'node':
+        # NODE_FIELDS
+        row = (element_id, get("lat", ""), get("lon", ""), sys.intern(get("user", "")), get("uid", ""),
+               get("version", ""), get("changeset", ""), get("timestamp", ""))
+    else:
+        # WAY_FIELDS
+        row = (element_id, sys.intern(get("user", "")), get("uid", ""), get("version", ""),
+               get("changeset", ""), get("timestamp", ""))
+    tags = []
+    for k, v in kvs:
+        r = tag_row(k, v, element_id)
+        if r is not None:
+            tags.append(r)
+    return row, tags, [(element_id, ref, position) for position, ref in enumerate(refs)]
+
+
+def row_dicts(tag, rows):
+    """Return the shape_element dict of the rows of a node or way, for validation."""
+    row, tags, way_nodes = rows
+    if tag == 'node':
+        return {'node': dict(zip(NODE_FIELDS, row)),
+                'node_tags': [dict(zip(NODE_TAGS_FIELDS, r)) for r in tags]}
+    return {'way': dict(zip(WAY_FIELDS, row)),
+            'way_nodes': [dict(zip(WAY_NODES_FIELDS, r)) for r in way_nodes],
+            'way_tags': [dict(zip(WAY_TAGS_FIELDS, r)) for r in tags]}
+
+
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
 def get_element(osm_file, tags=('node', 'way')):
     """Yield element if it is the right type of tag"""
+    return osm_reader.iter_elements(osm_file, tags, "etree")
+
+
+def get_elements(file_in, parser="etree"):
+    """Yield the node and way elements of the file: ElementTree elements, or
+    fastparse.Element records with parser "expat"."""
+    return osm_reader.iter_elements(file_in, ('node', 'way'), parser)
+
+
+def validate_element(element, validator):
+    """Return the list of validation.Failure of the element. They are also counted
+    in validator.report."""
+    return validator.validate(element)
+
+
+def open_writers(stack, dirname, prefix="", header=True):
+    """Open the csv files in dirname and return their csv.writers in the order of
+    CSV_FILES. Files are closed by the ExitStack stack."""
+    return [csv.writer(fp) for fp in open_csv_files(stack, dirname, prefix, header)]
+
+
+def open_csv_files(stack, dirname, prefix="", header=True, buffering=-1):
+    """Open the csv files in dirname, write their header lines, and return them in
+    the order of CSV_FILES. Files are closed by the ExitStack stack."""
+    files = []
+    for filename, fields in CSV_FILES:
+        fp = stack.enter_context(open(os.path.join(dirname, prefix + filename), 'w', encoding="utf-8", newline='',
+                                      buffering=buffering))
+        if header:
+            csv.writer(fp).writerow(fields)
+        files.append(fp)
+    return files
+
+
+def write_elements(elements, writers, validate, batch_size=BATCH_SIZE):
+    """Shape, optionally validate, and write node and way elements to the writers,
+    with writerows per batch_size elements. Return the validation.ValidationReport,
+    or None if not validating."""
+    validator = validation.Validator(SCHEMA) if validate else None
+    # rows per output file, in the order of CSV_FILES
+    batches = [[], [], [], [], []]
+    n = 0
+    for element in elements:
+        if add_rows(batches, element, validator):
+            n += 1
+            if n == batch_size:
+                flush_rows(writers, batches)
+                n = 0
+    flush_rows(writers, batches)
+    return validator.report if validator else None
+
+
+def add_rows(batches, element, validator=None):
+    """Shape a node or way element, validate it if a validator is given, and add
+    its rows to the batches of the csv files. Return False for other elements."""
+    if element.tag not in ('node', 'way'):
+        return False
+    rows = shape_rows(element)
+    if validator is not None:
+        validate_element(row_dicts(element.tag, rows), validator)
+    row, tags, refs = rows
+    if element.tag == 'node':
+        batches[0].append(row)
+        batches[1].extend(tags)
+    else:
+        batches[2].append(row)
+        batches[3].extend(refs)
+        batches[4].extend(tags)
+    return True
+
+
+def flush_rows(writers, batches):
+    for writer, rows in zip(writers, batches):
+        if rows:
+            writer.writerows(rows)
+            rows.clear()
+
+
+def track_progress(elements, progress):
+    """Yield the elements, counting them and keeping the id of the last one in progress."""
+    for element in elements:
+        progress["elements"] += 1
+        progress["last_id"] = element.attrib.get("id")
+        yield element
+
+
+def process_chunk(task):
+    """Worker: process one byte range into csv files without header, prefixed with
+    the chunk number. Return chunk number, validation report, cleaning cache
+    statistics and {"elements": number, "last_id": id of the last element} of
+    the chunk."""
+    file_in, start, end, validate, tmpdir, index, parser = task
+    data = chunks.read_chunk(file_in, start, end)
+    stats_before = CLEANING_CACHE.stats.copy()
+    progress = {"elements": 0, "last_id": None}
+    with ExitStack() as stack:
+        writers = open_writers(stack, tmpdir, prefix="%06i_" % index, header=False)
+        report = write_elements(track_progress(get_elements(io.BytesIO(data), parser), progress), writers, validate)
+    return index, report, CLEANING_CACHE.stats - stats_before, progress
+
+
+def append_chunk(outfiles, tmpdir, index):
+    """Append the csv files of chunk index to the output files, and remove them."""
+    for outfile, (filename, _) in zip(outfiles, CSV_FILES):
+        chunk_path = os.path.join(tmpdir, "%06i_" % index + filename)
+        with open(chunk_path, 'rb') as fp:
+            shutil.copyfileobj(fp, outfile)
+        os.remove(chunk_path)
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
 
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, workers=1, parser="etree", checkpoint=False, resume=False):
+    """Iteratively process each XML element and write to csv(s). With checkpoint,
+    write checkpoints; with resume, continue an interrupted checkpointed run.
+    Return the validation.ValidationReport, or None if not validating."""
+    if checkpoint or resume:
+        return process_map_checkpointed(file_in, validate, workers, parser, resume)
+    # compressed and PBF files cannot be split into byte ranges; their
+    # decompression and decoding run in parallel instead (compressed.py, pbf.py)
+    if workers > 1 and not compressed.is_compressed(file_in) and not pbf.is_pbf(file_in):
+        return process_map_parallel(file_in, validate, workers, parser=parser)
+    dirname = os.path.dirname(file_in)
+    with ExitStack() as stack:
+        writers = open_writers(stack, dirname)
+        return write_elements(get_elements(file_in, parser), writers, validate)
 
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema"""
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_string = pprint.pformat(errors)
-        
-        raise Exception(message_string.format(field, error_string))
+
+def process_map_parallel(file_in, validate, workers, chunk_size=chunks.CHUNK_SIZE, parser="etree"):
+    """Process byte ranges of the file in worker processes, and merge the results
+    in element order."""
+    report = validation.ValidationReport() if validate else None
+    dirname = os.path.dirname(file_in)
+    # several chunks per worker, so that workers finishing early get more work
+    ranges = chunks.split(file_in, workers * 4, chunk_size)
+    # create the output files with their header lines
+    with ExitStack() as stack:
+        open_writers(stack, dirname)
+    with ExitStack() as stack:
+        tmpdir = stack.enter_context(tempfile.TemporaryDirectory(dir=dirname or None))
+        outfiles = [stack.enter_context(open(os.path.join(dirname, filename), 'ab'))
+                    for filename, _ in CSV_FILES]
+        tasks = [(file_in, start, end, validate, tmpdir, i, parser) for i, (start, end) in enumerate(ranges)]
+        with multiprocessing.Pool(workers) as pool:
+            # imap returns results in order, later chunks are processed meanwhile
+            for index, chunk_report, cache_stats, _ in pool.imap(process_chunk, tasks):
+                if report is not None:
+                    report.merge(chunk_report)
+                CLEANING_CACHE.stats.update(cache_stats)
+                append_chunk(outfiles, tmpdir, index)
+    return report
 
 
 # ================================================== #
-#               Main Function                        #
+#               Checkpoints                          #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
+def read_checkpoint(path):
+    """Return the checkpoint state written by write_checkpoint, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def write_checkpoint(path, state):
+    """Write the checkpoint state atomically: a killed run leaves the previous
+    checkpoint or the new one, never a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding="utf-8") as fp:
+        json.dump(state, fp, indent=2)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+def process_map_checkpointed(file_in, validate, workers=1, parser="etree", resume=False,
+                             chunk_size=CHECKPOINT_SIZE):
+    """Process byte ranges of about chunk_size bytes in order (in worker processes
+    if workers > 1), and write a checkpoint after each range. With resume,
+    continue after the checkpoint of an interrupted run, if there is one."""
+    if compressed.is_compressed(file_in) or pbf.is_pbf(file_in):
+        raise ValueError("checkpoints need byte offsets in an uncompressed OSM XML file, %s is not one" % file_in)
     dirname = os.path.dirname(file_in)
-    with open(os.path.join(dirname, NODES_FILE), 'w', encoding="utf-8", newline='') as nodes_file, \
-         open(os.path.join(dirname, NODE_TAGS_FILE), 'w', encoding="utf-8", newline='') as nodes_tags_file, \
-         open(os.path.join(dirname, WAYS_FILE), 'w', encoding="utf-8", newline='') as ways_file, \
-         open(os.path.join(dirname, WAY_NODES_FILE), 'w', encoding="utf-8", newline='') as way_nodes_file, \
-         open(os.path.join(dirname, WAY_TAGS_FILE), 'w', encoding="utf-8", newline='') as way_tags_file:
-
-        nodes_writer = csv.DictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = csv.DictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = csv.DictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = csv.DictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = csv.DictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+    checkpoint_path = os.path.join(dirname, CHECKPOINT_FILE)
+    input_size = os.path.getsize(file_in)
+    state = read_checkpoint(checkpoint_path) if resume else None
+    if state is None:
+        # the ranges are stored, so that a resumed run uses the same ones
+        state = {"input": os.path.abspath(file_in), "input_size": input_size,
+                 "n_chunks": workers * 4, "chunk_size": chunk_size,
+                 "offset": 0, "last_id": None, "elements": 0, "sizes": None,
+                 "report": None, "cache_stats": {}}
+        # create the output files with their header lines
+        with ExitStack() as stack:
+            open_writers(stack, dirname)
+    else:
+        if state["input"] != os.path.abspath(file_in) or state["input_size"] != input_size:
+            raise ValueError("%s is the checkpoint of %s (%i bytes), not of %s"
+                             % (checkpoint_path, state["input"], state["input_size"], file_in))
+        print("resuming after element %s (%i elements) at byte %i" % (state["last_id"], state["elements"],
+                                                                     state["offset"]))
+        # drop what was written after the checkpoint
+        for filename, _ in CSV_FILES:
+            with open(os.path.join(dirname, filename), 'r+b') as fp:
+                fp.truncate(state["sizes"][filename])
+        CLEANING_CACHE.stats.update(state["cache_stats"])
+
+    report = None
+    if validate:
+        report = (validation.ValidationReport.from_dict(state["report"]) if state["report"]
+                  else validation.ValidationReport())
+    ranges = [(start, end) for start, end in chunks.split(file_in, state["n_chunks"], state["chunk_size"])
+              if start >= state["offset"]]
+    with ExitStack() as stack:
+        tmpdir = stack.enter_context(tempfile.TemporaryDirectory(dir=dirname or None))
+        outfiles = [stack.enter_context(open(os.path.join(dirname, filename), 'ab'))
+                    for filename, _ in CSV_FILES]
+        tasks = [(file_in, start, end, validate, tmpdir, i, parser) for i, (start, end) in enumerate(ranges)]
+        if workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(workers))
+            results = pool.imap(process_chunk, tasks)
+        else:
+            results = map(process_chunk, tasks)
+        for index, chunk_report, cache_stats, progress in results:
+            if report is not None:
+                report.merge(chunk_report)
+            if workers > 1:
+                CLEANING_CACHE.stats.update(cache_stats)
+            append_chunk(outfiles, tmpdir, index)
+            # the csv files must be on disk before the checkpoint that refers to them
+            for outfile in outfiles:
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            state["offset"] = ranges[index][1]
+            if progress["last_id"] is not None:
+                state["last_id"] = progress["last_id"]
+            state["elements"] += progress["elements"]
+            state["sizes"] = {filename: outfile.tell() for outfile, (filename, _) in zip(outfiles, CSV_FILES)}
+            state["report"] = report.to_dict() if report is not None else None
+            state["cache_stats"] = dict(CLEANING_CACHE.stats)
+            write_checkpoint(checkpoint_path, state)
+    # done, nothing to resume
+    os.remove(checkpoint_path)
+    return report
+
+
+# ================================================== #
+#               Pipeline                             #
+# ================================================== #
+class StageTimes(object):
+    """Wall time of a pipeline stage, and the part of it spent waiting on a queue
+    (or for the next stage)."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.seconds = 0.0
+        self.idle = 0.0
+
+    def wait(self, func, *args):
+        """Call func (a blocking queue operation), counting the time as idle."""
+        t0 = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.idle += time.perf_counter() - t0
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.t0
+
+
+class Stopped(Exception):
+    """The pipeline was stopped while waiting on a queue."""
+
+
+def queue_put(q, item, stop):
+    """Put item into q, waiting while it is full. Raise Stopped if the stop event
+    is set in the meantime."""
+    while not stop.is_set():
+        try:
+            return q.put(item, timeout=STOP_TIMEOUT)
+        except queue.Full:
+            pass
+    raise Stopped()
+
+
+def queue_get(q, stop):
+    """Return the next item of q, waiting while it is empty. Raise Stopped if the
+    stop event is set in the meantime."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=STOP_TIMEOUT)
+        except queue.Empty:
+            pass
+    raise Stopped()
+
+
+def parse_stage(file_in, parser, q, times, batch_size, errors, stop):
+    """Parser thread: put batches of element records into q, then None. An
+    exception is added to errors and stops the pipeline. Returns, closing the
+    input file, when the pipeline is stopped."""
+    try:
+        with closing(get_elements(file_in, parser)) as elements:
+            batch = []
+            for element in elements:
+                # ElementTree elements are cleared after use, and records pickle faster
+                batch.append(element if isinstance(element, fastparse.Element) else fastparse.from_etree(element))
+                if len(batch) == batch_size:
+                    times.wait(queue_put, q, batch, stop)
+                    batch = []
+        if batch:
+            times.wait(queue_put, q, batch, stop)
+        times.wait(queue_put, q, None, stop)
+    except Stopped:
+        pass
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        times.stop()
+
+
+def shape_batch(task):
+    """Pipeline worker: shape (and validate) a batch of element records. Return
+    the csv text per csv file, the validation report, the cleaning cache
+    statistics and the time spent."""
+    records, validate = task
+    t0 = time.perf_counter()
+    stats_before = CLEANING_CACHE.stats.copy()
+    validator = validation.Validator(SCHEMA) if validate else None
+    batches = [[], [], [], [], []]
+    for record in records:
+        add_rows(batches, record, validator)
+    # formatted here, in parallel, and a string is passed back faster than rows
+    texts = []
+    for rows in batches:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        texts.append(buf.getvalue())
+    return (texts, validator.report if validator else None, CLEANING_CACHE.stats - stats_before,
+            time.perf_counter() - t0)
+
+
+def write_stage(files, q, times, errors, stop):
+    """Writer thread: write the csv texts of q to the csv files, until None. An
+    exception is added to errors and stops the pipeline."""
+    try:
+        while True:
+            texts = times.wait(queue_get, q, stop)
+            if texts is None:
+                break
+            for fp, text in zip(files, texts):
+                if text:
+                    fp.write(text)
+    except Stopped:
+        pass
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        times.stop()
+
+
+def process_map_pipelined(file_in, validate, workers=1, batch_size=PIPELINE_BATCH_SIZE, queue_size=QUEUE_SIZE,
+                          parser="etree"):
+    """Run parsing (a thread), shaping and validation (a pool of worker processes)
+    and writing (a thread with large file buffers) as a pipeline connected by
+    bounded queues. The csv files are the same as with process_map. Return the
+    validation.ValidationReport (or None if not validating) and the
+    {stage: StageTimes} of the parse, transform, write stages. The first error of
+    a stage stops the pipeline, and is raised."""
+    report = validation.ValidationReport() if validate else None
+    dirname = os.path.dirname(file_in)
+    times = {"parse": StageTimes(), "transform": StageTimes(), "write": StageTimes()}
+    transform_busy = 0.0
+    errors = []  # of the parse and write threads
+    stop = threading.Event()
+    with ExitStack() as stack:
+        files = open_csv_files(stack, dirname, buffering=WRITE_BUFFER_SIZE)
+        # the pool is forked before the threads start
+        pool = stack.enter_context(multiprocessing.Pool(workers))
+        parsed, shaped = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+        parse_thread = threading.Thread(target=parse_stage, daemon=True,
+                                        args=(file_in, parser, parsed, times["parse"], batch_size, errors, stop))
+        write_thread = threading.Thread(target=write_stage, args=(files, shaped, times["write"], errors, stop),
+                                        daemon=True)
+        parse_thread.start()
+        write_thread.start()
+
+        def collect(result):
+            nonlocal transform_busy
+            texts, batch_report, cache_stats, seconds = result.get()
+            if report is not None:
+                report.merge(batch_report)
+            CLEANING_CACHE.stats.update(cache_stats)
+            transform_busy += seconds
+            # results in order of submission: the output order is deterministic
+            queue_put(shaped, texts, stop)
+
+        # batches in flight in the pool, oldest first
+        pending = deque()
+        try:
+            while True:
+                batch = queue_get(parsed, stop)
+                if batch is None:
+                    break
+                pending.append(pool.apply_async(shape_batch, ((batch, validate),)))
+                if len(pending) >= 2 * workers:
+                    collect(pending.popleft())
+            while pending:
+                collect(pending.popleft())
+            queue_put(shaped, None, stop)
+            write_thread.join()
+        except Stopped:
+            # the parse or write thread failed
+            raise errors[0] from None
+        finally:
+            # after an error: stop the threads, unblock the parser and wait for both
+            stop.set()
+            while not parsed.empty():
+                parsed.get_nowait()
+            parse_thread.join()
+            write_thread.join()
+    times["transform"].stop()
+    # the workers are idle when they wait for batches
+    times["transform"].idle = max(0.0, workers * times["transform"].seconds - transform_busy)
+    times["transform"].seconds *= workers
+    if errors:
+        raise errors[0]
+    return report, times
+
+
+def format_stage_times(times):
+    lines = ["%-10s %9s %9s %7s" % ("stage", "time s", "idle s", "idle")]
+    for name, t in times.items():
+        lines.append("%-10s %9.2f %9.2f %6.0f%%" % (name, t.seconds, t.idle,
+                                                    100.0 * t.idle / t.seconds if t.seconds > 0 else 0))
+    return "\n".join(lines)
 
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
+    import argparse
+
+    import instrument
+
     OSM_PATH = "full/ruegen_20200416.osm"
-    process_map(OSM_PATH, validate=False)
+
+    parser = argparse.ArgumentParser(description='Clean OSM file and write csv files next to it.')
+    parser.add_argument('osmpath', type=str, nargs='?', default=OSM_PATH, help='Path to OSM file')
+    parser.add_argument('--validate', action='store_true', help='Validate elements against schema')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--parser', choices=PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='write a checkpoint after every range of the file, to be able to --resume')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted --checkpoint run from its last checkpoint')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run parsing, shaping (in --workers processes) and writing as a pipeline')
+    parser.add_argument('--instrument', type=str, metavar='REPORT.json',
+                        help='measure the stages, print progress to stderr and write a JSON report')
+    parser.add_argument('--progress', type=float, default=instrument.PROGRESS_INTERVAL,
+                        help='seconds between progress lines with --instrument')
+    args = parser.parse_args()
+    if args.instrument and (args.workers > 1 or args.pipeline):
+        parser.error("--instrument measures a single process, use --workers 1 without --pipeline")
+    if args.pipeline and (args.checkpoint or args.resume):
+        parser.error("--pipeline cannot be combined with --checkpoint or --resume")
+
+    with ExitStack() as stack:
+        if args.instrument:
+            instr = stack.enter_context(instrument.Instrumentation(args.progress))
+            instrument.instrument_prepare_csv(instr, sys.modules[__name__])
+        if args.pipeline:
+            report, times = process_map_pipelined(args.osmpath, args.validate, args.workers, parser=args.parser)
+            print(format_stage_times(times))
+        else:
+            report = process_map(args.osmpath, validate=args.validate, workers=args.workers, parser=args.parser,
+                                 checkpoint=args.checkpoint, resume=args.resume)
+    if args.instrument:
+        instr.write_report(args.instrument)
+    if report is not None:
+        print(report.format())
+    print(CLEANING_CACHE.format_stats())
\ No newline at end of file
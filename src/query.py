@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Query layer for the database, used by queries.ipynb and dashboards.
+
+- Connections are read only (SQLite URI mode=ro) and kept in a pool for reuse.
+- Every connection caches its prepared statements (sqlite3 cached_statements).
+- Results are cached in an LRU cache keyed on the SQL, the parameters and the
+  identity of the database file (modification time and size, also of a -wal
+  file, and the change counter in the SQLite file header). Reloading or updating
+  the database changes the identity, so old results are never returned.
+- Every query is timed. The timings are kept in Database.timings and logged to
+  the logger "query" at level INFO (DEBUG for cached results).
+- A Database can be shared by threads: the pool is a thread safe queue, the
+  result cache and the timings are guarded by Database.lock.
+
+If run as a main program, it runs a query and prints the result.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from clean_cache import LRUCache
+
+Result = namedtuple("Result", ["columns", "rows"])
+Timing = namedtuple("Timing", ["sql", "params", "seconds", "cached"])
+
+POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
+RESULT_CACHE_SIZE = 256
+MAX_TIMINGS = 10000
+
+logger = logging.getLogger("query")
+
+
+class Database(object):
+    """Read only access to the database file at dbpath."""
+
+    def __init__(self, dbpath, pool_size=POOL_SIZE, statement_cache_size=STATEMENT_CACHE_SIZE,
+                 result_cache_size=RESULT_CACHE_SIZE):
+        self.dbpath = os.path.abspath(dbpath)
+        self.statement_cache_size = statement_cache_size
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.results = LRUCache(result_cache_size)
+        self.results_identity = None
+        self.lock = threading.Lock()
+        self.timings = []
+
+    def connect(self):
+        return sqlite3.connect("file:%s?mode=ro" % self.dbpath, uri=True, check_same_thread=False,
+                               cached_statements=self.statement_cache_size)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool. Return it afterwards, or close it if the pool is full."""
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def identity(self):
+        """Return the identity of the database file, changing whenever it is written."""
+        ident = []
+        for path in (self.dbpath, self.dbpath + "-wal"):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            ident.append((st.st_mtime_ns, st.st_size))
+        # file change counter, incremented by every committed transaction
+        with open(self.dbpath, "rb") as fp:
+            fp.seek(24)
+            ident.append(fp.read(4))
+        return tuple(ident)
+
+    def execute(self, sql, params=()):
+        """Run the query on a pooled connection and return a Result."""
+        with self.connection() as conn:
+            cur = conn.execute(sql, params)
+            columns = tuple(d[0] for d in cur.description) if cur.description else ()
+            rows = tuple(cur.fetchall())
+        return Result(columns, rows)
+
+    def query(self, sql, params=()):
+        """Return the Result of the query, from the result cache if possible."""
+        t0 = time.perf_counter()
+        ident = self.identity()
+        if isinstance(params, dict):
+            key_params = tuple(sorted(params.items()))
+        else:
+            key_params = tuple(params)
+        key = (sql, key_params)
+        with self.lock:
+            if ident != self.results_identity:
+                # the database file changed, all cached results are invalid
+                self.results = LRUCache(self.results.maxsize)
+                self.results_identity = ident
+            result = self.results.lookup(key)
+        cached = result is not None
+        if not cached:
+            result = self.execute(sql, params)
+            with self.lock:
+                if ident == self.results_identity:
+                    self.results.put(key, result)
+        self.log_timing(sql, key_params, time.perf_counter() - t0, cached)
+        return result
+
+    def dataframe(self, sql, params=()):
+        """Return the result of the query as pandas.DataFrame."""
+        import pandas as pd
+        result = self.query(sql, params)
+        return pd.DataFrame(list(result.rows), columns=list(result.columns))
+
+    def log_timing(self, sql, params, seconds, cached):
+        with self.lock:
+            if len(self.timings) >= MAX_TIMINGS:
+                del self.timings[:MAX_TIMINGS // 2]
+            self.timings.append(Timing(sql, params, seconds, cached))
+        logger.log(logging.DEBUG if cached else logging.INFO, "%.4f s%s: %s %s",
+                   seconds, " (cached)" if cached else "", " ".join(sql.split()), params or "")
+
+    def clear_cache(self):
+        with self.lock:
+            self.results = LRUCache(self.results.maxsize)
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a query against the database and print the result.')
+    parser.add_argument('dbpath', type=str, help='Path to database file')
+    parser.add_argument('sql', type=str, help='SQL query')
+    parser.add_argument('--repeat', type=int, default=1, help='run the query several times, to see the caching')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+    db = Database(args.dbpath)
+    for _ in range(args.repeat):
+        result = db.query(args.sql)
+    print("\t".join(result.columns))
+    for row in result.rows:
+        print("\t".join(str(v) for v in row))
+    db.close()
@@ -1,34 +1,236 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+Take a sample of an OSM file into a smaller OSM file.
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+Sampling modes:
+- every: every k-th top level element
+- reservoir: n top level elements drawn at random (reservoir sampling, one pass)
+- stratified: n random elements per element type, or per tag key (--by key)
+- bbox: the nodes in a bounding box, the ways with a node in it and the
+  relations with a member in the sample
+
+With --closure the nodes of the sampled ways are added, so that no way of the
+sample references a missing node.
+
+Nothing is parsed into a tree: top level elements are split by chunks.py, the
+few attributes a mode needs (id, lat, lon, nd refs, tag keys) are read from the
+raw bytes with regular expressions, and the sampled elements are copied to the
+sample as they are, in the order of the file, after the head of the file
+(declaration, root element and bounds). Compressed files (.osm.gz, .osm.bz2)
+are read directly (compressed.py).
+
+If run as a main program, it writes the sample of OSM_FILE to SAMPLE_FILE, or
+of the given files.
+"""
+import html
+import random
+import re
+
+import chunks
+import compressed
+import pbf
 
 OSM_FILE = "full/ruegen_20200416.osm"  # Replace this with your osm file
 SAMPLE_FILE = "sample/ruegen_20200416_sample.osm"
 
 k = 20 # Parameter: take every k-th top level element
 
-def get_element(osm_file, tags=('node', 'way')):
-    """Yield element if it is the right type of tag
-
-    Reference:
-    http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
-    """
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
-
-
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write(b'<osm>\n  ')
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding="utf-8"))
-    # closing tag
-    output.write(b'</osm>')
+MODES = ["every", "reservoir", "stratified", "bbox"]
+TOP_LEVEL = ("node", "way", "relation")
+
+# attributes in the raw bytes of an element; the first id is the one of the element
+RE_ID = re.compile(rb"""\sid=["'](-?\d+)""")
+RE_LAT = re.compile(rb"""\slat=["'](-?[\d.]+)""")
+RE_LON = re.compile(rb"""\slon=["'](-?[\d.]+)""")
+RE_ND_REF = re.compile(rb"""<nd\s[^>]*?ref=["'](-?\d+)""")
+RE_MEMBER = re.compile(rb"""<member\s[^>]*?type=["'](\w+)["'][^>]*?ref=["'](-?\d+)""")
+RE_TAG_KEY = re.compile(rb"""<tag\s[^>]*?k=(["'])(.*?)\1""")
+RE_BOUNDS = re.compile(rb"<bounds\s[^>]*>")
+
+
+def element_id(data):
+    return int(RE_ID.search(data).group(1))
+
+
+def node_position(data):
+    """Return (lat, lon) of a node."""
+    return float(RE_LAT.search(data).group(1)), float(RE_LON.search(data).group(1))
+
+
+def way_refs(data):
+    return [int(ref) for ref in RE_ND_REF.findall(data)]
+
+
+def relation_members(data):
+    """Return [(type, ref)] of a relation."""
+    return [(typ.decode(), int(ref)) for typ, ref in RE_MEMBER.findall(data)]
+
+
+def tag_keys(data):
+    return [html.unescape(key.decode("utf-8")) for _, key in RE_TAG_KEY.findall(data)]
+
+
+class Reservoir(object):
+    """Uniform random sample of at most size items of a stream (algorithm R)."""
+
+    def __init__(self, size, rnd):
+        self.size = size
+        self.rnd = rnd
+        self.seen = 0
+        self.items = []
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            i = self.rnd.randrange(self.seen)
+            if i < self.size:
+                self.items[i] = item
+
+
+# ================================================== #
+#               Sampling modes                       #
+# ================================================== #
+# Every mode takes the (name, offset, data) of the top level elements and
+# returns the sampled ones.
+
+def sample_every(elements, k=k):
+    return [element for i, element in enumerate(elements) if i % k == 0]
+
+
+def sample_reservoir(elements, n, seed=0):
+    reservoir = Reservoir(n, random.Random(seed))
+    for element in elements:
+        reservoir.add(element)
+    return reservoir.items
+
+
+def sample_stratified(elements, n, by="type", seed=0):
+    """Sample n elements per element type (by "type") or per tag key (by "key";
+    elements without tags form a stratum of their own)."""
+    rnd = random.Random(seed)
+    strata = {}
+    for element in elements:
+        name, _, data = element
+        for stratum in [name] if by == "type" else (tag_keys(data) or [None]):
+            if stratum not in strata:
+                strata[stratum] = Reservoir(n, rnd)
+            strata[stratum].add(element)
+    # an element may be sampled in several strata
+    sampled = {}
+    for reservoir in strata.values():
+        for element in reservoir.items:
+            sampled[element[1]] = element
+    return list(sampled.values())
+
+
+def sample_bbox(elements, bbox):
+    """Sample the nodes in bbox (min_lat, min_lon, max_lat, max_lon), the ways with
+    a node in it, and the relations with a member in the sample."""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    ids = {"node": set(), "way": set(), "relation": set()}
+    sampled = []
+    for element in elements:
+        name, _, data = element
+        if name == "node":
+            lat, lon = node_position(data)
+            inside = min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+        elif name == "way":
+            inside = any(ref in ids["node"] for ref in way_refs(data))
+        else:
+            inside = any(ref in ids.get(typ, ()) for typ, ref in relation_members(data))
+        if inside:
+            ids[name].add(element_id(data))
+            sampled.append(element)
+    return sampled
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def head(osmpath):
+    """Return the bytes of the file before the first top level element."""
+    with compressed.open_osm(osmpath, workers=1) as fp:
+        data = b""
+        while True:
+            block = fp.read(chunks.BLOCK_SIZE)
+            data += block
+            m = chunks.RE_ELEMENT.search(data)
+            if m or not block:
+                return data[:m.start()] if m else data
+
+
+def write_sample(osmpath, sample_path, sampled, closure=False, bbox=None):
+    """Copy the sampled (name, offset, data) elements to sample_path in file order.
+    With closure, add the nodes of the sampled ways. Return the number of
+    elements written."""
+    data_head = head(osmpath)
+    if bbox is not None:
+        bounds = '<bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>' % tuple(bbox)
+        data_head = RE_BOUNDS.sub(bounds.encode(), data_head, count=1)
+    n = 0
+    with open(sample_path, "wb") as output:
+        output.write(data_head)
+        if closure:
+            offsets = {offset for _, offset, _ in sampled}
+            nodes = {ref for name, _, data in sampled if name == "way" for ref in way_refs(data)}
+            # second pass for the nodes, which come before the ways
+            for name, offset, data in chunks.iter_raw_elements(osmpath):
+                if offset in offsets or (name == "node" and element_id(data) in nodes):
+                    output.write(data)
+                    n += 1
+        else:
+            for _, _, data in sorted(sampled, key=lambda element: element[1]):
+                output.write(data)
+                n += 1
+        output.write(b"</osm>\n")
+    return n
+
+
+def sample(osm_file=OSM_FILE, sample_file=SAMPLE_FILE, mode="every", k=k, n=1000, by="type", bbox=None,
+           closure=False, types=TOP_LEVEL, seed=0):
+    """Write a sample of the top level elements of the given types of osm_file to
+    sample_file. Return the number of elements written."""
+    if pbf.is_pbf(osm_file):
+        raise ValueError("%s is a PBF file, sampling copies the elements of OSM XML files" % osm_file)
+    elements = (element for element in chunks.iter_raw_elements(osm_file) if element[0] in types)
+    if mode == "every":
+        sampled = sample_every(elements, k)
+    elif mode == "reservoir":
+        sampled = sample_reservoir(elements, n, seed)
+    elif mode == "stratified":
+        sampled = sample_stratified(elements, n, by, seed)
+    elif mode == "bbox":
+        sampled = sample_bbox(elements, bbox)
+    else:
+        raise ValueError("unknown mode %r, use one of %s" % (mode, ", ".join(MODES)))
+    return write_sample(osm_file, sample_file, sampled, closure, bbox if mode == "bbox" else None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write a sample of an OSM file.')
+    parser.add_argument('osmpath', type=str, nargs='?', default=OSM_FILE, help='Path to OSM file')
+    parser.add_argument('samplepath', type=str, nargs='?', default=SAMPLE_FILE, help='Path of the sample file')
+    parser.add_argument('--mode', choices=MODES, default="every", help='sampling mode')
+    parser.add_argument('-k', type=int, default=k, help='every: take every k-th top level element')
+    parser.add_argument('-n', type=int, default=1000,
+                        help='reservoir: number of elements, stratified: number of elements per stratum')
+    parser.add_argument('--by', choices=["type", "key"], default="type",
+                        help='stratified: strata are the element types or the tag keys')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'),
+                        help='bbox: bounding box of the sample')
+    parser.add_argument('--closure', action='store_true', help='add the nodes of the sampled ways')
+    parser.add_argument('--types', type=str, nargs='+', choices=TOP_LEVEL, default=TOP_LEVEL,
+                        help='types of the elements to sample')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    if args.mode == "bbox" and args.bbox is None:
+        parser.error("--mode bbox needs --bbox")
 
+    n = sample(args.osmpath, args.samplepath, args.mode, args.k, args.n, args.by, args.bbox, args.closure,
+               args.types, args.seed)
+    print("%i elements written to %s" % (n, args.samplepath))
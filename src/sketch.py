@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fixed memory summaries of streams too large to count exactly.
+
+- CountMinSketch: frequencies of items. An estimate is never below the true
+  count, and above it by at most epsilon * total with probability 1 - delta.
+- TopK: the k most frequent items (heavy hitters), with count-min estimates.
+- HyperLogLog: number of distinct items, with a standard error of
+  1.04 / sqrt(2 ** precision).
+
+Items are hashed with a 64 bit blake2b hash, so that the results are the same in
+every run (str hashes are randomized per process). Used by tags.py --stats.
+"""
+import hashlib
+import math
+from array import array
+
+EPSILON = 0.001  # count-min error, as a fraction of the total count
+DELTA = 0.01  # probability that an estimate exceeds the error bound
+PRECISION = 12  # HyperLogLog registers: 2 ** PRECISION
+
+
+def hash64(item):
+    """Return a 64 bit hash of a string."""
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class CountMinSketch(object):
+    """Count-min sketch of depth rows of width counters."""
+
+    def __init__(self, epsilon=EPSILON, delta=DELTA):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.rows = [array("q", bytes(8 * self.width)) for _ in range(self.depth)]
+        self.total = 0
+
+    def columns(self, h):
+        # depth hash functions from the two halves of one hash (Kirsch and Mitzenmacher)
+        h1, h2 = h & 0xffffffff, h >> 32
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        """Add count occurrences of item. Return the new estimate of its count."""
+        return self.add_hash(hash64(item), count)
+
+    def add_hash(self, h, count=1):
+        """Like add, with the hash64 of the item."""
+        self.total += count
+        estimate = None
+        for row, column in zip(self.rows, self.columns(h)):
+            value = row[column] + count
+            row[column] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+    def estimate(self, item):
+        return min(row[column] for row, column in zip(self.rows, self.columns(hash64(item))))
+
+    def error(self):
+        """Return the largest overestimate, with probability 1 - delta."""
+        return self.epsilon * self.total
+
+    def memory(self):
+        return sum(row.itemsize * len(row) for row in self.rows)
+
+
+class TopK(object):
+    """The k items with the largest estimated counts seen so far."""
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self.threshold = 0  # no item with an estimate up to this enters a full list
+
+    def offer(self, item, estimate):
+        """Update item with its current estimate. Return the item it replaced, if any."""
+        counts = self.counts
+        if item in counts or len(counts) < self.k:
+            counts[item] = estimate
+            return None
+        if estimate <= self.threshold:
+            return None
+        smallest = min(counts, key=counts.get)
+        if estimate <= counts[smallest]:
+            self.threshold = counts[smallest]
+            return None
+        del counts[smallest]
+        counts[item] = estimate
+        self.threshold = min(counts.values())
+        return smallest
+
+    def items(self):
+        """Return [(item, estimate)], largest first."""
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+
+
+class HyperLogLog(object):
+    """Distinct count estimate with 2 ** precision one byte registers."""
+
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, item):
+        self.add_hash(hash64(item))
+
+    def add_hash(self, h):
+        """Like add, with the hash64 of the item."""
+        bits = 64 - self.precision
+        index = h >> bits
+        rest = h & ((1 << bits) - 1)
+        # position of the leftmost 1 bit of rest
+        rank = bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def error(self):
+        """Return the relative standard error."""
+        return 1.04 / math.sqrt(self.m)
+
+    def memory(self):
+        return len(self.registers)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Spatial index and bounding box / radius queries on nodes and ways.
+
+build_spatial_index creates two SQLite R*Tree virtual tables:
+- nodes_rtree: one point box per node
+- ways_rtree: the bounding box of every way, computed from ways_nodes joined to nodes
+
+The R*Tree stores 32 bit floats, rounded outwards, so the index is used to find
+candidates, and the exact coordinates are checked afterwards: for nodes in the
+nodes table, for ways in auxiliary columns of ways_rtree holding the exact box.
+
+If run as a main program, it builds the index for a database ("build"), or
+compares indexed queries with the equivalent full scans ("benchmark").
+"""
+import math
+import random
+import sqlite3
+import time
+
+EARTH_RADIUS = 6371008.8  # mean earth radius in m
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+SPATIAL_SCHEMA = """
+DROP TABLE IF EXISTS nodes_rtree;
+DROP TABLE IF EXISTS ways_rtree;
+CREATE VIRTUAL TABLE nodes_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE VIRTUAL TABLE ways_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon,
+                                            +exact_min_lat, +exact_max_lat, +exact_min_lon, +exact_max_lon);
+"""
+
+NODES_RTREE_INSERT = """
+INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon)
+    SELECT id, lat, lat, lon, lon
+    FROM nodes
+    WHERE lat IS NOT NULL AND lon IS NOT NULL {};
+"""
+
+WAYS_RTREE_INSERT = """
+INSERT INTO ways_rtree (id, min_lat, max_lat, min_lon, max_lon,
+                        exact_min_lat, exact_max_lat, exact_min_lon, exact_max_lon)
+    SELECT wn.id, min(n.lat), max(n.lat), min(n.lon), max(n.lon),
+           min(n.lat), max(n.lat), min(n.lon), max(n.lon)
+    FROM ways_nodes wn
+         JOIN nodes n ON n.id = wn.node_id
+    {}
+    GROUP BY wn.id;
+"""
+
+
+def build_spatial_index(conn):
+    """(Re)create and fill the R*Tree tables."""
+    cur = conn.cursor()
+    cur.executescript(SPATIAL_SCHEMA)
+    cur.execute(NODES_RTREE_INSERT.format(""))
+    cur.execute(WAYS_RTREE_INSERT.format(""))
+    conn.commit()
+
+
+def has_spatial_index(cur):
+    cur.execute("select count(*) from sqlite_master where name in ('nodes_rtree', 'ways_rtree');")
+    return cur.fetchone()[0] == 2
+
+
+def refresh_spatial_index(cur, node_ids, way_ids):
+    """Update the index for changed nodes and ways, e.g. after update_database.
+    Ways using a changed node get a new bounding box, too. Does not commit."""
+    if not has_spatial_index(cur):
+        return
+    node_ids = list(node_ids)
+    way_ids = set(way_ids)
+    for i in range(0, len(node_ids), 500):
+        batch = node_ids[i:i + 500]
+        marks = ", ".join("?" * len(batch))
+        cur.execute("delete from nodes_rtree where id in (%s);" % marks, batch)
+        cur.execute(NODES_RTREE_INSERT.format("AND id IN (%s)" % marks), batch)
+        cur.execute("select distinct id from ways_nodes where node_id in (%s);" % marks, batch)
+        way_ids.update(row[0] for row in cur.fetchall())
+    way_ids = list(way_ids)
+    for i in range(0, len(way_ids), 500):
+        batch = way_ids[i:i + 500]
+        marks = ", ".join("?" * len(batch))
+        cur.execute("delete from ways_rtree where id in (%s);" % marks, batch)
+        cur.execute(WAYS_RTREE_INSERT.format("WHERE wn.id IN (%s)" % marks), batch)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in m."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lon, radius):
+    """Return (min_lat, min_lon, max_lat, max_lon) enclosing the circle (radius in m)."""
+    dlat = radius / METERS_PER_DEGREE
+    coslat = math.cos(math.radians(min(89.9, abs(lat) + dlat)))
+    dlon = min(180.0, radius / (METERS_PER_DEGREE * coslat))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+# ================================================== #
+#               Indexed queries                      #
+# ================================================== #
+def nodes_in_bbox(conn, min_lat, min_lon, max_lat, max_lon):
+    """Return [(id, lat, lon)] of the nodes inside the box."""
+    return conn.execute("""
+        SELECT n.id, n.lat, n.lon
+        FROM nodes_rtree r
+             JOIN nodes n ON n.id = r.id
+        WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat
+          AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon
+          AND n.lat BETWEEN :min_lat AND :max_lat
+          AND n.lon BETWEEN :min_lon AND :max_lon
+        ORDER BY n.id;""",
+        {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}).fetchall()
+
+
+def ways_in_bbox(conn, min_lat, min_lon, max_lat, max_lon):
+    """Return [(id, min_lat, min_lon, max_lat, max_lon)] of the ways whose bounding
+    box intersects the box."""
+    return conn.execute("""
+        SELECT id, exact_min_lat, exact_min_lon, exact_max_lat, exact_max_lon
+        FROM ways_rtree
+        WHERE max_lat >= :min_lat AND min_lat <= :max_lat
+          AND max_lon >= :min_lon AND min_lon <= :max_lon
+          AND exact_max_lat >= :min_lat AND exact_min_lat <= :max_lat
+          AND exact_max_lon >= :min_lon AND exact_min_lon <= :max_lon
+        ORDER BY id;""",
+        {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}).fetchall()
+
+
+def nodes_in_radius(conn, lat, lon, radius):
+    """Return [(distance, id, lat, lon)] of the nodes within radius m, nearest first."""
+    result = []
+    for nid, nlat, nlon in nodes_in_bbox(conn, *radius_bbox(lat, lon, radius)):
+        d = haversine(lat, lon, nlat, nlon)
+        if d <= radius:
+            result.append((d, nid, nlat, nlon))
+    return sorted(result)
+
+
+# ================================================== #
+#               Scan based equivalents               #
+# ================================================== #
+def nodes_in_bbox_scan(conn, min_lat, min_lon, max_lat, max_lon):
+    return conn.execute("""
+        SELECT id, lat, lon
+        FROM nodes
+        WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?
+        ORDER BY id;""", (min_lat, max_lat, min_lon, max_lon)).fetchall()
+
+
+def ways_in_bbox_scan(conn, min_lat, min_lon, max_lat, max_lon):
+    return conn.execute("""
+        SELECT wn.id, min(n.lat) AS min_lat, min(n.lon) AS min_lon, max(n.lat) AS max_lat, max(n.lon) AS max_lon
+        FROM ways_nodes wn
+             JOIN nodes n ON n.id = wn.node_id
+        GROUP BY wn.id
+        HAVING max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+        ORDER BY wn.id;""", (min_lat, max_lat, min_lon, max_lon)).fetchall()
+
+
+def nodes_in_radius_scan(conn, lat, lon, radius):
+    result = []
+    for nid, nlat, nlon in conn.execute("SELECT id, lat, lon FROM nodes WHERE lat IS NOT NULL;"):
+        d = haversine(lat, lon, nlat, nlon)
+        if d <= radius:
+            result.append((d, nid, nlat, nlon))
+    return sorted(result)
+
+
+def benchmark(conn, n_queries=20, size=0.01, radius=500, seed=0):
+    """Time indexed queries against the scans, for random boxes of size degrees and
+    circles of radius m inside the data extent. Return {query: (indexed s, scan s)}."""
+    rnd = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = conn.execute(
+        "SELECT min(lat), min(lon), max(lat), max(lon) FROM nodes;").fetchone()
+    boxes, points = [], []
+    for _ in range(n_queries):
+        lat = rnd.uniform(min_lat, max_lat)
+        lon = rnd.uniform(min_lon, max_lon)
+        boxes.append((lat, lon, lat + size, lon + size))
+        points.append((lat, lon, radius))
+
+    timings = {}
+    for name, indexed, scan, queries in [("nodes_in_bbox", nodes_in_bbox, nodes_in_bbox_scan, boxes),
+                                         ("ways_in_bbox", ways_in_bbox, ways_in_bbox_scan, boxes),
+                                         ("nodes_in_radius", nodes_in_radius, nodes_in_radius_scan, points)]:
+        times = []
+        results = []
+        for func in (indexed, scan):
+            t0 = time.perf_counter()
+            results.append([func(conn, *q) for q in queries])
+            times.append(time.perf_counter() - t0)
+        if results[0] != results[1]:
+            raise AssertionError("%s: indexed and scan results differ" % name)
+        timings[name] = tuple(times)
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the spatial index, or benchmark it against full scans.')
+    parser.add_argument('command', choices=['build', 'benchmark'])
+    parser.add_argument('dbpath', type=str, help='Path to database file')
+    parser.add_argument('-n', type=int, default=20, help='number of random queries (benchmark)')
+    parser.add_argument('--size', type=float, default=0.01, help='box size in degrees (benchmark)')
+    parser.add_argument('--radius', type=float, default=500, help='radius in m (benchmark)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.dbpath)
+    if args.command == 'build':
+        t0 = time.perf_counter()
+        build_spatial_index(conn)
+        print("spatial index built, %.1f s" % (time.perf_counter() - t0))
+    else:
+        for name, (t_index, t_scan) in benchmark(conn, args.n, args.size, args.radius).items():
+            print("%-16s indexed %8.4f s   scan %8.4f s   speedup %6.1fx" % (name, t_index, t_scan, t_scan / t_index))
+    conn.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load an OSM file directly into the database, without the csv intermediate.
+
+A parser thread runs get_elements and shape_element from prepare_csv and collects
+the shaped records into batches of rows per table. The batches go through a
+bounded queue to the main thread, which inserts them with executemany, so parsing
+and inserting overlap while memory stays bounded. The tables are created from
+osm.sql with the same PRAGMAs and deferred indexes as load_database --bulk, and
+their content is the same as with prepare_csv.py followed by load_database.py.
+
+The rollback journal is kept, as with load_database --bulk --checkpoint: if an
+insert fails (e.g. on a duplicate id), the rows inserted so far are rolled back,
+the parser thread is stopped and the database is left with the empty tables.
+Pages appended to the database file are not journaled, so loading into a new
+file costs next to nothing extra.
+"""
+import contextlib
+import os.path
+import queue
+import sqlite3
+import threading
+import time
+
+import load_database
+import prepare_csv
+import validation
+
+# shape_element record type -> table, column order
+RECORDS = [("node", "nodes", prepare_csv.NODE_FIELDS),
+           ("node_tags", "nodes_tags", prepare_csv.NODE_TAGS_FIELDS),
+           ("way", "ways", prepare_csv.WAY_FIELDS),
+           ("way_tags", "ways_tags", prepare_csv.WAY_TAGS_FIELDS),
+           ("way_nodes", "ways_nodes", prepare_csv.WAY_NODES_FIELDS)]
+
+BATCH_SIZE = 10000   # elements per batch
+QUEUE_SIZE = 8       # batches waiting for the database
+PUT_TIMEOUT = 0.1    # seconds between checks for a stop while the queue is full
+
+
+def empty_batch():
+    return {table: [] for _, table, _ in RECORDS}
+
+
+def add_rows(batch, el):
+    """Append the rows of a shaped element to the batch."""
+    for record_type, table, fields in RECORDS:
+        if record_type not in el:
+            continue
+        records = el[record_type]
+        if isinstance(records, dict):
+            batch[table].append(tuple(records[f] for f in fields))
+        else:
+            batch[table].extend(tuple(r[f] for f in fields) for r in records)
+
+
+def put(q, item, stop):
+    """Put item into the queue, waiting while it is full. Return False, without
+    putting it, if stop is set in the meantime."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def produce(file_in, q, stop, validator=None, batch_size=BATCH_SIZE, parser="etree"):
+    """Parser thread: put batches {table: [row tuples]} into the queue, then None.
+    Elements are validated if a validator is given.
+    An exception is passed on through the queue. Returns early, closing the
+    input file, when the stop event is set."""
+    try:
+        with contextlib.closing(prepare_csv.get_elements(file_in, parser)) as elements:
+            batch = empty_batch()
+            n = 0
+            for element in elements:
+                el = prepare_csv.shape_element(element)
+                if el:
+                    if validator is not None:
+                        prepare_csv.validate_element(el, validator)
+                    add_rows(batch, el)
+                    n += 1
+                    if n == batch_size:
+                        if not put(q, batch, stop):
+                            return
+                        batch = empty_batch()
+                        n = 0
+        if put(q, batch, stop):
+            put(q, None, stop)
+    except Exception as e:
+        put(q, e, stop)
+
+
+def load(file_in, dbpath, validate=False, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, parser="etree"):
+    """Create the database dbpath and fill it from the OSM file.
+    Return {table: rows}, and the validation.ValidationReport or None if not validating."""
+    conn = sqlite3.connect(dbpath)
+    cur = conn.cursor()
+    for pragma in load_database.CHECKPOINT_BULK_PRAGMAS:
+        cur.execute(pragma)
+    sql_schema, sql_indexes = load_database.split_schema(load_database.read_schema())
+    cur.executescript(sql_schema)
+
+    templates = {table: load_database.positional_insert_template(table, fields)
+                 for _, table, fields in RECORDS}
+    counts = {table: 0 for _, table, _ in RECORDS}
+
+    validator = validation.Validator(prepare_csv.SCHEMA) if validate else None
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    producer = threading.Thread(target=produce, args=(file_in, q, stop, validator, batch_size, parser), daemon=True)
+    producer.start()
+
+    try:
+        cur.execute("BEGIN;")
+        while True:
+            batch = q.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            for table, rows in batch.items():
+                if rows:
+                    cur.executemany(templates[table], rows)
+                    counts[table] += len(rows)
+        conn.commit()
+        if sql_indexes:
+            cur.executescript(sql_indexes)
+        conn.commit()
+    finally:
+        # on an error: unblock and wait for the parser thread, drop the uncommitted rows
+        stop.set()
+        producer.join()
+        conn.rollback()
+        conn.close()
+    return counts, validator.report if validator else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Create database and fill it directly from an OSM file.')
+    parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('dbfile', type=str, help='name of database file, created next to the OSM file')
+    parser.add_argument('--validate', action='store_true', help='Validate elements against schema')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='elements per batch')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help='batches buffered between parser and database')
+    parser.add_argument('--parser', choices=prepare_csv.PARSERS, default="etree", help='XML parser backend')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    counts, report = load(args.osmpath, os.path.join(os.path.dirname(args.osmpath), args.dbfile),
+                  validate=args.validate, batch_size=args.batch_size, queue_size=args.queue_size,
+                  parser=args.parser)
+    dt = time.perf_counter() - t0
+    for table, n in counts.items():
+        print("%s: %i entries" % (table, n))
+    print("%.1f s, %.0f rows/s" % (dt, sum(counts.values()) / dt if dt > 0 else 0))
+    if report is not None:
+        print(report.format())
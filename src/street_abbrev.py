@@ -7,18 +7,17 @@ If run as a main program, it takes the path to an OSM file as input, identifies
 tag elements containing street names, and prints out those that have abbreviations.
 """
 
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 
-# replace abbreviations and incorrect typing
-ABBREV_MAPPING = { 
-    "Str.$": "Straße",
-    "str.$": "straße",
-    "Strasse": "Straße",
-    "strasse": "straße"
-    }
-ABBREV_RE = re.compile("|".join(ABBREV_MAPPING.keys()))
+import audit_engine
+import cleaning_rules
+import osm_reader
+
+# abbreviations and incorrect typing: the addr:street rules of cleaning_rules.RULES
+# except the removal of house numbers
+ABBREV_RE = re.compile("|".join(pattern for key, pattern, _ in cleaning_rules.RULES
+                                if key == "addr:street" and pattern != cleaning_rules.HOUSENUM))
 
 
 def is_streetname(elem):
@@ -27,30 +26,34 @@ def is_streetname(elem):
 
 
 def audit_abbreviations(streets_with_abbrev, streetname):
-    """Assign street name to a category, if it matches one of the criteria 
-    defined in ABBREV_MAPPING"""
+    """Assign street name to a category, if it matches one of the abbreviation
+    rules of cleaning_rules.RULES"""
     m = ABBREV_RE.search(streetname)
     if m:
         streets_with_abbrev[m.group()].add(streetname)
 
 
-def audit(osmpath):
-    osm = open(osmpath, "r", encoding='utf-8')
-    streets = defaultdict(set)
-    for event, elem in ET.iterparse(osm, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_streetname(tag):
-                    audit_abbreviations(streets, tag.attrib['v'])
-    osm.close()
-    return streets
+def report(abbrev_types):
+    for abbrev_type, street_names in abbrev_types.items():
+        print("\n%s:" % abbrev_type)
+        for street_name in sorted(street_names):
+            print("    %s" % street_name)
+
+
+AUDITOR = audit_engine.Auditor("street_abbrev", lambda: defaultdict(set),
+                               lambda key: key == "addr:street",
+                               lambda streets, key, value: audit_abbreviations(streets, value),
+                               report)
+
+
+def audit(osmpath, parser="etree"):
+    return audit_engine.run(osmpath, [AUDITOR], parser=parser)[AUDITOR.name]
 
 
 def update_streetname(streetname):
-    """Return an updated version of the street name with common abbreviations replaced."""
-    for pattern, repl in ABBREV_MAPPING.items():
-        streetname = re.sub(pattern, repl, streetname)
-    return streetname
+    """Return an updated version of the street name with common abbreviations replaced
+    (and trailing house numbers removed): all addr:street rules of cleaning_rules.RULES."""
+    return cleaning_rules.RULE_SET.clean("addr:street", streetname)
 
 
 if __name__ == "__main__":
@@ -58,11 +61,10 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Audit street names. Prints results to stdout.')
     parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
     args = parser.parse_args()
 
-    abbrev_types = audit(args.osmpath) # dict {str:set {str}}
-    for abbrev_type, street_names in abbrev_types.items():
-        print("\n%s:" % abbrev_types)
-        for street_name in sorted(street_names):
-            print("    %s" % street_name)                
+    abbrev_types = audit(args.osmpath, args.parser) # dict {str:set {str}}
+    report(abbrev_types)
 
@@ -7,14 +7,15 @@ If run as a main program, it takes the path to an OSM file as input, identifies
 tag elements containing street names, and prints out those that have trailing numbers.
 """
 
-import xml.etree.cElementTree as ET
-from collections import defaultdict
 import re
 
+import audit_engine
+import cleaning_rules
+import osm_reader
 
-# detect and remove trailing house numbers: latin numbers and roman literals. 
-# Latin numbers: using I, V and X only. Could be extended if necessary.
-HOUSENUM_RE = re.compile("\s+(\d+|[IVX]+)\s*$")
+
+# detect trailing house numbers: latin numbers and roman literals, see cleaning_rules.HOUSENUM
+HOUSENUM_RE = re.compile(cleaning_rules.HOUSENUM)
 
 
 def is_streetname(elem):
@@ -28,21 +29,26 @@ def audit_housenum(streets_with_housenum, streetname):
     if m:
         streets_with_housenum.add(streetname)
 
-def audit(osmpath):
-    osm = open(osmpath, "r", encoding='utf-8')
-    streets = set([])
-    for event, elem in ET.iterparse(osm, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_streetname(tag):
-                    audit_housenum(streets, tag.attrib['v'])
-    osm.close()
-    return streets
+
+def report(streets):
+    for streetname in streets:
+        print(streetname)
+
+
+AUDITOR = audit_engine.Auditor("street_housenum", set,
+                               lambda key: key == "addr:street",
+                               lambda streets, key, value: audit_housenum(streets, value),
+                               report)
+
+
+def audit(osmpath, parser="etree"):
+    return audit_engine.run(osmpath, [AUDITOR], parser=parser)[AUDITOR.name]
 
 
 def update_streetname(streetname):
-    """Return an updated version of the street name with trailing numbers removed"""
-    return re.sub(HOUSENUM_RE, '', streetname)
+    """Return an updated version of the street name with trailing numbers removed
+    (and abbreviations replaced): all addr:street rules of cleaning_rules.RULES."""
+    return cleaning_rules.RULE_SET.clean("addr:street", streetname)
 
 
 if __name__ == "__main__":
@@ -50,7 +56,10 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Audit street names. Prints results to stdout.')
     parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
     args = parser.parse_args()
 
-    for streetname in audit(args.osmpath): # set {str}
-        print(streetname)  
\ No newline at end of file
+    streets = audit(args.osmpath, args.parser) # set {str}
+    report(streets)
+  
\ No newline at end of file
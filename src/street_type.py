@@ -8,10 +8,12 @@ tag elements containing street names, groups them according to typical street ty
 abd prints out the result.
 """
 
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 
+import audit_engine
+import osm_reader
+
 # typical street names
 STREET_TYPE_RE = re.compile("|".join([
     "^(Am|An) ",
@@ -39,16 +41,21 @@ def audit_street_type(street_types, streetname):
     street_types[street_type].add(streetname)
 
 
-def audit(osmpath):
-    osm = open(osmpath, "r", encoding='utf-8')
-    street_types = defaultdict(set)
-    for event, elem in ET.iterparse(osm, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_streetname(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
-    osm.close()
-    return street_types
+def report(street_types):
+    for street_type, street_names in street_types.items():
+        print("\n%s:" % street_type)
+        for street_name in sorted(street_names):
+            print("    %s" % street_name)
+
+
+AUDITOR = audit_engine.Auditor("street_type", lambda: defaultdict(set),
+                               lambda key: key == "addr:street",
+                               lambda street_types, key, value: audit_street_type(street_types, value),
+                               report)
+
+
+def audit(osmpath, parser="etree"):
+    return audit_engine.run(osmpath, [AUDITOR], parser=parser)[AUDITOR.name]
 
 
 if __name__ == "__main__":
@@ -56,10 +63,9 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Audit street names. Prints results to stdout.')
     parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
     args = parser.parse_args()
 
-    street_types = audit(args.osmpath) # dict {str:set {str}}
-    for street_type, street_names in street_types.items():
-        print("\n%s:" % street_type)
-        for street_name in sorted(street_names):
-            print("    %s" % street_name)
+    street_types = audit(args.osmpath, args.parser) # dict {str:set {str}}
+    report(street_types)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Deterministic generator of synthetic OSM XML files, for benchmarks and checks.
+
+The same parameters and seed always give the same file. Nodes lie in the
+bounding box of Rügen, ways reference existing nodes. Tag keys and values look
+like the ones of the real extract: addresses, amenities, names, places with a
+population, highways, and a few keys with colons or problem characters.
+
+A share of the addr:street, addr:city and addr:postcode values is dirty, with
+the defects found by the audits: abbreviations and misspellings of 'Straße',
+trailing house numbers, 'Ostseebad'/'Insel' prefixes, '/ ...' suffixes, and
+postcodes with extra characters or outside the region.
+
+If run as a main program, it writes a file of the given size, and with --pbf
+a PBF copy of it (pbf.py).
+"""
+import random
+from xml.sax.saxutils import quoteattr
+
+# bounding box of Rügen: min_lat, min_lon, max_lat, max_lon
+BBOX = (54.2, 13.0, 54.7, 13.8)
+
+CITIES = ["Bergen auf Rügen", "Binz", "Sassnitz", "Putbus", "Sellin", "Göhren", "Baabe", "Garz",
+          "Gingst", "Samtens", "Dranske", "Breege", "Glowe", "Lohme", "Kloster", "Vitte"]
+STREETS = ["Hauptstraße", "Bahnhofstraße", "Am Markt", "Dorfstraße", "Ringweg", "Kirchweg",
+           "Strandpromenade", "Zum Hafen", "Lindenallee", "Schulstraße", "Wilhelmstraße",
+           "Am Berg", "Birkenweg", "Seestraße", "Alter Hof", "Putbuser Chaussee"]
+POSTCODES = ["18528", "18609", "18546", "18586", "18573", "18581", "18569", "18565", "18556", "18445"]
+AMENITIES = ["restaurant", "cafe", "fast_food", "ice_cream", "bench", "parking", "toilets", "pub"]
+CUISINES = ["regional", "german", "italian", "pizza", "fish", "ice_cream", "coffee_shop", "burger"]
+PLACES = ["village", "hamlet", "town", "locality"]
+HIGHWAYS = ["residential", "service", "track", "footway", "unclassified", "tertiary"]
+
+# keys of other tags, including keys with colons and problem characters
+OTHER_KEYS = ["building", "source", "opening_hours", "wheelchair", "seamark:type", "seamark:light:colour",
+              "name:de", "tourism", "fixme", "note", "bad key", "foo.bar"]
+OTHER_VALUES = ["yes", "no", "survey", "Mo-Su 10:00-22:00", "limited", "buoy_lateral", "red",
+                "Hotel", "check position", "x&y \"quoted\""]
+
+
+def dirty_street(rnd, street):
+    """Return the street name with one of the defects found by the audits."""
+    defect = rnd.randrange(4)
+    if defect == 0 and street.endswith("straße"):
+        return street[:-len("straße")] + rnd.choice(["str.", "strasse"])
+    if defect == 1 and street.endswith("Straße"):
+        return street[:-len("Straße")] + rnd.choice(["Str.", "Strasse"])
+    if defect == 2:
+        return "%s %s" % (street, rnd.choice(["IV", "XII", "II"]))
+    return "%s %i" % (street, rnd.randint(1, 120))
+
+
+def dirty_city(rnd, city):
+    defect = rnd.randrange(3)
+    if defect == 0:
+        return "Ostseebad " + city
+    if defect == 1:
+        return "Insel " + city
+    return city + rnd.choice([" / Rügen", "/Rügen", " / OT Lietzow"])
+
+
+def dirty_postcode(rnd, postcode):
+    defect = rnd.randrange(3)
+    if defect == 0:
+        return postcode[:4]
+    if defect == 1:
+        return "%s %i" % (postcode, rnd.randint(1, 9))
+    return "%05i" % rnd.randint(10000, 99999)
+
+
+class Generator(object):
+    """Random tags, elements and attributes, from a seeded random number generator."""
+
+    def __init__(self, seed=0, tags_per_element=3, dirty=0.2, n_users=200):
+        self.rnd = random.Random(seed)
+        self.tags_per_element = tags_per_element
+        self.dirty = dirty
+        self.users = ["user%i" % i for i in range(n_users)]
+
+    def address(self):
+        rnd = self.rnd
+        street, city, postcode = rnd.choice(STREETS), rnd.choice(CITIES), rnd.choice(POSTCODES)
+        if rnd.random() < self.dirty:
+            street = dirty_street(rnd, street)
+        if rnd.random() < self.dirty:
+            city = dirty_city(rnd, city)
+        if rnd.random() < self.dirty:
+            postcode = dirty_postcode(rnd, postcode)
+        return [("addr:street", street), ("addr:housenumber", str(rnd.randint(1, 120))),
+                ("addr:city", city), ("addr:postcode", postcode)]
+
+    def node_tags(self, element_id):
+        rnd = self.rnd
+        kind = rnd.random()
+        if kind < 0.4:
+            tags = self.address()
+        elif kind < 0.7:
+            amenity = rnd.choice(AMENITIES)
+            tags = [("amenity", amenity), ("name", "%s %i" % (amenity.title(), element_id))]
+            if amenity in ("restaurant", "cafe", "fast_food", "ice_cream"):
+                tags.append(("cuisine", rnd.choice(CUISINES)))
+                tags += self.address()[2:3]
+        elif kind < 0.75:
+            tags = [("place", rnd.choice(PLACES)), ("name", rnd.choice(CITIES)),
+                    ("population", str(rnd.randint(20, 15000)))]
+        else:
+            tags = []
+        return tags + self.other_tags(len(tags))
+
+    def way_tags(self, element_id):
+        rnd = self.rnd
+        if rnd.random() < 0.6:
+            tags = [("highway", rnd.choice(HIGHWAYS)), ("name", rnd.choice(STREETS))]
+        else:
+            tags = [("building", "yes")] + self.address()
+        return tags + self.other_tags(len(tags))
+
+    def other_tags(self, n):
+        """Fill up to a random number of tags with tags of other keys."""
+        n_tags = self.rnd.randint(1, 2 * self.tags_per_element - 1)
+        keys = self.rnd.sample(OTHER_KEYS, max(0, min(len(OTHER_KEYS), n_tags - n)))
+        return [(key, self.rnd.choice(OTHER_VALUES)) for key in keys]
+
+    def attributes(self, element_id):
+        rnd = self.rnd
+        uid = rnd.randrange(len(self.users))
+        return [("id", str(element_id)), ("version", str(rnd.randint(1, 12))),
+                ("timestamp", "20%02i-%02i-%02iT%02i:%02i:%02iZ" % (rnd.randint(8, 20), rnd.randint(1, 12),
+                                                                    rnd.randint(1, 28), rnd.randint(0, 23),
+                                                                    rnd.randint(0, 59), rnd.randint(0, 59))),
+                ("changeset", str(rnd.randint(1, 80000000))), ("uid", str(uid + 1)),
+                ("user", self.users[uid])]
+
+
+def format_attributes(attributes):
+    return " ".join("%s=%s" % (name, quoteattr(value)) for name, value in attributes)
+
+
+def format_tags(tags, indent="    "):
+    return "".join('%s<tag k=%s v=%s/>\n' % (indent, quoteattr(k), quoteattr(v)) for k, v in tags)
+
+
+def generate(path, n_nodes, n_ways, n_relations=0, tags_per_element=3, tagged=0.3, dirty=0.2, seed=0):
+    """Write a synthetic OSM file. tagged is the share of nodes having tags, dirty
+    the share of dirty addr:street, addr:city and addr:postcode values."""
+    gen = Generator(seed, tags_per_element, dirty)
+    rnd = gen.rnd
+    min_lat, min_lon, max_lat, max_lon = BBOX
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fp.write('<osm version="0.6" generator="synth_osm">\n')
+        fp.write(' <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>\n' % BBOX)
+        for node_id in range(1, n_nodes + 1):
+            attributes = gen.attributes(node_id)
+            attributes[1:1] = [("lat", "%.7f" % rnd.uniform(min_lat, max_lat)),
+                               ("lon", "%.7f" % rnd.uniform(min_lon, max_lon))]
+            tags = gen.node_tags(node_id) if rnd.random() < tagged else []
+            if tags:
+                fp.write(' <node %s>\n%s </node>\n' % (format_attributes(attributes), format_tags(tags)))
+            else:
+                fp.write(' <node %s/>\n' % format_attributes(attributes))
+        for way_id in range(1, n_ways + 1):
+            # ways are made of nearby nodes, mostly
+            start = rnd.randint(1, n_nodes)
+            refs = [min(n_nodes, max(1, start + rnd.randint(-50, 50))) for _ in range(rnd.randint(2, 12))]
+            fp.write(' <way %s>\n' % format_attributes(gen.attributes(way_id)))
+            fp.write("".join('    <nd ref="%i"/>\n' % ref for ref in refs))
+            fp.write('%s </way>\n' % format_tags(gen.way_tags(way_id)))
+        for relation_id in range(1, n_relations + 1):
+            fp.write(' <relation %s>\n' % format_attributes(gen.attributes(relation_id)))
+            for _ in range(rnd.randint(1, 5)):
+                fp.write('    <member type="way" ref="%i" role="outer"/>\n' % rnd.randint(1, max(1, n_ways)))
+            fp.write('    <tag k="type" v="multipolygon"/>\n </relation>\n')
+        fp.write('</osm>\n')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write a synthetic OSM file.')
+    parser.add_argument('path', type=str, help='Path of the OSM file to write')
+    parser.add_argument('--nodes', type=int, default=100000, help='number of nodes')
+    parser.add_argument('--ways', type=int, default=15000, help='number of ways')
+    parser.add_argument('--relations', type=int, default=100, help='number of relations')
+    parser.add_argument('--tags', type=int, default=3, help='mean number of tags per tagged element')
+    parser.add_argument('--tagged', type=float, default=0.3, help='share of nodes having tags')
+    parser.add_argument('--dirty', type=float, default=0.2, help='share of dirty street, city and postcode values')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--pbf', type=str, metavar='PATH', help='also write the file as PBF to PATH')
+    args = parser.parse_args()
+
+    generate(args.path, args.nodes, args.ways, args.relations, args.tags, args.tagged, args.dirty, args.seed)
+    if args.pbf:
+        import pbf
+        pbf.convert(args.path, args.pbf)
@@ -3,19 +3,40 @@
 """
 Investigation of <tag> elements.
 
+The category of a key is memoized: keys repeat millions of times, the regular
+expressions only run once per distinct key. The memo is a plain dict, faster
+than the LRU cache of clean_cache.py, and it is bounded: once full, the keys
+seen first (the frequent ones, mostly) stay in it.
+
+With --stats, the exact counts (one per distinct key) are replaced by fixed
+memory summaries (sketch.py), for files too large to count exactly: the tag
+counts of every category, a count-min sketch of the key frequencies with the
+top K keys, HyperLogLog estimates of the distinct keys per category and of the
+distinct values of the top keys. The report gives the error bounds.
+
 If run as a main program, it takes the path to an OSM file as input, categorizes
-and counts the keys on <tag> elements, and prints the result to stdout.
+and counts the keys on <tag> elements, and prints the result to stdout. With
+--benchmark it compares time, peak memory and results of both modes.
 """
-import xml.etree.cElementTree as ET
 from collections import defaultdict
+from operator import itemgetter
 import re
 
+import audit_engine
+import osm_reader
+import sketch
+
 KEY_CATEGORIES = ['lower', 'lower_colon', 'problemchar', 'other']
 
 RE_LOWER = re.compile(r'^([a-z_]+)$') # simple keys like "building", all lowercase
 RE_LOWER_COLON = re.compile(r'^(([a-z_]+):)+([a-z_]+)$') # complex keys like "seamark:light:orientation"
 RE_PROBLEMCHAR = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]') # keys that contain problematic characters
 
+CATEGORY_CACHE_SIZE = 10000  # most keys with a memoized category
+
+TOP_K = 50  # keys reported with --stats
+BUFFER_SIZE = 10000  # distinct (key, value) pairs counted exactly before they go to the sketches
+
 
 def key_category(key):
     """Return category of a key (string)."""
@@ -29,38 +50,195 @@ def key_category(key):
         return "other"
 
 
+# key -> category
+CATEGORY_CACHE = {}
+
+
+def cached_key_category(key):
+    """Return category of a key, memoized."""
+    try:
+        return CATEGORY_CACHE[key]
+    except KeyError:
+        cat = key_category(key)
+        if len(CATEGORY_CACHE) < CATEGORY_CACHE_SIZE:
+            CATEGORY_CACHE[key] = cat
+        return cat
+
+
 def is_tag_acceptable(element):
     """Return True if key of tag element is acceptable. 
     All keys that do not contain problematic characters are considered acceptable."""
     key = element.attrib['k']
-    return key_category(key) != "problemchar"
+    return cached_key_category(key) != "problemchar"
+
+
+def count_key(key_counts, key):
+    cat = cached_key_category(key)
+    key_counts[cat][key] += 1
 
 
 def count(element, key_counts):
     if element.tag == "tag":
-        key = element.attrib["k"]
-        cat = key_category(key)
-        key_counts[cat][key] += 1
+        count_key(key_counts, element.attrib["k"])
 
 
-def process_map(filename):
-    keys = {cat: defaultdict(int) for cat in KEY_CATEGORIES}
-    for event, element in ET.iterparse(filename):
-        count(element, keys)
-    return keys
+def report(keys):
+    for cat in KEY_CATEGORIES:
+        print("\n*** %s ***\n" % cat)
+        for key, n in sorted(keys[cat].items(), key=itemgetter(1), reverse=True):
+            print("%s %i" % (key, n))
+
+
+# tags of all elements are counted, including relations
+AUDITOR = audit_engine.Auditor("tags", lambda: {cat: defaultdict(int) for cat in KEY_CATEGORIES},
+                               lambda key: True,
+                               lambda keys, key, value: count_key(keys, key),
+                               report,
+                               parents=None)
+
+
+def process_map(filename, parser="etree"):
+    return audit_engine.run(filename, [AUDITOR], parser=parser)[AUDITOR.name]
+
+
+# ================================================== #
+#               Probabilistic statistics             #
+# ================================================== #
+class TagStats(object):
+    """Fixed memory statistics of tag keys and values.
+
+    Tags are first counted exactly in a buffer of at most buffer_size distinct
+    keys and (top key, value) pairs; when it is full, the key counts go to the
+    count-min sketch, and the values to the HyperLogLogs of the top keys. The
+    distinct values of a key are counted from the time it entered the top keys
+    on. Call flush() before reading the results."""
+
+    def __init__(self, k=TOP_K, epsilon=sketch.EPSILON, delta=sketch.DELTA, buffer_size=BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.totals = {cat: 0 for cat in KEY_CATEGORIES}
+        self.distinct_keys = {cat: sketch.HyperLogLog() for cat in KEY_CATEGORIES}
+        self.frequencies = sketch.CountMinSketch(epsilon, delta)
+        self.top = sketch.TopK(k)
+        self.distinct_values = {}  # top key -> HyperLogLog
+        self.key_counts = defaultdict(int)
+        self.values = set()
+
+    def add(self, key, value):
+        self.key_counts[key] += 1
+        # until the top keys are known, keep the values of all keys
+        if key in self.top.counts or len(self.top.counts) < self.top.k:
+            self.values.add((key, value))
+            if len(self.values) + len(self.key_counts) >= self.buffer_size:
+                self.flush()
+        elif len(self.key_counts) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        for key, n in self.key_counts.items():
+            cat = cached_key_category(key)
+            self.totals[cat] += n
+            h = sketch.hash64(key)
+            self.distinct_keys[cat].add_hash(h)
+            replaced = self.top.offer(key, self.frequencies.add_hash(h, n))
+            if replaced is not None:
+                self.distinct_values.pop(replaced, None)
+        for key, value in self.values:
+            if key in self.top.counts:
+                if key not in self.distinct_values:
+                    self.distinct_values[key] = sketch.HyperLogLog()
+                self.distinct_values[key].add(value)
+        self.key_counts.clear()
+        self.values.clear()
+
+    def memory(self):
+        """Return the bytes of the sketches, without the buffer and the cache."""
+        return (self.frequencies.memory() + sum(hll.memory() for hll in self.distinct_keys.values())
+                + sum(hll.memory() for hll in self.distinct_values.values()))
+
+
+def report_stats(stats):
+    stats.flush()
+    top = stats.top.items()
+    print("%i tags; key counts overestimate by at most %.0f (epsilon %g) with probability %g"
+          % (stats.frequencies.total, stats.frequencies.error(), stats.frequencies.epsilon,
+             1 - stats.frequencies.delta))
+    print("distinct counts have a standard error of %.1f%%; sketches use %i KB"
+          % (100 * sketch.HyperLogLog().error(), stats.memory() // 1024))
+    for cat in KEY_CATEGORIES:
+        print("\n*** %s: %i tags, ~%i distinct keys ***\n"
+              % (cat, stats.totals[cat], stats.distinct_keys[cat].estimate()))
+        for key, n in top:
+            if cached_key_category(key) == cat:
+                hll = stats.distinct_values.get(key)
+                print("%s ~%i (~%i distinct values)" % (key, n, hll.estimate() if hll else 0))
+
+
+STATS_AUDITOR = audit_engine.Auditor("tag_stats", TagStats,
+                                     lambda key: True,
+                                     lambda stats, key, value: stats.add(key, value),
+                                     report_stats,
+                                     parents=None)
+
+
+def process_map_stats(filename, parser="etree", k=TOP_K, epsilon=sketch.EPSILON, delta=sketch.DELTA):
+    auditor = audit_engine.Auditor(STATS_AUDITOR.name, lambda: TagStats(k, epsilon, delta),
+                                   STATS_AUDITOR.predicate, STATS_AUDITOR.accumulate, report_stats, parents=None)
+    stats = audit_engine.run(filename, [auditor], parser=parser)[auditor.name]
+    stats.flush()
+    return stats
+
+
+def benchmark(filename, parser="etree", k=TOP_K, repeat=1, log=print):
+    """Time the exact and the statistics mode, measure their peak memory, and
+    compare their results. Return {mode: (time in s, peak memory in bytes)}."""
+    import benchmark as bench
+
+    results = {}
+    for mode, func in [("exact", lambda: process_map(filename, parser)),
+                       ("stats", lambda: process_map_stats(filename, parser, k))]:
+        # every mode starts without memoized categories
+        seconds = bench.best_time(func, repeat, setup=CATEGORY_CACHE.clear)
+        CATEGORY_CACHE.clear()
+        peak = osm_reader.peak_memory(func)
+        results[mode] = (seconds, peak)
+        log("%-5s %8.3f s  peak %8.1f KB" % (mode, seconds, peak / 1024))
+
+    keys = process_map(filename, parser)
+    stats = process_map_stats(filename, parser, k)
+    exact = {key: n for cat in KEY_CATEGORIES for key, n in keys[cat].items()}
+    # keys of the exact top k that stand out of the error bound must be found
+    bound = stats.frequencies.error()
+    heavy = [key for key in sorted(exact, key=lambda key: (-exact[key], key))[:k] if exact[key] > bound]
+    found = [key for key in heavy if key in stats.top.counts]
+    worst = max((n - exact[key] for key, n in stats.top.items()), default=0)
+    log("top %i keys: %i of the %i exact top keys above the error bound found, largest overestimate %i (bound %.0f)"
+        % (k, len(found), len(heavy), worst, bound))
+    for cat in KEY_CATEGORIES:
+        log("%-12s distinct keys: exact %i, estimate %i" % (cat, len(keys[cat]), stats.distinct_keys[cat].estimate()))
+    return results
 
 
 if __name__ == "__main__":
     import argparse
-    from operator import itemgetter
 
     parser = argparse.ArgumentParser(description='Audit <tag> elements and print results to stdout.')
     parser.add_argument('osmpath', type=str, help='Path to OSM file')
+    parser.add_argument('--parser', choices=osm_reader.PARSERS, default="etree",
+                        help='XML parser backend; expat is faster and builds no element tree')
+    parser.add_argument('--stats', action='store_true',
+                        help='fixed memory statistics (count-min sketch, top keys, HyperLogLog) instead of exact counts')
+    parser.add_argument('--top', type=int, default=TOP_K, help='--stats: number of top keys')
+    parser.add_argument('--epsilon', type=float, default=sketch.EPSILON,
+                        help='--stats: count error bound, as a fraction of all tags')
+    parser.add_argument('--delta', type=float, default=sketch.DELTA,
+                        help='--stats: probability that a count exceeds the error bound')
+    parser.add_argument('--benchmark', action='store_true', help='compare the exact and the --stats mode')
     args = parser.parse_args()
 
-    keys = process_map(args.osmpath)
-
-    for cat in KEY_CATEGORIES:
-        print("\n*** %s ***\n" % cat)
-        for key, count in sorted(keys[cat].items(), key=itemgetter(1), reverse=True):
-            print("%s %i" % (key, count))
+    if args.benchmark:
+        benchmark(args.osmpath, args.parser, args.top)
+    elif args.stats:
+        report_stats(process_map_stats(args.osmpath, args.parser, args.top, args.epsilon, args.delta))
+    else:
+        keys = process_map(args.osmpath, args.parser)
+        report(keys)
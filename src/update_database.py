@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Apply an OSM change file (.osc, .osc.gz or .osc.bz2) to the database, instead of a rebuild.
+
+The <create>, <modify> and <delete> blocks are streamed. Created and modified
+nodes and ways are cleaned and shaped with prepare_csv.shape_element, and replace
+the element's rows in nodes/ways and its tags and way nodes. Deleted elements
+are removed from all tables. Relations are ignored, like in prepare_csv.
+
+All changes, and the sequence number of the change file, are committed in one
+transaction. The sequence number is stored in the table replication_state; a
+change file is only applied if its sequence number follows the last one, so
+daily updates can be chained. If the database has a spatial index, pivot tables
+or ways_geometry, their rows of the changed elements are rebuilt in the same
+transaction.
+"""
+import re
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+
+import compressed
+import load_database
+import pivot
+import prepare_csv
+import spatial
+
+STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS replication_state (
+    sequence_number INTEGER PRIMARY KEY NOT NULL,
+    osc_file TEXT,
+    applied_at DATETIME
+);
+"""
+
+ACTIONS = ("create", "modify", "delete")
+
+# element -> (table, fields) of the element row, and of its child rows
+ELEMENT_TABLES = {
+    "node": (("nodes", prepare_csv.NODE_FIELDS),
+             [("node_tags", "nodes_tags", prepare_csv.NODE_TAGS_FIELDS)]),
+    "way": (("ways", prepare_csv.WAY_FIELDS),
+            [("way_tags", "ways_tags", prepare_csv.WAY_TAGS_FIELDS),
+             ("way_nodes", "ways_nodes", prepare_csv.WAY_NODES_FIELDS)]),
+}
+
+
+class SequenceError(Exception):
+    pass
+
+
+def open_osc(path):
+    return compressed.open_osm(path)
+
+
+def read_state_file(path):
+    """Return the sequence number from a replication state.txt file."""
+    with open(path, encoding="utf-8") as fp:
+        m = re.search(r"^sequenceNumber=(\d+)", fp.read(), re.MULTILINE)
+    if not m:
+        raise ValueError("no sequenceNumber in %s" % path)
+    return int(m.group(1))
+
+
+def last_sequence_number(cur):
+    cur.executescript(STATE_TABLE)
+    cur.execute("select max(sequence_number) from replication_state;")
+    return cur.fetchone()[0]
+
+
+def get_changes(osc_file):
+    """Yield (action, element) for the nodes and ways of the change file."""
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    action, parent = None, root
+    for event, elem in context:
+        if event == 'start':
+            if elem.tag in ACTIONS:
+                action, parent = elem.tag, elem
+        elif elem.tag in ELEMENT_TABLES or elem.tag == "relation":
+            if elem.tag != "relation":
+                yield action, elem
+            # consumed, free memory
+            parent.remove(elem)
+        elif elem.tag in ACTIONS:
+            root.clear()
+            action, parent = None, root
+
+
+def delete_element(cur, tag, element_id, children_only=False):
+    (table, _), children = ELEMENT_TABLES[tag]
+    for _, child_table, _ in children:
+        cur.execute("delete from %s where id = ?;" % child_table, (element_id,))
+    if not children_only:
+        cur.execute("delete from %s where id = ?;" % table, (element_id,))
+
+
+def upsert_element(cur, tag, el):
+    """Replace the rows of a shaped element."""
+    (table, fields), children = ELEMENT_TABLES[tag]
+    row = el[tag]
+    delete_element(cur, tag, row["id"], children_only=True)
+    cur.execute("insert or replace into %s (%s) values (%s);" % (table, ", ".join(fields), ", ".join("?" * len(fields))),
+                [row[f] for f in fields])
+    for record_type, child_table, child_fields in children:
+        template = load_database.positional_insert_template(child_table, child_fields)
+        cur.executemany(template, [[r[f] for f in child_fields] for r in el[record_type]])
+
+
+def apply_changes(cur, osc_file):
+    """Apply all changes of the file. Return dict {(action, element tag): number}
+    and the set of changed (element tag, id)."""
+    counts = {(action, tag): 0 for action in ACTIONS for tag in ELEMENT_TABLES}
+    changed = set()
+    for action, element in get_changes(osc_file):
+        element_id = element.attrib["id"]
+        if action == "delete":
+            delete_element(cur, element.tag, element_id)
+        else:
+            upsert_element(cur, element.tag, prepare_csv.shape_element(element))
+        counts[(action, element.tag)] += 1
+        changed.add((element.tag, int(element_id)))
+    return counts, changed
+
+
+def refresh_geometry(cur, changed):
+    """Refresh ways_geometry, if the database has it (geometry.py needs numpy)."""
+    cur.execute("select count(*) from sqlite_master where name = 'ways_geometry';")
+    if cur.fetchone()[0]:
+        import geometry
+        geometry.refresh_ways_geometry(cur, [i for tag, i in changed if tag == "node"],
+                                       [i for tag, i in changed if tag == "way"])
+
+
+def update(dbpath, oscpath, sequence_number, force=False):
+    """Apply the change file in one transaction, and record its sequence number."""
+    conn = sqlite3.connect(dbpath)
+    cur = conn.cursor()
+    try:
+        last = last_sequence_number(cur)
+        if last is not None and sequence_number != last + 1 and not force:
+            raise SequenceError("last applied sequence number is %i, got %i" % (last, sequence_number))
+        cur.execute("BEGIN;")
+        with open_osc(oscpath) as fp:
+            counts, changed = apply_changes(cur, fp)
+        spatial.refresh_spatial_index(cur, [i for tag, i in changed if tag == "node"],
+                                      [i for tag, i in changed if tag == "way"])
+        pivot.refresh_all(cur, changed)
+        refresh_geometry(cur, changed)
+        cur.execute("insert or replace into replication_state (sequence_number, osc_file, applied_at) "
+                    "values (?, ?, datetime('now'));", (sequence_number, oscpath))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return counts, changed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Apply an OSM change file to the database.')
+    parser.add_argument('dbpath', type=str, help='Path to database file')
+    parser.add_argument('oscpath', type=str, help='Path to .osc or .osc.gz file')
+    seq = parser.add_mutually_exclusive_group(required=True)
+    seq.add_argument('--sequence', type=int, help='sequence number of the change file')
+    seq.add_argument('--state', type=str, help='replication state.txt belonging to the change file')
+    parser.add_argument('--force', action='store_true', help='apply even if the sequence number does not follow the last one')
+    args = parser.parse_args()
+
+    sequence_number = args.sequence if args.state is None else read_state_file(args.state)
+    t0 = time.perf_counter()
+    try:
+        counts, changed = update(args.dbpath, args.oscpath, sequence_number, args.force)
+    except SequenceError as e:
+        parser.exit(1, "%s, use --force to apply anyway\n" % e)
+    for (action, tag), n in counts.items():
+        print("%s %s: %i" % (action, tag, n))
+    print("sequence number %i applied, %.1f s" % (sequence_number, time.perf_counter() - t0))
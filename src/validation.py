@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fast validation of shaped elements against the schema in schema.py.
+
+The schema dict is compiled once into one checking function per record type
+('node', 'node_tags', 'way', ...), with the coercion function and type of every
+field looked up in advance. Validation collects all failures of an element as
+Failure tuples instead of stopping at the first one, and a ValidationReport
+counts them over a whole run.
+
+The rules used in schema.py are supported: type (dict, list, integer, float,
+string), required, coerce and schema. As with cerberus, unknown fields are
+failures, and the coerced values are only used for checking.
+"""
+from collections import Counter, namedtuple
+
+import schema
+
+# record: record type, e.g. 'node_tags'
+# index: position in a list record type, None for dict record types
+Failure = namedtuple("Failure", ["record", "index", "field", "message", "value"])
+
+# type name -> (accepted types, excluded types); as in cerberus, bool is an int
+# but neither an integer nor a float
+TYPES = {
+    'integer': ((int,), (bool,)),
+    'float': ((float, int), (bool,)),
+    'string': ((str,), ()),
+}
+
+
+def compile_fields(fields_schema):
+    """Return a function check(record, record_type, index) -> list of failures
+    for a dict with the given field rules."""
+    rules = [(field, rule.get('required', False), rule.get('coerce')) + TYPES[rule['type']] + (rule['type'],)
+             for field, rule in fields_schema.items()]
+    known = frozenset(fields_schema)
+
+    def check(record, record_type, index):
+        failures = []
+        for field, required, coerce, types, excluded, type_name in rules:
+            if field not in record:
+                if required:
+                    failures.append(Failure(record_type, index, field, "required field", None))
+                continue
+            value = record[field]
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except (TypeError, ValueError):
+                    failures.append(Failure(record_type, index, field, "cannot be coerced by %s" % coerce.__name__,
+                                            record[field]))
+                    continue
+            if not isinstance(value, types) or isinstance(value, excluded):
+                failures.append(Failure(record_type, index, field, "must be of %s type" % type_name, record[field]))
+        if len(record) > len(rules) or not known.issuperset(record):
+            for field in record:
+                if field not in known:
+                    failures.append(Failure(record_type, index, field, "unknown field", record[field]))
+        return failures
+
+    return check
+
+
+def compile_record(record_type, rule):
+    """Return a function check(value) -> list of failures for a top level record type."""
+    if rule['type'] == 'dict':
+        check_fields = compile_fields(rule['schema'])
+
+        def check(value):
+            if not isinstance(value, dict):
+                return [Failure(record_type, None, None, "must be of dict type", value)]
+            return check_fields(value, record_type, None)
+
+    elif rule['type'] == 'list':
+        check_fields = compile_fields(rule['schema']['schema'])
+
+        def check(value):
+            if not isinstance(value, list):
+                return [Failure(record_type, None, None, "must be of list type", value)]
+            failures = []
+            for i, item in enumerate(value):
+                if isinstance(item, dict):
+                    failures.extend(check_fields(item, record_type, i))
+                else:
+                    failures.append(Failure(record_type, i, None, "must be of dict type", item))
+            return failures
+
+    else:
+        raise ValueError("unsupported type for record %s: %s" % (record_type, rule['type']))
+    return check
+
+
+def compile_schema(schema):
+    """Return dict {record type: check function}."""
+    return {record_type: compile_record(record_type, rule) for record_type, rule in schema.items()}
+
+
+class ValidationReport(object):
+    """Failure statistics of a run. Keeps the first max_examples failures."""
+
+    def __init__(self, max_examples=100):
+        self.elements = 0
+        self.invalid = 0
+        self.counts = Counter()  # (record, field, message) -> number of failures
+        self.examples = []
+        self.max_examples = max_examples
+
+    def add(self, failures):
+        self.elements += 1
+        if failures:
+            self.invalid += 1
+            for f in failures:
+                self.counts[(f.record, f.field, f.message)] += 1
+            self.examples.extend(failures[:self.max_examples - len(self.examples)])
+
+    def merge(self, other):
+        self.elements += other.elements
+        self.invalid += other.invalid
+        self.counts.update(other.counts)
+        self.examples.extend(other.examples[:self.max_examples - len(self.examples)])
+
+    def to_dict(self):
+        """Return the report as a JSON serializable dict, see from_dict."""
+        return {"elements": self.elements,
+                "invalid": self.invalid,
+                "counts": [list(key) + [n] for key, n in self.counts.items()],
+                "examples": [list(f) for f in self.examples],
+                "max_examples": self.max_examples}
+
+    @classmethod
+    def from_dict(cls, d):
+        report = cls(d["max_examples"])
+        report.elements = d["elements"]
+        report.invalid = d["invalid"]
+        report.counts = Counter({tuple(c[:3]): c[3] for c in d["counts"]})
+        report.examples = [Failure(*f) for f in d["examples"]]
+        return report
+
+    def format(self):
+        lines = ["%i of %i elements invalid" % (self.invalid, self.elements)]
+        for (record, field, message), n in self.counts.most_common():
+            lines.append("  %s.%s: %s (%i)" % (record, field, message, n))
+        return "\n".join(lines)
+
+
+class Validator(object):
+    """Validate shaped elements (as returned by prepare_csv.shape_element)."""
+
+    def __init__(self, schema=schema.schema):
+        self.checks = compile_schema(schema)
+        self.report = ValidationReport()
+
+    def validate(self, element):
+        """Return a list of failures of the element, and add them to the report."""
+        failures = []
+        checks = self.checks
+        for record_type, value in element.items():
+            if record_type in checks:
+                failures.extend(checks[record_type](value))
+            else:
+                failures.append(Failure(record_type, None, None, "unknown field", None))
+        self.report.add(failures)
+        return failures
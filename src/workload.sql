@@ -0,0 +1,172 @@
+-- Query workload of queries.ipynb, for index_advisor.py and the benchmarks.
+-- Statements other than SELECT are run once before the queries. The views are
+-- TEMP views, so that running the workload does not change the database.
+-- The comment line before a query is its name.
+
+CREATE TEMP VIEW IF NOT EXISTS tags AS
+   SELECT * FROM nodes_tags
+   UNION ALL
+   SELECT * FROM ways_tags;
+
+CREATE TEMP VIEW IF NOT EXISTS resto_tags AS
+    select id, key, value
+    from tags
+    where id in (select id
+                 from tags
+                 where key = 'amenity'
+                 and value in ('restaurant', 'cafe', 'fast_food', 'ice_cream')
+                 )
+      and key in ('amenity', 'name', 'cuisine', 'city');
+
+CREATE TEMP VIEW IF NOT EXISTS resto AS
+    select distinct
+        am.id as id,
+        na.value as name,
+        ci.value as city,
+        cu.value as cuisine
+    from
+        resto_tags am
+        left join resto_tags na on
+            am.id = na.id
+            and na.key = 'name'
+        left join resto_tags ci on
+            am.id = ci.id
+            and ci.key = 'city'
+        left join resto_tags cu on
+            am.id = cu.id
+            and cu.key = 'cuisine';
+
+-- number of nodes, ways, tags
+SELECT 'nodes' as element, count(*) AS num FROM nodes
+UNION
+SELECT 'nodes_tags' as element, count(*) AS num FROM nodes_tags
+UNION
+SELECT 'ways' as element, count(*) AS num FROM ways
+UNION
+SELECT 'ways_tags' as element, count(*) AS num FROM ways_tags
+UNION
+SELECT 'ways_nodes' as element, count(*) AS num FROM ways_nodes;
+
+-- unique users
+SELECT count(user) as num_users
+  FROM (SELECT DISTINCT user FROM nodes
+        UNION
+        SELECT DISTINCT user FROM ways);
+
+-- users having only one edit
+SELECT count(*) as num_once
+FROM (SELECT user, count(*) AS edits
+        FROM (SELECT user FROM nodes
+              UNION ALL
+              SELECT user FROM ways)
+      GROUP BY user
+      HAVING edits = 1
+);
+
+-- top 10 users
+SELECT user, count(*) AS edits
+  FROM (SELECT user FROM nodes
+        UNION ALL
+        SELECT user FROM ways)
+GROUP BY user
+ORDER BY edits DESC
+LIMIT 10;
+
+-- cities of named nodes
+SELECT ci.value AS city, COUNT(*) AS num
+FROM nodes_tags ci, nodes_tags na
+WHERE ci.type = 'addr'
+  AND ci.key = 'city'
+  AND na.type = 'regular'
+  AND na.key = 'name'
+  AND ci.id = na.id
+GROUP by city
+ORDER BY num DESC
+LIMIT 10;
+
+-- cities of named nodes and ways
+SELECT ci.value AS city, COUNT(*) AS num
+FROM tags ci, tags na
+WHERE ci.type = 'addr'
+  AND ci.key = 'city'
+  AND na.type = 'regular'
+  AND na.key = 'name'
+  AND ci.id = na.id
+GROUP by city
+ORDER BY num DESC
+LIMIT 10;
+
+-- restaurants in nodes
+select count(*) num_in_nodes
+from nodes_tags
+where key = 'amenity'
+and value in ('restaurant', 'cafe', 'fast_food', 'ice_cream');
+
+-- restaurants in ways
+select count(*) num_in_ways
+from ways_tags
+where key = 'amenity'
+and value in ('restaurant', 'cafe', 'fast_food', 'ice_cream');
+
+-- restaurants in tags
+select count(*)
+from tags
+where key = 'amenity'
+and value in ('restaurant', 'cafe', 'fast_food', 'ice_cream');
+
+-- restaurants total
+select count(distinct id) as total from resto_tags;
+
+-- restaurant attributes
+select 'amenity' as key, count(*) as n from resto_tags where key='amenity'
+union
+select 'city' as key, count(*) as n from resto_tags where key='city'
+union
+select 'name' as key, count(*) as n from resto_tags where key='name'
+union
+select 'cuisine' as key, count(*) as n from resto_tags where key='cuisine';
+
+-- restaurants joined
+select name, city, cuisine
+from resto
+order by city;
+
+-- restaurants per city
+select city, count(*) as num
+from resto
+group by city
+order by num desc
+limit 10;
+
+-- most common cuisine
+select cuisine, count(*) as num
+from resto
+group by cuisine
+order by num desc
+limit 8;
+
+-- total population
+select sum(po.value) as total_population
+from nodes_tags po
+     join nodes_tags na using(id)
+     join nodes_tags pl using(id)
+where po.key = 'population'
+  and po.type = 'regular'
+  and na.key = 'name'
+  and na.type = 'regular'
+  and pl.key = 'place'
+  and pl.type = 'regular';
+
+-- population of places
+select na.value as city, 1*po.value as population
+from nodes_tags po
+     join nodes_tags na using(id)
+     join nodes_tags pl using(id)
+where po.key = 'population'
+  and po.type = 'regular'
+  and na.key = 'name'
+  and na.type = 'regular'
+  and pl.key = 'place'
+  and pl.type = 'regular'
+order by population desc
+limit 10;
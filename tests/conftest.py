@@ -0,0 +1,201 @@
+"""
+Fixtures shared by the tests: a small synthetic OSM file (synth_osm.py), its
+csv files (prepare_csv.py) and databases loaded from them (load_database.py).
+
+The scripts in src import each other by name and read osm.sql and other files
+relative to the working directory, so the tests run in src.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import xml.etree.ElementTree as ET
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+import load_database  # noqa: E402
+import prepare_csv  # noqa: E402
+import synth_osm  # noqa: E402
+
+N_NODES = 2000
+N_WAYS = 300
+N_RELATIONS = 20
+
+
+@pytest.fixture(autouse=True)
+def in_src(monkeypatch):
+    monkeypatch.chdir(SRC)
+
+
+@pytest.fixture(scope="session")
+def osm_file(tmp_path_factory):
+    """A synthetic OSM file, the same in every run."""
+    path = str(tmp_path_factory.mktemp("osm") / "synth.osm")
+    synth_osm.generate(path, N_NODES, N_WAYS, N_RELATIONS, seed=1)
+    return path
+
+
+@pytest.fixture(scope="session")
+def csv_dir(osm_file, tmp_path_factory):
+    """Directory with the osm file and the csv files of prepare_csv; read only."""
+    directory = tmp_path_factory.mktemp("csv")
+    path = str(directory / "synth.osm")
+    shutil.copy(osm_file, path)
+    cwd = os.getcwd()
+    os.chdir(SRC)
+    try:
+        prepare_csv.process_map(path, validate=False)
+    finally:
+        os.chdir(cwd)
+    return str(directory)
+
+
+@pytest.fixture(scope="session")
+def plain_db(csv_dir, tmp_path_factory):
+    """Database loaded from the csv files; read only, copy it to change it."""
+    return load_db(csv_dir, str(tmp_path_factory.mktemp("db") / "plain.db"))
+
+
+@pytest.fixture
+def db_copy(plain_db, tmp_path):
+    """(path, connection) of a copy of plain_db, for a test that changes it."""
+    path = str(tmp_path / "copy.db")
+    shutil.copy(plain_db, path)
+    conn = sqlite3.connect(path)
+    yield path, conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def change(osm_file, tmp_path_factory):
+    """A change file (.osc) for the OSM file, and the OSM file with the changes
+    applied, as (osc path, OSM path): modified, created and deleted nodes and
+    ways, and a relation (ignored by update_database)."""
+    directory = tmp_path_factory.mktemp("change")
+    root = ET.parse(osm_file).getroot()
+    nodes = {int(e.attrib["id"]): e for e in root.iter("node")}
+    ways = {int(e.attrib["id"]): e for e in root.iter("way")}
+    changes = {"create": [], "modify": [], "delete": []}
+
+    def bump(element):
+        element.attrib["version"] = str(int(element.attrib["version"]) + 1)
+        element.attrib["changeset"] = "99999999"
+
+    def set_children(element, refs, tags):
+        for child in list(element):
+            element.remove(child)
+        for ref in refs:
+            ET.SubElement(element, "nd", ref=ref)
+        for k, v in tags:
+            ET.SubElement(element, "tag", k=k, v=v)
+
+    for node_id in range(1, 21):
+        node = nodes[node_id]
+        bump(node)
+        node.attrib["lat"] = "%.7f" % (float(node.attrib["lat"]) + 0.001)
+        tags = [(tag.attrib["k"], tag.attrib["v"]) for tag in node.iter("tag")]
+        set_children(node, [], tags[1:] + [("amenity", "cafe"), ("addr:street", "Bahnhofstr. 3")])
+        changes["modify"].append(node)
+    for way_id in (1, 2):
+        way = ways[way_id]
+        bump(way)
+        refs = [nd.attrib["ref"] for nd in way.iter("nd")]
+        set_children(way, refs[1:] + ["30", "31"], [("highway", "residential"), ("name", "Neue Strasse")])
+        changes["modify"].append(way)
+    attrib = dict(nodes[1].attrib, version="1", changeset="99999999")
+    for node_id in (N_NODES + 1, N_NODES + 2):
+        nodes[node_id] = ET.Element("node", dict(attrib, id=str(node_id)))
+        set_children(nodes[node_id], [], [("name", "Neu %i" % node_id)])
+        changes["create"].append(nodes[node_id])
+    ways[N_WAYS + 1] = ET.Element("way", dict(ways[1].attrib, id=str(N_WAYS + 1), version="1"))
+    set_children(ways[N_WAYS + 1], [str(N_NODES + 1), str(N_NODES + 2), "40"], [("highway", "track")])
+    changes["create"].append(ways[N_WAYS + 1])
+    for way_id in (3, 4):
+        changes["delete"].append(ways.pop(way_id))
+    # deleted nodes may still be referenced, the database does not check it
+    for node_id in (N_NODES - 1, N_NODES):
+        changes["delete"].append(nodes.pop(node_id))
+    relation = ET.Element("relation", dict(ways[1].attrib, id="1"))
+    ET.SubElement(relation, "member", type="way", ref="1", role="outer")
+    changes["modify"].append(relation)
+
+    def to_xml(elements):
+        for element in elements:
+            element.tail = "\n"
+        return "".join(ET.tostring(element, encoding="unicode") for element in elements)
+
+    osc_path = str(directory / "change.osc")
+    with open(osc_path, "w", encoding="utf-8") as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n<osmChange version="0.6">\n')
+        for action, action_elements in changes.items():
+            fp.write("<%s>\n%s</%s>\n" % (action, to_xml(action_elements), action))
+        fp.write("</osmChange>\n")
+    osm_path = str(directory / "changed.osm")
+    with open(osm_path, "w", encoding="utf-8") as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        fp.write(to_xml([nodes[i] for i in sorted(nodes)] + [ways[i] for i in sorted(ways)]))
+        fp.write("</osm>\n")
+    return osc_path, osm_path
+
+
+@pytest.fixture(scope="session")
+def changed_db(change, tmp_path_factory):
+    """Database loaded from the OSM file with the changes applied; read only."""
+    directory = tmp_path_factory.mktemp("changed")
+    cwd = os.getcwd()
+    os.chdir(SRC)
+    try:
+        prepare(change[1], directory, None, False)
+    finally:
+        os.chdir(cwd)
+    return load_db(str(directory), str(directory / "changed.db"))
+
+
+def load_db(directory, path, **kwargs):
+    """Load the csv files in directory into the database path, with load_database.load."""
+    cwd = os.getcwd()
+    os.chdir(SRC)
+    try:
+        load_database.load(directory, path, bulk=True, **kwargs)
+    finally:
+        os.chdir(cwd)
+    return path
+
+
+def prepare(osm_file, directory, func=None, *args, **kwargs):
+    """Copy the osm file into directory, run prepare_csv.process_map (or func) on
+    the copy with the given arguments, and return the csv files as
+    {file name: bytes}."""
+    path = os.path.join(str(directory), os.path.basename(osm_file))
+    shutil.copy(osm_file, path)
+    (func or prepare_csv.process_map)(path, *args, **kwargs)
+    return read_csvs(directory)
+
+
+def read_csvs(directory):
+    """Return the csv files of prepare_csv in directory as {file name: bytes}."""
+    result = {}
+    for filename, _ in prepare_csv.CSV_FILES:
+        with open(os.path.join(str(directory), filename), "rb") as fp:
+            result[filename] = fp.read()
+    return result
+
+
+def dump_db(path, tables=load_database.TABLES):
+    """Return the schema objects and the rows of the tables of the database."""
+    conn = sqlite3.connect(path)
+    try:
+        schema = sorted(conn.execute("SELECT type, name, tbl_name FROM sqlite_master;").fetchall())
+        rows = {table: conn.execute("SELECT * FROM %s ORDER BY 1, 2, 3;" % table).fetchall() for table in tables}
+        return schema, rows
+    finally:
+        conn.close()
+
+
+def csv_rows(directory, table):
+    """Number of data rows of the csv file of table."""
+    with open(os.path.join(directory, table + ".csv"), encoding="utf-8", newline="") as fp:
+        return sum(1 for _ in load_database.csv.reader(fp)) - 1
@@ -0,0 +1,52 @@
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+import pytest
+
+import audit_engine
+import clean_cache
+import osm_reader
+import street_abbrev
+
+
+def plain(result):
+    """Comparable form of an audit result: nested defaultdicts as dicts."""
+    if isinstance(result, dict):
+        return {k: plain(v) for k, v in result.items()}
+    return result
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_single_pass_same_as_separate_runs(osm_file, parser):
+    auditors = audit_engine.load_auditors()
+    combined = audit_engine.run(osm_file, auditors, parser=parser)
+    assert list(combined) == [a.name for a in auditors]
+    for a in auditors:
+        assert plain(combined[a.name]) == plain(audit_engine.run(osm_file, [a], parser=parser)[a.name])
+
+
+def test_parsers_same_results(osm_file):
+    auditors = audit_engine.load_auditors()
+    results = [plain(audit_engine.run(osm_file, auditors, parser=parser)) for parser in osm_reader.PARSERS]
+    assert all(r == results[0] for r in results)
+
+
+def test_count_elements(osm_file):
+    expected = Counter(elem.tag for elem in ET.parse(osm_file).getroot().iter())
+    result = audit_engine.run(osm_file, audit_engine.load_auditors(["count_elements"]))["count_elements"]
+    assert dict(result) == dict(expected)
+
+
+def test_streets(osm_file):
+    streets = [tag.attrib["v"] for elem in ET.parse(osm_file).getroot() if elem.tag in ("node", "way")
+               for tag in elem.iterfind("tag") if tag.attrib["k"] == "addr:street"]
+    result = audit_engine.run(osm_file, audit_engine.load_auditors(["street_abbrev"]))["street_abbrev"]
+    assert result
+    assert set().union(*result.values()) == {s for s in streets if street_abbrev.ABBREV_RE.search(s)}
+
+
+def test_cleaned(osm_file):
+    # after cleaning no abbreviations and house numbers are left
+    auditors = audit_engine.load_auditors(["street_abbrev", "street_housenum"])
+    results = audit_engine.run(osm_file, auditors, cleaner=clean_cache.CleaningCache())
+    assert not results["street_abbrev"] and not results["street_housenum"]
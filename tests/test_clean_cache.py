@@ -0,0 +1,30 @@
+import xml.etree.ElementTree as ET
+
+import clean_cache
+import cleaning_rules
+
+
+def test_lru_eviction():
+    cache = clean_cache.LRUCache(2)
+    assert cache.get("a", str.upper, "a") == "A"
+    assert cache.get("b", str.upper, "b") == "B"
+    assert cache.get("a", str.upper, "x") == "A"  # hit, a is now the most recent
+    assert cache.get("c", str.upper, "c") == "C"  # evicts b
+    assert list(cache.data) == ["a", "c"]
+    assert len(cache) == 2
+    assert cache.stats == {"hits": 1, "misses": 3, "evictions": 1}
+
+
+def test_cleaning_cache_same_as_rules(osm_file):
+    cache = clean_cache.CleaningCache(maxsize=50)
+    n = 0
+    for tag in ET.parse(osm_file).getroot().iter("tag"):
+        k, v = tag.attrib["k"], tag.attrib["v"]
+        assert cache.clean(k, v) == cleaning_rules.RULE_SET.clean(k, v)
+        n += k in clean_cache.CLEANERS
+    stats = cache.stats
+    # only values of keys with rules are looked up
+    assert stats["hits"] + stats["misses"] == n
+    assert stats["hits"] > 0 and stats["evictions"] == stats["misses"] - len(cache.cache)
+    assert len(cache.cache) <= 50
+    assert "hit rate" in cache.format_stats()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pytest
+
+import addr_city
+import cleaning_rules
+import street_abbrev
+import street_housenum
+
+
+# the sequential cleaners that the rule table replaced (street_housenum.py, street_abbrev.py
+# and addr_city.py before cleaning_rules.py), applied one after the other
+def old_clean_street(value):
+    value = re.sub(r"\s+(\d+|[IVX]+)\s*$", "", value)
+    for pattern, repl in [("Str.$", "Straße"), ("str.$", "straße"), ("Strasse", "Straße"), ("strasse", "straße")]:
+        value = re.sub(pattern, repl, value)
+    return value
+
+
+def old_clean_city(value):
+    return re.sub("^Ostseebad *|^Insel *| */.*$", "", value)
+
+
+OLD_CLEANERS = {"addr:street": old_clean_street, "addr:city": old_clean_city}
+
+# (key, value, cleaned value), all the same as with the old cleaners
+CASES = [
+    ("addr:street", "Hauptstraße", "Hauptstraße"),
+    ("addr:street", "Bahnhofstr.", "Bahnhofstraße"),
+    ("addr:street", "Bahnhofstr. 12", "Bahnhofstraße"),
+    ("addr:street", "Putbuser Str.", "Putbuser Straße"),
+    ("addr:street", "Putbuser Str. 3", "Putbuser Straße"),
+    ("addr:street", "Dorfstrasse", "Dorfstraße"),
+    ("addr:street", "Dorfstrasse 7", "Dorfstraße"),
+    ("addr:street", "Alte Strasse", "Alte Straße"),
+    ("addr:street", "Am Markt 5 ", "Am Markt"),
+    ("addr:street", "Ringweg\t12", "Ringweg"),
+    # str. in the middle of a name is not an abbreviation at the end
+    ("addr:street", "Str. der Jugend", "Str. der Jugend"),
+    ("addr:street", "Seestr.weg", "Seestr.weg"),
+    ("addr:street", "Karl-Marx-Str. am Hafen", "Karl-Marx-Str. am Hafen"),
+    # roman numerals (I, V and X only) are house numbers
+    ("addr:street", "Dorfstraße II", "Dorfstraße"),
+    ("addr:street", "Schulstr. XIV", "Schulstraße"),
+    ("addr:street", "Ring IV", "Ring"),
+    ("addr:street", "Heinrich IV.", "Heinrich IV."),
+    ("addr:street", "Am Berg L", "Am Berg L"),
+    ("addr:city", "Binz", "Binz"),
+    ("addr:city", "Ostseebad Binz", "Binz"),
+    ("addr:city", "Ostseebad  Sellin", "Sellin"),
+    ("addr:city", "Insel Hiddensee", "Hiddensee"),
+    ("addr:city", "Sassnitz / Rügen", "Sassnitz"),
+    ("addr:city", "Bergen auf Rügen/OT Buschvitz", "Bergen auf Rügen"),
+    ("addr:city", "Ostseebad Göhren / Rügen", "Göhren"),
+    # the prefix needs no space after it, as before
+    ("addr:city", "Inselweg", "weg"),
+    ("addr:postcode", "18528 ", "18528 "),
+]
+
+# (key, value, cleaned value, value of the old cleaners): trailing whitespace after an
+# abbreviation, the old patterns only matched at the very end of the value
+CHANGED = [
+    ("addr:street", "Seestr.  ", "Seestraße  ", "Seestr.  "),
+    ("addr:street", "Seestr. ", "Seestraße ", "Seestr. "),
+]
+
+
+@pytest.mark.parametrize("key, value, cleaned", CASES)
+def test_rules_match_old_cleaners(key, value, cleaned):
+    assert cleaning_rules.RULE_SET.clean(key, value) == cleaned
+    assert OLD_CLEANERS.get(key, lambda v: v)(value) == cleaned
+
+
+@pytest.mark.parametrize("key, value, cleaned, old", CHANGED)
+def test_trailing_whitespace(key, value, cleaned, old):
+    assert cleaning_rules.RULE_SET.clean(key, value) == cleaned
+    assert OLD_CLEANERS[key](value) == old
+
+
+@pytest.mark.parametrize("key, value, cleaned", CASES + [case[:3] for case in CHANGED])
+def test_cleaners(key, value, cleaned):
+    cleaners = cleaning_rules.RULE_SET.cleaners()
+    assert cleaners.get(key, lambda v: v)(value) == cleaned
+
+
+@pytest.mark.parametrize("key, value, cleaned", CASES + [case[:3] for case in CHANGED])
+def test_update_functions_delegate(key, value, cleaned):
+    if key == "addr:street":
+        assert street_abbrev.update_streetname(value) == cleaned
+        assert street_housenum.update_streetname(value) == cleaned
+    elif key == "addr:city":
+        assert addr_city.update_cityname(value) == cleaned
+
+
+def test_capturing_group_rejected():
+    with pytest.raises(ValueError):
+        cleaning_rules.RuleSet([("addr:street", r"(Str)\.", "Straße")])
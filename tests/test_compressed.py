@@ -0,0 +1,64 @@
+import io
+
+import pytest
+
+import compressed
+
+STREAM_SIZE = 20000
+
+
+@pytest.fixture(scope="module")
+def original(osm_file):
+    with open(osm_file, "rb") as fp:
+        return fp.read()
+
+
+@pytest.fixture(scope="module")
+def bz2_file(osm_file, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("compressed") / "synth.osm.bz2")
+    compressed.compress_bz2(osm_file, path, STREAM_SIZE)
+    return path
+
+
+def test_compression(osm_file, bz2_file, tmp_path):
+    gz = str(tmp_path / "synth.osm.gz")
+    compressed.compress_gz(osm_file, gz)
+    assert compressed.compression(osm_file) is None
+    assert compressed.compression(bz2_file) == "bz2"
+    assert compressed.compression(gz) == "gz"
+    assert not compressed.is_compressed(osm_file) and compressed.is_compressed(gz)
+
+
+def test_stream_groups(bz2_file, original):
+    offsets = compressed.bz2_streams(bz2_file)
+    assert offsets[0] == 0
+    assert len(offsets) == -(-len(original) // STREAM_SIZE)
+    groups = compressed.stream_groups(bz2_file, 3 * STREAM_SIZE // 10)
+    # consecutive, covering the file
+    assert groups[0][0] == 0
+    assert all(end == start for (_, end), (start, _) in zip(groups, groups[1:]))
+    assert len(groups) > 1
+    assert compressed.stream_groups(bz2_file, 1 << 30) == [(0, groups[-1][1])]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_reader(bz2_file, original, workers):
+    groups = compressed.stream_groups(bz2_file, 1)
+    with io.BufferedReader(compressed.ParallelBz2Reader(bz2_file, groups, workers), 4096) as fp:
+        assert fp.read() == original
+
+
+@pytest.mark.parametrize("workers", [None, 1, 2])
+def test_decompress(bz2_file, original, tmp_path, workers):
+    path = str(tmp_path / "synth.osm")
+    compressed.decompress(bz2_file, path, workers)
+    with open(path, "rb") as fp:
+        assert fp.read() == original
+
+
+def test_open_osm(osm_file, original, tmp_path):
+    gz = str(tmp_path / "synth.osm.gz")
+    compressed.compress_gz(osm_file, gz)
+    for path in (osm_file, gz):
+        with compressed.open_osm(path) as fp:
+            assert fp.read() == original
@@ -0,0 +1,40 @@
+import io
+import pickle
+import xml.etree.ElementTree as ET
+
+import fastparse
+
+
+def records(elements):
+    return [(e.tag, e.attrib, e.tags, e.nds, e.members) for e in elements]
+
+
+def test_same_as_etree(osm_file):
+    expected = [fastparse.from_etree(elem) for elem in ET.parse(osm_file).getroot()
+                if elem.tag in fastparse.TOP_LEVEL]
+    # a small block size splits elements between blocks
+    assert records(fastparse.iter_elements(osm_file, block_size=1000)) == records(expected)
+
+
+def test_all_top_level_elements(osm_file):
+    root = ET.parse(osm_file).getroot()
+    elements = list(fastparse.iter_elements(osm_file, tags=None))
+    assert [e.tag for e in elements] == [root.tag] + [elem.tag for elem in root]
+
+
+def test_children_before_first_element_ignored():
+    data = b'<osm><tag k="a" v="b"/><nd ref="1"/><member type="way" ref="2" role=""/>' \
+           b'<node id="1" lat="1" lon="2"><tag k="c" v="d"/></node></osm>'
+    elements = list(fastparse.iter_elements(io.BytesIO(data)))
+    assert records(elements) == [("node", {"id": "1", "lat": "1", "lon": "2"}, [("c", "d")], [], [])]
+
+
+def test_to_xml_round_trip(osm_file):
+    elements = list(fastparse.iter_elements(osm_file))
+    data = b"<osm>\n" + b"".join(fastparse.to_xml(e) for e in elements) + b"</osm>\n"
+    assert records(fastparse.iter_elements(io.BytesIO(data))) == records(elements)
+
+
+def test_pickle(osm_file):
+    elements = list(fastparse.iter_elements(osm_file))[:50]
+    assert records(pickle.loads(pickle.dumps(elements))) == records(elements)
@@ -0,0 +1,98 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import spatial
+import update_database
+from conftest import N_WAYS, load_db
+
+np = pytest.importorskip("numpy")
+import geometry  # noqa: E402
+
+
+def reference(conn):
+    """The ways_geometry rows, computed way by way."""
+    coords = {i: (lat, lon) for i, lat, lon in conn.execute("SELECT id, lat, lon FROM nodes WHERE lat IS NOT NULL;")}
+    ways = {}
+    for way_id, node_id in conn.execute("SELECT id, node_id FROM ways_nodes ORDER BY id, position;"):
+        ways.setdefault(way_id, []).append(node_id)
+    rows = []
+    for way_id, refs in sorted(ways.items()):
+        points = [coords.get(ref) for ref in refs]
+        found = [p for p in points if p]
+        length = weighted_lat = weighted_lon = 0.0
+        for a, b in zip(points, points[1:]):
+            if a and b:
+                d = spatial.haversine(a[0], a[1], b[0], b[1])
+                length += d
+                weighted_lat += d * (a[0] + b[0]) / 2
+                weighted_lon += d * (a[1] + b[1]) / 2
+        if not found:
+            rows.append((way_id,) + (None,) * 6 + (0.0, len(refs), len(refs)))
+            continue
+        if length > 0:
+            centroid = (weighted_lat / length, weighted_lon / length)
+        else:
+            centroid = (sum(p[0] for p in found) / len(found), sum(p[1] for p in found) / len(found))
+        rows.append((way_id, min(p[0] for p in found), max(p[0] for p in found), min(p[1] for p in found),
+                     max(p[1] for p in found)) + centroid + (length, len(refs), len(refs) - len(found)))
+    return rows
+
+
+def ways_geometry(conn):
+    return conn.execute("SELECT * FROM ways_geometry ORDER BY id;").fetchall()
+
+
+def assert_same(rows, expected):
+    assert len(rows) == len(expected)
+    for row, expected_row in zip(rows, expected):
+        assert row == pytest.approx(expected_row, abs=1e-6)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 777, geometry.CHUNK_SIZE])
+def test_same_as_reference(db_copy, chunk_size):
+    _, db = db_copy
+    # ways with some and with all of their nodes missing
+    db.execute("DELETE FROM nodes WHERE id IN (SELECT node_id FROM ways_nodes WHERE position = 1 LIMIT 50);")
+    db.execute("DELETE FROM nodes WHERE id IN (SELECT node_id FROM ways_nodes WHERE id = 5);")
+    assert geometry.build_ways_geometry(db, chunk_size=chunk_size) == N_WAYS
+    rows = ways_geometry(db)
+    assert_same(rows, reference(db))
+    assert sum(1 for row in rows if row[9]) >= 50
+    assert rows[4][0] == 5 and rows[4][1] is None
+
+
+def test_node_store(db_copy, tmp_path):
+    _, db = db_copy
+    store_dir = str(tmp_path / "store")
+    os.mkdir(store_dir)
+    geometry.build_ways_geometry(db, store_dir, chunk_size=100)
+    store = geometry.NodeStore.open(store_dir)
+    nodes = db.execute("SELECT id, lat, lon FROM nodes ORDER BY id;").fetchall()
+    assert len(store) == len(nodes)
+    lat, lon, found = store.lookup(np.array([nodes[0][0], -1, nodes[-1][0]], dtype=np.int64))
+    assert found.tolist() == [True, False, True]
+    assert lat[[0, 2]].tolist() == pytest.approx([nodes[0][1], nodes[-1][1]], abs=1e-7)
+    assert lon[1] == 0
+    empty = geometry.NodeStore(*geometry.to_store_arrays([]))
+    assert empty.lookup(np.array([1, 2], dtype=np.int64))[2].tolist() == [False, False]
+
+
+@pytest.mark.parametrize("normalized", [False, True])
+def test_refresh_same_as_rebuild(csv_dir, change, changed_db, tmp_path, normalized):
+    path = load_db(csv_dir, str(tmp_path / "update.db"), normalized=normalized, geometry=True)
+    conn = sqlite3.connect(path)
+    before = ways_geometry(conn)
+    update_database.update(path, change[0], 1)
+    refreshed = ways_geometry(conn)
+    assert refreshed != before
+    conn.close()
+    rebuilt = str(tmp_path / "rebuilt.db")
+    shutil.copy(changed_db, rebuilt)
+    conn = sqlite3.connect(rebuilt)
+    geometry.build_ways_geometry(conn)
+    expected = ways_geometry(conn)
+    conn.close()
+    assert_same(refreshed, expected)
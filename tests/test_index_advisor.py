@@ -0,0 +1,58 @@
+import os
+import sqlite3
+
+import pytest
+
+import index_advisor
+import load_database
+from conftest import SRC
+
+A = index_advisor
+
+
+@pytest.fixture(scope="module")
+def workload():
+    return index_advisor.read_workload(os.path.join(SRC, index_advisor.WORKLOAD))
+
+
+@pytest.mark.parametrize("plan, found", [
+    ([(0, "SCAN nodes")], [A.FULL_SCAN]),
+    ([(0, "SEARCH nodes USING INTEGER PRIMARY KEY (rowid=?)")], []),
+    ([(0, "SCAN nodes_tags"), (0, "SCAN ways_tags AS w")], [A.FULL_SCAN, A.NESTED_SCAN]),
+    ([(0, "SCAN t"), (0, "SEARCH n USING AUTOMATIC COVERING INDEX (id=?)")], [A.FULL_SCAN, A.AUTOMATIC_INDEX]),
+    ([(0, "MATERIALIZE sub"), (1, "SCAN nodes"), (0, "SCAN sub"), (0, "USE TEMP B-TREE FOR ORDER BY")],
+     [A.FULL_SCAN, A.TEMP_BTREE]),
+])
+def test_problems(plan, found):
+    assert [problem for problem, _ in index_advisor.problems(plan)] == found
+
+
+def test_read_workload(workload):
+    setup, queries = workload
+    assert queries and all(q.name and index_advisor.RE_QUERY.match(q.sql) for q in queries)
+    assert not any(index_advisor.RE_QUERY.match(s) for s in setup)
+
+
+def test_advise(db_copy, workload):
+    setup, queries = workload
+    chosen, before, after = index_advisor.advise(db_copy[1], setup, queries)
+    assert chosen
+    assert index_advisor.cost(after) < index_advisor.cost(before)
+    for plan_before, plan_after in zip(before, after):
+        assert index_advisor.plan_cost(plan_after) <= index_advisor.plan_cost(plan_before)
+
+
+def test_index_set_same_results(csv_dir, plain_db, tmp_path, workload):
+    setup, queries = workload
+    path = str(tmp_path / "indexes.db")
+    load_database.load(csv_dir, path, bulk=True, indexes=True)
+    results = []
+    for db in (plain_db, path):
+        conn = sqlite3.connect(db)
+        for statement in setup:
+            conn.execute(statement)
+        results.append([sorted(conn.execute(q.sql).fetchall(), key=repr) for q in queries])
+        results.append(index_advisor.workload_plans(conn, queries))
+        conn.close()
+    assert results[2] == results[0]
+    assert index_advisor.cost(results[3]) < index_advisor.cost(results[1])
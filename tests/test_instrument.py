@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+import instrument
+import load_database
+import prepare_csv
+from conftest import csv_rows, prepare, read_csvs
+
+
+def test_stage():
+    stage = instrument.Stage()
+    stage.add(0.000003, 10)  # 3 us
+    stage.add(0.001, 5)  # 1000 us
+    report = stage.report()
+    assert (report["calls"], report["items"]) == (2, 15)
+    assert report["histogram_us"] == {"<4": 1, "<1024": 1}
+    assert report["max_us"] == 1000
+
+
+def test_prepare_csv(osm_file, csv_dir, tmp_path):
+    functions = dict(vars(prepare_csv))
+    with instrument.Instrumentation(interval=0, out=io.StringIO()) as instr:
+        instrument.instrument_prepare_csv(instr)
+        csvs = prepare(osm_file, tmp_path, None, True)
+    # same output, and the module is restored
+    assert csvs == read_csvs(csv_dir)
+    assert dict(vars(prepare_csv)) == functions
+    report = json.loads(json.dumps(instr.report()))
+    stages = report["stages"]
+    elements = csv_rows(csv_dir, "nodes") + csv_rows(csv_dir, "ways")
+    assert stages["shape"]["calls"] == stages["validate"]["calls"] == elements
+    assert stages["parse"]["items"] == elements
+    assert stages["write"]["items"] > 0 and stages["clean"]["calls"] > 0
+    assert report["counters"]["cleaned_values"] > 0
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_load_database(csv_dir, tmp_path, bulk):
+    with instrument.Instrumentation(interval=0, out=None) as instr:
+        instrument.instrument_load_database(instr)
+        load_database.load(csv_dir, str(tmp_path / "instr.db"), bulk=bulk)
+    stages = instr.report()["stages"]
+    rows = {table: csv_rows(csv_dir, table) for table in load_database.TABLES}
+    # data rows, without the header lines
+    assert stages["read"]["items"] == sum(rows.values())
+    for table, n in rows.items():
+        assert stages["load." + table]["items"] == n
+    assert load_database.csv is instrument.csv
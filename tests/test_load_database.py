@@ -0,0 +1,115 @@
+import sqlite3
+
+import pytest
+
+import load_database
+from conftest import csv_rows, dump_db
+
+CHECKPOINT_ROWS = 100
+BATCH_SIZE = 50  # bulk mode commits after a batch
+
+
+class Killed(Exception):
+    pass
+
+
+def kill_at(monkeypatch, table, checkpoints):
+    """Let the load die, without committing, at the given checkpoint of table."""
+    save_checkpoint = load_database.save_checkpoint
+    calls = []
+
+    def save(cur, name, rows):
+        if name == table:
+            calls.append(rows)
+            if len(calls) == checkpoints:
+                cur.connection.close()  # rolls back, like a killed process
+                raise Killed()
+        save_checkpoint(cur, name, rows)
+
+    monkeypatch.setattr(load_database, "save_checkpoint", save)
+
+
+def table_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {table: load_database.count_rows(conn.cursor(), table) for table in load_database.TABLES}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_load(csv_dir, tmp_path, bulk):
+    path = str(tmp_path / "osm.db")
+    load_database.load(csv_dir, path, bulk=bulk)
+    assert table_rows(path) == {table: csv_rows(csv_dir, table) for table in load_database.TABLES}
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_resume(csv_dir, tmp_path, monkeypatch, bulk):
+    path = str(tmp_path / "osm.db")
+    with monkeypatch.context() as m:
+        kill_at(m, "nodes_tags", 3)
+        with pytest.raises(Killed):
+            load_database.load(csv_dir, path, bulk=bulk, batch_size=BATCH_SIZE, checkpoint=True,
+                               checkpoint_rows=CHECKPOINT_ROWS)
+    load_database.load(csv_dir, path, bulk=bulk, batch_size=BATCH_SIZE, resume=True,
+                       checkpoint_rows=CHECKPOINT_ROWS)
+    assert table_rows(path) == {table: csv_rows(csv_dir, table) for table in load_database.TABLES}
+    conn = sqlite3.connect(path)
+    assert load_database.read_checkpoint(conn.cursor()) is None
+    conn.close()
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_fresh_checkpoint_after_interrupted_load(csv_dir, tmp_path, monkeypatch, bulk):
+    # the checkpoint of the first load must not be used to resume the second one
+    path = str(tmp_path / "osm.db")
+    with monkeypatch.context() as m:
+        kill_at(m, "nodes_tags", 3)
+        with pytest.raises(Killed):
+            load_database.load(csv_dir, path, bulk=bulk, batch_size=BATCH_SIZE, checkpoint=True,
+                               checkpoint_rows=CHECKPOINT_ROWS)
+    with monkeypatch.context() as m:
+        kill_at(m, "nodes", 2)
+        with pytest.raises(Killed):
+            load_database.load(csv_dir, path, bulk=bulk, batch_size=BATCH_SIZE, checkpoint=True,
+                               checkpoint_rows=CHECKPOINT_ROWS)
+    conn = sqlite3.connect(path)
+    assert load_database.read_checkpoint(conn.cursor()) == {"nodes": CHECKPOINT_ROWS}
+    conn.close()
+    load_database.load(csv_dir, path, bulk=bulk, batch_size=BATCH_SIZE, resume=True,
+                       checkpoint_rows=CHECKPOINT_ROWS)
+    assert table_rows(path) == {table: csv_rows(csv_dir, table) for table in load_database.TABLES}
+
+
+def test_bulk_report_counts_table_rows(csv_dir, tmp_path, capsys):
+    # the report shows the rows in the table, not the checkpoint count plus the inserted rows
+    path = str(tmp_path / "osm.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(load_database.read_schema() + load_database.CHECKPOINT_SCHEMA)
+    load_database.save_checkpoint(conn.cursor(), "nodes", 500)
+    conn.commit()
+    conn.close()
+    load_database.load(csv_dir, path, bulk=True, resume=True)
+    assert "reading nodes ...  %i entries" % (csv_rows(csv_dir, "nodes") - 500) in capsys.readouterr().out
+
+
+def test_bulk_same_as_row_by_row(csv_dir, tmp_path):
+    paths = [str(tmp_path / "rows.db"), str(tmp_path / "bulk.db")]
+    load_database.load(csv_dir, paths[0])
+    load_database.load(csv_dir, paths[1], bulk=True, batch_size=BATCH_SIZE)
+    assert dump_db(paths[1]) == dump_db(paths[0])
+
+
+def test_split_schema():
+    sql = """-- nodes
+CREATE TABLE a (id INTEGER);
+create unique index a_id on a (id);
+CREATE TABLE b (
+    id INTEGER  -- no index here
+);
+CREATE INDEX b_id ON b (id);
+"""
+    tables, indexes = load_database.split_schema(sql)
+    assert tables == "-- nodes\nCREATE TABLE a (id INTEGER);\nCREATE TABLE b (\n    id INTEGER  -- no index here\n);\n"
+    assert indexes == "create unique index a_id on a (id);\nCREATE INDEX b_id ON b (id);\n"
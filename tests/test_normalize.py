@@ -0,0 +1,69 @@
+import shutil
+import sqlite3
+
+import pytest
+
+import index_advisor
+import normalize
+import update_database
+from conftest import SRC, dump_db, load_db
+
+
+@pytest.fixture(scope="module")
+def normalized_db(csv_dir, tmp_path_factory):
+    return load_db(csv_dir, str(tmp_path_factory.mktemp("normalized") / "normalized.db"), normalized=True)
+
+
+def test_same_rows(plain_db, normalized_db):
+    assert dump_db(normalized_db)[1] == dump_db(plain_db)[1]
+
+
+def test_lookup_tables(plain_db, normalized_db):
+    conn = sqlite3.connect(normalized_db)
+    cur = conn.cursor()
+    assert normalize.is_normalized(cur)
+    sizes = normalize.table_sizes(cur)
+    plain = sqlite3.connect(plain_db)
+    assert not normalize.is_normalized(plain.cursor())
+    assert sizes["users"] == plain.execute("SELECT count(*) FROM (SELECT user FROM nodes UNION "
+                                           "SELECT user FROM ways);").fetchone()[0]
+    assert sizes["tag_values"] > 0
+    # values below min_value_count stay inline
+    assert cur.execute("SELECT count(*) FROM tag_values v JOIN nodes_tags_data t ON t.value = v.value;"
+                       ).fetchone()[0] == 0
+    # a second normalize does nothing
+    normalize.normalize(conn)
+    assert normalize.table_sizes(cur) == sizes
+    plain.close()
+    conn.close()
+
+
+def test_all_values_inline(csv_dir, plain_db, tmp_path):
+    path = load_db(csv_dir, str(tmp_path / "inline.db"), normalized=True, min_value_count=10 ** 9)
+    conn = sqlite3.connect(path)
+    assert normalize.table_sizes(conn.cursor())["tag_values"] == 0
+    conn.close()
+    assert dump_db(path)[1] == dump_db(plain_db)[1]
+
+
+def test_workload(plain_db, normalized_db):
+    setup, queries = index_advisor.read_workload(SRC + "/workload.sql")
+    results = {}
+    for path in (plain_db, normalized_db):
+        conn = sqlite3.connect(path)
+        for statement in setup:
+            conn.execute(statement)
+        results[path] = [sorted(conn.execute(query.sql).fetchall(), key=repr) for query in queries]
+        if path == normalized_db:
+            by_name = dict(zip([query.name for query in queries], results[path]))
+            for name, sql in normalize.NATIVE_QUERIES:
+                assert sorted(conn.execute(sql).fetchall(), key=repr) == by_name[name]
+        conn.close()
+    assert results[normalized_db] == results[plain_db]
+
+
+def test_update_through_views(normalized_db, change, changed_db, tmp_path):
+    path = str(tmp_path / "update.db")
+    shutil.copy(normalized_db, path)
+    update_database.update(path, change[0], 1)
+    assert dump_db(path)[1] == dump_db(changed_db)[1]
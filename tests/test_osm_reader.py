@@ -0,0 +1,104 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import audit_engine
+import compressed
+import fastparse
+import osm_reader
+import pbf
+import synth_osm
+
+# peak memory of reading or auditing any of the files, far below the size of the
+# larger file (about 3 MB) and of its element tree
+MAX_PEAK = 1024 * 1024
+SIZES = [(2000, 300), (12000, 1800)]
+
+
+def records(elements):
+    """Compact records of the top level elements, of ElementTree elements or records."""
+    result = []
+    for e in elements:
+        if isinstance(e, ET.Element):
+            e = fastparse.from_etree(e)
+        result.append((e.tag, e.attrib, e.tags, e.nds, e.members))
+    return result
+
+
+@pytest.fixture(scope="module")
+def synth_files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("sizes")
+    paths = []
+    for n_nodes, n_ways in SIZES:
+        path = str(directory / ("synth_%i_%i.osm" % (n_nodes, n_ways)))
+        synth_osm.generate(path, n_nodes, n_ways, n_relations=n_ways // 100)
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_read_memory_bounded(synth_files, parser):
+    peaks = [osm_reader.peak_memory(lambda: osm_reader.consume(osm_reader.iter_elements(path, None, parser)))
+             for path in synth_files]
+    assert os.path.getsize(synth_files[-1]) > 2 * MAX_PEAK
+    assert max(peaks) < MAX_PEAK
+    assert peaks[-1] < 1.5 * peaks[0]
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_audit_memory_bounded(synth_files, parser):
+    auditors = audit_engine.load_auditors(["count_elements", "tags"])
+    peaks = [osm_reader.peak_memory(lambda: audit_engine.run(path, auditors, parser=parser))
+             for path in synth_files]
+    assert max(peaks) < MAX_PEAK
+    assert peaks[-1] < 1.5 * peaks[0]
+
+
+@pytest.fixture(scope="module")
+def expected(osm_file):
+    """Records of all top level elements, from a full ElementTree parse."""
+    root = ET.parse(osm_file).getroot()
+    return records(root)
+
+
+@pytest.fixture(scope="module")
+def copies(osm_file, tmp_path_factory):
+    """gz, multi stream bz2 and PBF copies of the OSM file."""
+    directory = tmp_path_factory.mktemp("copies")
+    paths = {"gz": str(directory / "synth.osm.gz"), "bz2": str(directory / "synth.osm.bz2"),
+             "pbf": str(directory / "synth.osm.pbf")}
+    compressed.compress_gz(osm_file, paths["gz"])
+    compressed.compress_bz2(osm_file, paths["bz2"], stream_size=50000)
+    pbf.convert(osm_file, paths["pbf"])
+    return paths
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_parsers_same_records(osm_file, expected, parser):
+    elements = records(osm_reader.iter_elements(osm_file, None, parser))
+    assert elements[1:] == expected
+    assert elements[0][0] == "osm"
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+@pytest.mark.parametrize("kind", ["gz", "bz2"])
+def test_compressed_same_records(copies, expected, parser, kind):
+    assert records(osm_reader.iter_elements(copies[kind], None, parser))[1:] == expected
+
+
+def test_pbf_same_records(copies, expected):
+    # PBF files give records whatever the parser
+    top_level = [e for e in expected if e[0] in osm_reader.TOP_LEVEL]
+    for parser in osm_reader.PARSERS:
+        assert records(osm_reader.iter_elements(copies["pbf"], parser=parser)) == top_level
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_selected_tags(osm_file, expected, parser):
+    assert records(osm_reader.iter_elements(osm_file, ("way",), parser)) == [e for e in expected if e[0] == "way"]
+
+
+def test_unknown_parser(osm_file):
+    with pytest.raises(ValueError):
+        osm_reader.iter_elements(osm_file, parser="sax")
@@ -0,0 +1,73 @@
+import pytest
+
+import fastparse
+import pbf
+
+BLOCK_SIZE = 500
+
+
+def records(elements):
+    return [(e.tag, e.attrib, e.tags, e.nds, e.members) for e in elements]
+
+
+@pytest.fixture(scope="module")
+def pbf_file(osm_file, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("pbf") / "synth.osm.pbf")
+    pbf.convert(osm_file, path, BLOCK_SIZE)
+    return path
+
+
+@pytest.mark.parametrize("n", [0, 1, 127, 128, 300, 2 ** 31, 2 ** 63 - 1])
+def test_varint(n):
+    buf = pbf.encode_varint(n)
+    assert pbf.read_varint(buf, 0) == (n, len(buf))
+    assert pbf.unpack_varints(buf * 3) == [n] * 3
+
+
+@pytest.mark.parametrize("n", [0, 1, -1, 63, -64, 2 ** 40, -2 ** 40])
+def test_zigzag(n):
+    assert pbf.zigzag(pbf.encode_zigzag(n)) == n
+    assert pbf.signed(pbf.read_varint(pbf.encode_varint(n), 0)[0]) == n
+
+
+def test_packed_deltas():
+    values = [5, 3, 10, -7, 0]
+    buf = b"".join(pbf.encode_varint(pbf.encode_zigzag(d)) for d in pbf.deltas(values))
+    assert pbf.unpack_sint(buf, delta=True) == values
+    fields = list(pbf.iter_fields(pbf.field_varint(1, 150) + pbf.field_bytes(2, b"abc")))
+    assert [(number, bytes(value) if isinstance(value, memoryview) else value) for number, value in fields] == \
+        [(1, 150), (2, b"abc")]
+
+
+def test_is_pbf(osm_file, pbf_file):
+    assert pbf.is_pbf(pbf_file)
+    assert not pbf.is_pbf(osm_file)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_same_records(osm_file, pbf_file, workers):
+    expected = records(fastparse.iter_elements(osm_file))
+    assert records(pbf.iter_elements(pbf_file, workers=workers)) == expected
+    ways = [r for r in expected if r[0] == "way"]
+    assert records(pbf.iter_elements(pbf_file, tags=("way",), workers=workers)) == ways
+
+
+def test_root_and_bounds(osm_file, pbf_file):
+    xml_root, xml_bounds = list(fastparse.iter_elements(osm_file, tags=None))[:2]
+    root, bounds = list(pbf.iter_elements(pbf_file, tags=None, workers=1))[:2]
+    assert (root.tag, bounds.tag) == ("osm", "bounds")
+    # coordinates with 7 decimals, like the nodes
+    assert {k: float(v) for k, v in bounds.attrib.items()} == {k: float(v) for k, v in xml_bounds.attrib.items()}
+    assert root.attrib["generator"] == xml_root.attrib["generator"]
+
+
+def test_blocks(pbf_file):
+    with open(pbf_file, "rb") as fp:
+        types = [blob_type for blob_type, _, _ in pbf.iter_blobs(fp)]
+    assert types[0] == "OSMHeader"
+    # nodes, ways and relations are written in blocks of their own
+    assert types.count("OSMData") >= -(-2000 // BLOCK_SIZE) + 1 + 1
+
+
+def test_check(tmp_path):
+    assert pbf.check(str(tmp_path), 1000, 100, workers=1, log=lambda *args: None)
@@ -0,0 +1,92 @@
+import shutil
+import threading
+from xml.parsers import expat
+
+import pytest
+
+import prepare_csv
+from conftest import prepare, read_csvs
+
+shape_batch = prepare_csv.shape_batch
+
+
+def pipelined(*args, **kwargs):
+    report, times = prepare_csv.process_map_pipelined(*args, **kwargs)
+    assert list(times) == ["parse", "transform", "write"]
+    assert all(t.seconds >= t.idle >= 0 for t in times.values())
+    return report
+
+
+@pytest.mark.parametrize("parser,workers", [("etree", 1), ("expat", 2)])
+def test_same_as_process_map(osm_file, csv_dir, tmp_path, parser, workers):
+    assert prepare(osm_file, tmp_path, pipelined, False, workers, batch_size=37, queue_size=2, parser=parser) == \
+        read_csvs(csv_dir)
+
+
+def test_validation_report(osm_file, tmp_path):
+    (tmp_path / "serial").mkdir()
+    (tmp_path / "pipeline").mkdir()
+    shutil.copy(osm_file, str(tmp_path / "serial" / "synth.osm"))
+    shutil.copy(osm_file, str(tmp_path / "pipeline" / "synth.osm"))
+    expected = prepare_csv.process_map(str(tmp_path / "serial" / "synth.osm"), True)
+    report = pipelined(str(tmp_path / "pipeline" / "synth.osm"), True, 2, batch_size=100)
+    assert report.elements == expected.elements > 0
+    assert report.format() == expected.format()
+
+
+def test_parse_error(osm_file, tmp_path):
+    path = str(tmp_path / "broken.osm")
+    with open(osm_file, "rb") as fp:
+        data = fp.read()
+    with open(path, "wb") as fp:
+        fp.write(data[:len(data) // 2] + b"<node <")
+    # raised in the parser thread, passed on to the caller
+    with pytest.raises(expat.ExpatError):
+        prepare_csv.process_map_pipelined(path, False, 2, batch_size=50, parser="expat")
+
+
+def failing_shape_batch(task):
+    # module level, so that the pool can pickle it
+    records, validate = task
+    if any(record.attrib["id"] == "500" for record in records):
+        raise ValueError("shape error")
+    return shape_batch(task)
+
+
+def test_shape_error(osm_file, tmp_path, monkeypatch):
+    path = str(tmp_path / "synth.osm")
+    shutil.copy(osm_file, path)
+    monkeypatch.setattr(prepare_csv, "shape_batch", failing_shape_batch)
+    threads = threading.enumerate()
+    # raised in a worker process; the parser thread is blocked on the full queue
+    with pytest.raises(ValueError, match="shape error"):
+        prepare_csv.process_map_pipelined(path, False, 2, batch_size=10, queue_size=1, parser="expat")
+    assert threading.enumerate() == threads
+
+
+class FullDisk(object):
+    def write(self, text):
+        raise OSError("no space left")
+
+
+def test_write_error(osm_file, tmp_path, monkeypatch):
+    path = str(tmp_path / "synth.osm")
+    shutil.copy(osm_file, path)
+    open_csv_files = prepare_csv.open_csv_files
+    monkeypatch.setattr(prepare_csv, "open_csv_files", lambda *args, **kwargs: [
+        FullDisk() for _ in open_csv_files(*args, **kwargs)])
+    threads = threading.enumerate()
+    # the writer thread stops the pipeline
+    with pytest.raises(OSError, match="no space left"):
+        prepare_csv.process_map_pipelined(path, False, 2, batch_size=10, queue_size=1)
+    assert threading.enumerate() == threads
+
+
+def test_format_stage_times():
+    times = {"parse": prepare_csv.StageTimes(), "write": prepare_csv.StageTimes()}
+    times["parse"].seconds, times["parse"].idle = 2.0, 0.5
+    times["write"].seconds, times["write"].idle = 0.0, 0.0
+    lines = prepare_csv.format_stage_times(times).splitlines()
+    assert len(lines) == 3
+    assert lines[1].split() == ["parse", "2.00", "0.50", "25%"]
+    assert lines[2].split() == ["write", "0.00", "0.00", "0%"]
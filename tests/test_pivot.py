@@ -0,0 +1,68 @@
+import pytest
+
+import pivot
+
+KEYS = ["amenity", "name", "addr:city", "contact:e-mail", "name:de-CH", "opening hours", 'say "hi"']
+# extra tags: (node id, type, key, value)
+TAGS = [(1, "contact", "e-mail", "info@example.org"), (2, "contact", "e-mail", "a@b.c"),
+        (2, "name", "de-CH", "Rügen"), (3, "regular", "opening hours", "Mo-Fr"),
+        (3, "regular", 'say "hi"', "hi")]
+
+
+@pytest.fixture
+def conn(db_copy):
+    _, conn = db_copy
+    conn.executemany("INSERT INTO nodes_tags (id, type, key, value) VALUES (?, ?, ?, ?);", TAGS)
+    conn.commit()
+    return conn
+
+
+def self_join(conn, keys):
+    """Rows of the pivot table by one join of the tag tables per key."""
+    rows = []
+    for element_type, tag_table in pivot.TAG_TABLES:
+        ids = conn.execute("SELECT DISTINCT id FROM %s;" % tag_table).fetchall()
+        for (element_id,) in ids:
+            values = []
+            for key in keys:
+                typ, k = pivot.split_colon(key)
+                row = conn.execute("SELECT max(value) FROM %s WHERE id = ? AND type = ? AND key = ?;" % tag_table,
+                                   (element_id, typ, k)).fetchone()
+                values.append(row[0])
+            if any(v is not None for v in values):
+                rows.append((element_id, element_type) + tuple(values))
+    return sorted(rows)
+
+
+def pivot_rows(conn, name):
+    return sorted(conn.execute('SELECT * FROM "%s";' % name).fetchall())
+
+
+def test_column_names():
+    assert pivot.column_names(["addr:city", "contact:e-mail", "name:de-CH"]) == \
+        ["addr_city", "contact_e_mail", "name_de_CH"]
+
+
+@pytest.mark.parametrize("keys", [["name:de-CH", "name_de_CH"], ["a-b", "A:B"], ["id"], ["element:type"],
+                                  ["a,b"]])
+def test_column_collisions(keys):
+    with pytest.raises(ValueError):
+        pivot.column_names(keys)
+
+
+def test_create_pivot(conn):
+    pivot.create_pivot(conn, "wide-table", KEYS)
+    assert pivot_rows(conn, "wide-table") == self_join(conn, KEYS)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info("wide-table");')]
+    assert columns == ["id", "element_type"] + pivot.column_names(KEYS)
+    assert conn.execute('SELECT contact_e_mail, name_de_CH FROM "wide-table" WHERE id = 2 '
+                        "AND element_type = 'node';").fetchone() == ("a@b.c", "Rügen")
+
+
+def test_refresh_elements(conn):
+    pivot.create_pivot(conn, "wide", KEYS)
+    conn.execute("UPDATE nodes_tags SET value = 'x@y.z' WHERE id = 1 AND key = 'e-mail';")
+    conn.execute("DELETE FROM nodes_tags WHERE id = 3;")
+    pivot.refresh_all(conn.cursor(), [("node", 1), ("node", 3)])
+    conn.commit()
+    assert pivot_rows(conn, "wide") == self_join(conn, KEYS)
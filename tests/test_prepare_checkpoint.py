@@ -0,0 +1,86 @@
+import os
+import shutil
+
+import pytest
+
+import compressed
+import prepare_csv
+from conftest import read_csvs
+
+CHUNK_SIZE = 20000  # bytes, about 20 checkpoints in the synthetic file
+
+
+class Killed(Exception):
+    pass
+
+
+def kill_at(monkeypatch, n):
+    """Kill the run after the csv rows of chunk n are written, before its checkpoint."""
+    append_chunk = prepare_csv.append_chunk
+    calls = []
+
+    def killing_append_chunk(outfiles, tmpdir, index):
+        append_chunk(outfiles, tmpdir, index)
+        calls.append(index)
+        if len(calls) == n:
+            for outfile in outfiles:
+                outfile.flush()
+            raise Killed()
+
+    monkeypatch.setattr(prepare_csv, "append_chunk", killing_append_chunk)
+
+
+@pytest.fixture
+def osm_copy(osm_file, tmp_path):
+    path = str(tmp_path / "synth.osm")
+    shutil.copy(osm_file, path)
+    return path
+
+
+def checkpoint(osm_copy):
+    return prepare_csv.read_checkpoint(os.path.join(os.path.dirname(osm_copy), prepare_csv.CHECKPOINT_FILE))
+
+
+def test_checkpointed_same_csv(osm_copy, csv_dir):
+    assert prepare_csv.process_map_checkpointed(osm_copy, False, chunk_size=CHUNK_SIZE) is None
+    assert read_csvs(os.path.dirname(osm_copy)) == read_csvs(csv_dir)
+    assert checkpoint(osm_copy) is None
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_resume(osm_copy, csv_dir, tmp_path, monkeypatch, workers):
+    (tmp_path / "serial").mkdir()
+    expected_report = prepare_csv.process_map(shutil.copy(osm_copy, str(tmp_path / "serial")), True)
+    kill_at(monkeypatch, 5)
+    with pytest.raises(Killed):
+        prepare_csv.process_map_checkpointed(osm_copy, True, chunk_size=CHUNK_SIZE)
+    monkeypatch.undo()
+    state = checkpoint(osm_copy)
+    assert state["elements"] > 0 and state["offset"] < os.path.getsize(osm_copy)
+    report = prepare_csv.process_map_checkpointed(osm_copy, True, workers, resume=True)
+    assert read_csvs(os.path.dirname(osm_copy)) == read_csvs(csv_dir)
+    assert report.format() == expected_report.format()
+    assert checkpoint(osm_copy) is None
+
+
+def test_resume_without_checkpoint(osm_copy, csv_dir):
+    prepare_csv.process_map(osm_copy, False, resume=True)
+    assert read_csvs(os.path.dirname(osm_copy)) == read_csvs(csv_dir)
+
+
+def test_checkpoint_of_other_file(osm_copy, monkeypatch):
+    kill_at(monkeypatch, 2)
+    with pytest.raises(Killed):
+        prepare_csv.process_map_checkpointed(osm_copy, False, chunk_size=CHUNK_SIZE)
+    monkeypatch.undo()
+    with open(osm_copy, "ab") as fp:
+        fp.write(b"\n")
+    with pytest.raises(ValueError):
+        prepare_csv.process_map_checkpointed(osm_copy, False, resume=True)
+
+
+def test_compressed_input(osm_copy):
+    gz = osm_copy + ".gz"
+    compressed.compress_gz(osm_copy, gz)
+    with pytest.raises(ValueError):
+        prepare_csv.process_map(gz, False, checkpoint=True)
@@ -0,0 +1,39 @@
+import os
+import shutil
+
+import chunks
+import prepare_csv
+from conftest import prepare, read_csvs
+
+CHUNK_SIZE = 20000  # bytes, about 20 chunks of the synthetic file
+
+
+def test_chunks_aligned(osm_file):
+    ranges = chunks.split(osm_file, 4, CHUNK_SIZE)
+    assert len(ranges) > 4
+    with open(osm_file, "rb") as fp:
+        start, end = chunks.data_range(fp)
+        fp.seek(0)
+        data = fp.read()
+    assert ranges[0][0] == start and ranges[-1][1] == end
+    for (_, a_end), (b_start, _) in zip(ranges, ranges[1:]):
+        assert a_end == b_start
+    for range_start, _ in ranges:
+        assert chunks.RE_BOUNDARY.match(data, range_start)
+
+
+def test_parallel_same_as_serial(osm_file, csv_dir, tmp_path):
+    expected = read_csvs(csv_dir)
+    assert prepare(osm_file, tmp_path, prepare_csv.process_map_parallel, False, 2, CHUNK_SIZE) == expected
+
+
+def test_parallel_validation_report(osm_file, tmp_path):
+    reports = []
+    for name, func, args in [("serial", prepare_csv.process_map, (True,)),
+                             ("parallel", prepare_csv.process_map_parallel, (True, 2, CHUNK_SIZE))]:
+        os.mkdir(str(tmp_path / name))
+        path = str(tmp_path / name / "synth.osm")
+        shutil.copy(osm_file, path)
+        reports.append(func(path, *args))
+    assert reports[0].elements > 0 and reports[0].invalid == 0
+    assert reports[1].format() == reports[0].format()
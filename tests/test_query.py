@@ -0,0 +1,60 @@
+import threading
+
+import query
+
+SQL = "SELECT count(*) FROM nodes WHERE id > ?;"
+
+
+def test_query_and_cache(plain_db):
+    db = query.Database(plain_db)
+    try:
+        first = db.query(SQL, (100,))
+        second = db.query(SQL, (100,))
+        assert first == second
+        assert first.columns == ("count(*)",)
+        assert [t.cached for t in db.timings] == [False, True]
+    finally:
+        db.close()
+
+
+def test_cache_invalidated_by_write(db_copy):
+    path, conn = db_copy
+    db = query.Database(path)
+    try:
+        before = db.query(SQL, (0,)).rows[0][0]
+        conn.execute("DELETE FROM nodes WHERE id <= 10;")
+        conn.commit()
+        assert db.query(SQL, (0,)).rows[0][0] == before - 10
+    finally:
+        db.close()
+
+
+def test_threads(plain_db, monkeypatch):
+    monkeypatch.setattr(query, "MAX_TIMINGS", 100)
+    db = query.Database(plain_db, pool_size=2)
+    n_threads, n_queries = 8, 150
+    expected = db.query(SQL, (500,))
+    errors = []
+
+    def run():
+        try:
+            for i in range(n_queries):
+                assert db.query(SQL, (500,)) == expected
+                db.query(SQL, (i,))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.close()
+    assert errors == []
+    # the same trimming as one thread logging all queries
+    n = 0
+    for _ in range(1 + n_threads * n_queries * 2):
+        if n >= 100:
+            n -= 50
+        n += 1
+    assert len(db.timings) == n
@@ -0,0 +1,76 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import compressed
+import fastparse
+import sampling
+
+BBOX = (54.3, 13.2, 54.5, 13.5)
+
+
+def records(path):
+    return [(e.tag, e.attrib, e.tags, e.nds, e.members) for e in fastparse.iter_elements(path)]
+
+
+@pytest.fixture(scope="module")
+def original(osm_file):
+    return records(osm_file)
+
+
+def run_sample(osm_file, tmp_path, mode, **kwargs):
+    path = str(tmp_path / ("%s.osm" % mode))
+    n = sampling.sample(osm_file, path, mode, **kwargs)
+    ET.parse(path)  # well formed
+    sampled = records(path)
+    assert len(sampled) == n
+    return sampled
+
+
+def in_order(sampled, original):
+    """True if sampled is a subsequence of original."""
+    elements = iter(original)
+    return all(any(e == o for o in elements) for e in sampled)
+
+
+def test_every(osm_file, tmp_path, original):
+    assert run_sample(osm_file, tmp_path, "every", k=7) == original[::7]
+
+
+def test_reservoir(osm_file, tmp_path, original):
+    sampled = run_sample(osm_file, tmp_path, "reservoir", n=100, seed=3)
+    assert len(sampled) == 100 and in_order(sampled, original)
+    assert run_sample(osm_file, tmp_path, "reservoir", n=100, seed=3) == sampled
+    assert run_sample(osm_file, tmp_path, "reservoir", n=100, seed=4) != sampled
+
+
+def test_stratified(osm_file, tmp_path, original):
+    sampled = run_sample(osm_file, tmp_path, "stratified", n=10)
+    assert in_order(sampled, original)
+    assert [e[0] for e in sampled].count("way") == 10
+    assert [e[0] for e in sampled].count("relation") == 10
+    by_key = run_sample(osm_file, tmp_path, "stratified", n=2, by="key")
+    keys = set(k for e in original for k, _ in e[2])
+    assert keys == set(k for e in by_key for k, _ in e[2])
+
+
+def test_bbox_closure(osm_file, tmp_path, original):
+    min_lat, min_lon, max_lat, max_lon = BBOX
+    inside = set(e[1]["id"] for e in original if e[0] == "node" and min_lat <= float(e[1]["lat"]) <= max_lat
+                 and min_lon <= float(e[1]["lon"]) <= max_lon)
+    ways = set(e[1]["id"] for e in original if e[0] == "way" and inside.intersection(e[3]))
+    sampled = run_sample(osm_file, tmp_path, "bbox", bbox=BBOX, types=("node", "way"))
+    assert set(e[1]["id"] for e in sampled if e[0] == "node") == inside
+    assert set(e[1]["id"] for e in sampled if e[0] == "way") == ways
+    closed = run_sample(osm_file, tmp_path, "bbox", bbox=BBOX, types=("node", "way"), closure=True)
+    nodes = set(e[1]["id"] for e in closed if e[0] == "node")
+    assert all(ref in nodes for e in closed if e[0] == "way" for ref in e[3])
+    assert in_order(closed, original)
+    bounds = ET.parse(str(tmp_path / "bbox.osm")).getroot().find("bounds").attrib
+    assert [float(bounds[k]) for k in ("minlat", "minlon", "maxlat", "maxlon")] == list(BBOX)
+
+
+def test_compressed_input(osm_file, tmp_path):
+    gz = str(tmp_path / "synth.osm.gz")
+    compressed.compress_gz(osm_file, gz)
+    assert run_sample(gz, tmp_path, "reservoir", n=50) == run_sample(osm_file, tmp_path, "reservoir", n=50)
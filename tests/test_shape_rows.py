@@ -0,0 +1,28 @@
+from contextlib import ExitStack
+
+import pytest
+
+import prepare_csv
+from conftest import prepare, read_csvs
+
+
+@pytest.mark.parametrize("parser", ["etree", "expat"])
+def test_same_as_shape_element(osm_file, parser):
+    n = 0
+    for element in prepare_csv.get_elements(osm_file, parser):
+        assert prepare_csv.row_dicts(element.tag, prepare_csv.shape_rows(element)) == \
+            prepare_csv.shape_element(element)
+        n += 1
+    assert n == 2000 + 300
+
+
+def test_expat_same_csv(osm_file, csv_dir, tmp_path):
+    assert prepare(osm_file, tmp_path, prepare_csv.process_map, False, parser="expat") == read_csvs(csv_dir)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 100000])
+def test_batch_size(osm_file, csv_dir, tmp_path, batch_size):
+    with ExitStack() as stack:
+        writers = prepare_csv.open_writers(stack, str(tmp_path))
+        prepare_csv.write_elements(prepare_csv.get_elements(osm_file, "expat"), writers, False, batch_size)
+    assert read_csvs(str(tmp_path)) == read_csvs(csv_dir)
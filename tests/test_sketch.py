@@ -0,0 +1,83 @@
+from collections import Counter
+
+import pytest
+
+import fastparse
+import sketch
+import tags
+
+
+def stream():
+    """Items with frequencies 1000 / rank, for 2000 ranks."""
+    return [("item%i" % rank) for rank in range(1, 2001) for _ in range(1000 // rank)]
+
+
+def test_count_min():
+    items = stream()
+    cms = sketch.CountMinSketch(epsilon=0.01, delta=0.01)
+    for item in items:
+        cms.add(item)
+    assert cms.total == len(items)
+    for item, n in Counter(items).items():
+        assert n <= cms.estimate(item) <= n + cms.error()
+    assert cms.estimate("missing") <= cms.error()
+    assert cms.memory() == 8 * cms.width * cms.depth
+
+
+def test_top_k():
+    items = stream()
+    cms = sketch.CountMinSketch(epsilon=0.001)
+    top = sketch.TopK(10)
+    for item in items:
+        top.offer(item, cms.add(item))
+    assert [item for item, _ in top.items()] == [item for item, _ in Counter(items).most_common(10)]
+
+
+@pytest.mark.parametrize("n", [10, 1000, 50000])
+def test_hyperloglog(n):
+    hll = sketch.HyperLogLog()
+    for i in range(n):
+        hll.add("value%i" % i)
+        hll.add("value%i" % (i // 2))  # duplicates do not count
+    assert abs(hll.estimate() - n) <= 3 * hll.error() * n + 1
+    assert hll.memory() == 2 ** sketch.PRECISION
+
+
+@pytest.fixture(scope="module")
+def exact(osm_file):
+    return tags.process_map(osm_file)
+
+
+def check_stats(stats, exact):
+    error = stats.frequencies.error()
+    for cat, keys in exact.items():
+        assert stats.totals[cat] == sum(keys.values())
+        n = len(keys)
+        assert abs(stats.distinct_keys[cat].estimate() - n) <= 3 * stats.distinct_keys[cat].error() * n + 1
+    counts = {key: n for keys in exact.values() for key, n in keys.items()}
+    top = stats.top.items()
+    assert len(top) == min(stats.top.k, len(counts))
+    for key, estimate in top:
+        assert counts[key] <= estimate <= counts[key] + error
+    # the most frequent key is found
+    assert top[0][0] == max(counts, key=counts.get)
+
+
+def test_process_map_stats(osm_file, exact):
+    check_stats(tags.process_map_stats(osm_file, k=5), exact)
+
+
+def test_small_buffer(osm_file, exact):
+    stats = tags.TagStats(k=5, buffer_size=50)
+    for element in fastparse.iter_elements(osm_file):
+        for key, value in element.tags:
+            stats.add(key, value)
+    stats.flush()
+    check_stats(stats, exact)
+    values = {}
+    for element in fastparse.iter_elements(osm_file):
+        for key, value in element.tags:
+            values.setdefault(key, set()).add(value)
+    for key, hll in stats.distinct_values.items():
+        # values are counted from the time the key entered the top keys on
+        assert hll.estimate() <= len(values[key]) * (1 + 3 * hll.error()) + 1
@@ -0,0 +1,47 @@
+import math
+
+import pytest
+
+import spatial
+import update_database
+
+
+@pytest.fixture
+def conn(db_copy):
+    _, conn = db_copy
+    spatial.build_spatial_index(conn)
+    return conn
+
+
+def test_indexed_same_as_scan(conn):
+    # benchmark raises AssertionError if the results differ
+    timings = spatial.benchmark(conn, n_queries=10, size=0.05, radius=3000)
+    assert set(timings) == {"nodes_in_bbox", "ways_in_bbox", "nodes_in_radius"}
+    assert spatial.nodes_in_bbox(conn, 54.2, 13.0, 54.7, 13.8)
+
+
+def test_haversine():
+    # one degree of latitude
+    assert spatial.haversine(54.0, 13.0, 55.0, 13.0) == pytest.approx(spatial.METERS_PER_DEGREE)
+    assert spatial.haversine(54.5, 13.4, 54.5, 13.4) == 0
+
+
+def test_radius_bbox_encloses_circle():
+    lat, lon, radius = 54.5, 13.4, 2000
+    min_lat, min_lon, max_lat, max_lon = spatial.radius_bbox(lat, lon, radius)
+    for i in range(36):
+        angle = math.radians(i * 10)
+        # points just inside the circle
+        dlat = 0.999 * radius * math.cos(angle) / spatial.METERS_PER_DEGREE
+        dlon = 0.999 * radius * math.sin(angle) / (spatial.METERS_PER_DEGREE * math.cos(math.radians(lat)))
+        assert min_lat <= lat + dlat <= max_lat and min_lon <= lon + dlon <= max_lon
+
+
+def test_refresh_after_update(db_copy, conn, change):
+    update_database.update(db_copy[0], change[0], 1)
+    updated = [conn.execute("SELECT * FROM %s ORDER BY id;" % table).fetchall()
+               for table in ("nodes_rtree", "ways_rtree")]
+    spatial.build_spatial_index(conn)
+    rebuilt = [conn.execute("SELECT * FROM %s ORDER BY id;" % table).fetchall()
+               for table in ("nodes_rtree", "ways_rtree")]
+    assert updated == rebuilt
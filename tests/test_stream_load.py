@@ -0,0 +1,46 @@
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import osm_reader
+import stream_load
+from conftest import dump_db
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_same_as_csv_load(osm_file, plain_db, tmp_path, parser):
+    path = str(tmp_path / "stream.db")
+    counts, report = stream_load.load(osm_file, path, validate=True, batch_size=100, queue_size=2, parser=parser)
+    schema, rows = dump_db(path)
+    assert (schema, rows) == dump_db(plain_db)
+    assert counts == {table: len(table_rows) for table, table_rows in rows.items()}
+    assert report.invalid == 0
+
+
+def test_parse_error(tmp_path):
+    path = str(tmp_path / "broken.osm")
+    with open(path, "w") as fp:
+        fp.write('<osm><node id="1" lat="1" lon="2" user="u" uid="1" version="1" changeset="1" timestamp="t">')
+    # the exception of the parser thread is raised in the caller
+    with pytest.raises(ET.ParseError):
+        stream_load.load(path, str(tmp_path / "broken.db"))
+
+
+@pytest.mark.parametrize("parser", osm_reader.PARSERS)
+def test_insert_error(tmp_path, parser):
+    path = str(tmp_path / "duplicate.osm")
+    node = '<node id="%i" lat="54.4" lon="13.4" user="u" uid="1" version="1" changeset="1" timestamp="t"/>\n'
+    with open(path, "w") as fp:
+        fp.write("<osm>\n" + node % 1 + "".join(node % i for i in range(1, 500)) + "</osm>\n")
+    threads = threading.enumerate()
+    dbpath = str(tmp_path / "duplicate.db")
+    # the parser thread is blocked on the full queue when the insert fails
+    with pytest.raises(sqlite3.IntegrityError):
+        stream_load.load(path, dbpath, batch_size=1, queue_size=1, parser=parser)
+    assert threading.enumerate() == threads
+    conn = sqlite3.connect(dbpath)
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    assert conn.execute("SELECT count(*) FROM nodes").fetchone() == (0,)
+    conn.close()
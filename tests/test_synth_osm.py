@@ -0,0 +1,46 @@
+import filecmp
+import json
+import xml.etree.ElementTree as ET
+
+import benchmark
+import synth_osm
+from conftest import N_NODES, N_RELATIONS, N_WAYS
+
+
+def test_deterministic(osm_file, tmp_path):
+    same, other = str(tmp_path / "same.osm"), str(tmp_path / "other.osm")
+    synth_osm.generate(same, N_NODES, N_WAYS, N_RELATIONS, seed=1)
+    synth_osm.generate(other, N_NODES, N_WAYS, N_RELATIONS, seed=2)
+    assert filecmp.cmp(osm_file, same, shallow=False)
+    assert not filecmp.cmp(osm_file, other, shallow=False)
+
+
+def test_content(osm_file):
+    root = ET.parse(osm_file).getroot()
+    nodes = root.findall("node")
+    ways = root.findall("way")
+    assert (len(nodes), len(ways), len(root.findall("relation"))) == (N_NODES, N_WAYS, N_RELATIONS)
+    min_lat, min_lon, max_lat, max_lon = synth_osm.BBOX
+    assert all(min_lat <= float(n.attrib["lat"]) <= max_lat and min_lon <= float(n.attrib["lon"]) <= max_lon
+               for n in nodes)
+    node_ids = set(n.attrib["id"] for n in nodes)
+    assert all(nd.attrib["ref"] in node_ids for way in ways for nd in way.iterfind("nd"))
+    streets = [t.attrib["v"] for t in root.iter("tag") if t.attrib["k"] == "addr:street"]
+    dirty = [s for s in streets if s not in synth_osm.STREETS]
+    assert streets and 0 < len(dirty) < len(streets) / 2
+
+
+def test_benchmark(tmp_path):
+    results = benchmark.run([(500, 80)], str(tmp_path), log=lambda *args: None)
+    json.dumps(results)
+    (size,) = results["sizes"]
+    timings = size["timings"]
+    for stage in ("audit.all", "prepare_csv", "prepare_csv.validate", "load_database", "load_database.bulk"):
+        assert timings[stage] > 0
+    assert any(stage.startswith("query.") for stage in timings)
+    rows = benchmark.compare(results, results)
+    assert len(rows) == len(timings) and all(old == new for _, _, old, new in rows)
+
+
+def test_parse_size():
+    assert benchmark.parse_size("100000x15000") == (100000, 15000)
@@ -0,0 +1,37 @@
+import pytest
+
+import update_database
+from conftest import dump_db
+
+
+def test_same_as_rebuild(db_copy, change, changed_db):
+    path, _ = db_copy
+    assert dump_db(path)[1] != dump_db(changed_db)[1]
+    counts, changed = update_database.update(path, change[0], 1)
+    assert counts == {("create", "node"): 2, ("create", "way"): 1, ("modify", "node"): 20, ("modify", "way"): 2,
+                      ("delete", "node"): 2, ("delete", "way"): 2}
+    assert len(changed) == 29
+    assert dump_db(path)[1] == dump_db(changed_db)[1]
+
+
+def test_sequence(db_copy, change, tmp_path):
+    path, conn = db_copy
+    update_database.update(path, change[0], 7)
+    with pytest.raises(update_database.SequenceError):
+        update_database.update(path, change[0], 9)
+    # applying the same changes again gives the same database
+    update_database.update(path, change[0], 8)
+    state = tmp_path / "state.txt"
+    state.write_text("#Sun Oct 18 2026\nsequenceNumber=9\ntimestamp=2026-10-18T00\\:00\\:00Z\n")
+    update_database.update(path, change[0], update_database.read_state_file(str(state)))
+    assert conn.execute("SELECT sequence_number FROM replication_state ORDER BY 1;").fetchall() == [(7,), (8,), (9,)]
+
+
+def test_rollback_on_error(db_copy, tmp_path):
+    path, _ = db_copy
+    before = dump_db(path)[1]
+    osc = tmp_path / "broken.osc"
+    osc.write_text('<osmChange><delete><way id="1"/></delete><modify><node id="5" lat="x"')
+    with pytest.raises(update_database.ET.ParseError):
+        update_database.update(path, str(osc), 1)
+    assert dump_db(path)[1] == before
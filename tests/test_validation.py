@@ -0,0 +1,65 @@
+import copy
+
+import pytest
+
+import fastparse
+import prepare_csv
+import validation
+
+SCHEMA = {
+    'point': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer'},
+            'lat': {'required': True, 'type': 'float'},
+            'name': {'type': 'string'},
+        }
+    },
+}
+
+
+def messages(failures):
+    return sorted((f.record, f.index, f.field, f.message) for f in failures)
+
+
+@pytest.mark.parametrize("record, failures", [
+    ({'id': 1, 'lat': 54.5}, []),
+    ({'id': 1, 'lat': 54}, []),
+    ({'id': 1, 'lat': True}, [('point', None, 'lat', 'must be of float type')]),
+    ({'id': False, 'lat': 54.5}, [('point', None, 'id', 'must be of integer type')]),
+    ({'id': 1.0, 'lat': 54.5}, [('point', None, 'id', 'must be of integer type')]),
+    ({'lat': '54.5', 'name': 3}, [('point', None, 'id', 'required field'),
+                                  ('point', None, 'lat', 'must be of float type'),
+                                  ('point', None, 'name', 'must be of string type')]),
+    ({'id': 1, 'lat': 54.5, 'x': 1}, [('point', None, 'x', 'unknown field')]),
+])
+def test_types(record, failures):
+    validator = validation.Validator(SCHEMA)
+    assert messages(validator.validate({'point': record})) == failures
+
+
+def test_shaped_elements_valid(osm_file):
+    validator = validation.Validator()
+    for element in fastparse.iter_elements(osm_file):
+        if element.tag in ('node', 'way'):
+            assert validator.validate(prepare_csv.shape_record(element)) == []
+    assert validator.report.invalid == 0 and validator.report.elements > 0
+
+
+def test_invalid_element(osm_file):
+    element = next(fastparse.iter_elements(osm_file))
+    shaped = copy.deepcopy(prepare_csv.shape_record(element))
+    shaped['node']['lat'] = 'north'
+    shaped['node_tags'].append({'id': shaped['node']['id'], 'key': 'k', 'value': 'v'})
+    assert messages(validation.Validator().validate(shaped)) == [
+        ('node', None, 'lat', 'cannot be coerced by float'),
+        ('node_tags', len(shaped['node_tags']) - 1, 'type', 'required field')]
+
+
+def test_report_round_trip():
+    report = validation.ValidationReport()
+    report.add([validation.Failure('node', None, 'lat', 'must be of float type', True)])
+    report.add([])
+    copied = validation.ValidationReport.from_dict(report.to_dict())
+    assert copied.format() == report.format()
+    assert copied.examples == report.examples